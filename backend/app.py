@@ -14,7 +14,19 @@ from services.face_recognizer import FaceRecognizer
 from services.enrollment_manager import EnrollmentManager
 from services.analytics_tracker import AnalyticsTracker
 from services.video_processor import VideoProcessor
-from config.settings import HOST, PORT, DEBUG
+from services.frame_context import FrameContext
+from services.frame_codec import decode_image, frame_payload
+from services.session_log import (
+    list_sessions, load_session, record_to_event, iter_session_blocks
+)
+from services.export_stream import json_stream, csv_stream
+from services.worker_pool import PooledFaceDetector
+from services.encoding_dispatcher import EncodingDispatcher
+from services.metrics import MetricsRegistry
+from config.settings import (
+    HOST, PORT, DEBUG, WORKER_PROCESSES, ENROLLMENT_FEEDBACK_MODEL, ENROLLMENT_FEEDBACK_WIDTH,
+    ENCODING_BATCH_WINDOW_MS, MAX_PROFILES
+)
 
 # Inizializza Flask
 app = Flask(__name__)
@@ -23,11 +35,31 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet',
                     max_http_buffer_size=10 * 1024 * 1024)  # 10MB per frame
 
 # Inizializza servizi
-face_detector = FaceDetector()
+# Con WORKER_PROCESSES > 0 detection ed encoding girano in processi separati
+# e il loop eventlet resta libero durante il processing dei frame
+face_detector = PooledFaceDetector(WORKER_PROCESSES) if WORKER_PROCESSES > 0 else FaceDetector()
 face_recognizer = FaceRecognizer()
+# Encoding dei volti di tutti gli stream in micro-batch (finestra ENCODING_BATCH_WINDOW_MS)
+encoding_dispatcher = EncodingDispatcher(face_detector) if ENCODING_BATCH_WINDOW_MS > 0 else None
+# Detector leggero per il feedback di enrollment (non compete con il riconoscimento)
+feedback_detector = FaceDetector(ENROLLMENT_FEEDBACK_MODEL)
 enrollment_mgr = EnrollmentManager()
 analytics_tracker = AnalyticsTracker()
-video_processor = VideoProcessor(face_detector, face_recognizer, analytics_tracker)
+metrics = MetricsRegistry(encoding_dispatcher)  # Totali di processo (istogrammi, contatori, gauge)
+
+# Stato pipeline per connessione (FPS, timing, tracker, impostazioni),
+# indicizzato per socket sid. Detector, recognizer e gallery sono condivisi.
+video_processors = {}
+
+
+def get_video_processor(sid):
+    """Ritorna (creandolo se serve) il VideoProcessor dello stream sid."""
+    processor = video_processors.get(sid)
+    if processor is None:
+        processor = VideoProcessor(face_detector, face_recognizer, analytics_tracker,
+                                   encoder=encoding_dispatcher)
+        video_processors[sid] = processor
+    return processor
 
 # Carica profili esistenti nel recognizer
 face_recognizer.load_profiles(enrollment_mgr.get_full_profiles())
@@ -51,7 +83,7 @@ def get_profiles():
     """Lista profili enrollati."""
     return jsonify({
         'profiles': enrollment_mgr.get_profiles(),
-        'max_profiles': 4,
+        'max_profiles': MAX_PROFILES,
     })
 
 
@@ -65,7 +97,7 @@ def start_enrollment():
     if not name:
         return jsonify({'error': 'Nome richiesto'}), 400
 
-    result = enrollment_mgr.start_enrollment(name, color)
+    result = enrollment_mgr.start_enrollment(name, color, bool(data.get('auto_capture', False)))
     if 'error' in result:
         return jsonify(result), 400
 
@@ -74,10 +106,18 @@ def start_enrollment():
 
 @app.route('/api/enrollment/capture', methods=['POST'])
 def capture_enrollment():
-    """Cattura sample per enrollment."""
-    data = request.json
-    frame_data = data.get('frame', '')
-    step = data.get('step', 'front')
+    """
+    Cattura sample per enrollment.
+    Accetta JSON {frame: base64, step} oppure il JPEG/WebP grezzo nel body
+    (Content-Type image/* o application/octet-stream) con ?step=... in query.
+    """
+    if request.is_json:
+        data = request.json
+        frame_data = data.get('frame', '')
+        step = data.get('step', 'front')
+    else:
+        frame_data = request.get_data(cache=False)
+        step = request.args.get('step', 'front')
 
     if not frame_data:
         return jsonify({'error': 'Frame richiesto'}), 400
@@ -96,8 +136,8 @@ def complete_enrollment():
     if 'error' in result:
         return jsonify(result), 400
 
-    # Ricarica profili nel recognizer
-    face_recognizer.load_profiles(enrollment_mgr.get_full_profiles())
+    # Aggiunge solo il nuovo profilo alla gallery del recognizer
+    face_recognizer.add_profile(enrollment_mgr.get_full_profile(result['profile']['id']))
 
     return jsonify(result)
 
@@ -120,8 +160,8 @@ def delete_profile(profile_id):
     """Elimina profilo."""
     result = enrollment_mgr.delete_profile(profile_id)
 
-    # Ricarica profili nel recognizer
-    face_recognizer.load_profiles(enrollment_mgr.get_full_profiles())
+    # Rimuove solo il profilo eliminato dalla gallery del recognizer
+    face_recognizer.remove_profile(profile_id)
 
     return jsonify(result)
 
@@ -164,19 +204,84 @@ def challenge_scores():
     return jsonify(analytics_tracker.get_challenge_scores())
 
 
+@app.route('/api/analytics/sessions', methods=['GET'])
+def list_past_sessions():
+    """Sessioni persistite in SESSIONS_DIR."""
+    return jsonify({'sessions': list_sessions()})
+
+
+@app.route('/api/analytics/sessions/<session_id>', methods=['GET'])
+def past_session_events(session_id):
+    """Eventi di una sessione persistita (query: offset, limit)."""
+    loaded = load_session(session_id)
+    if loaded is None:
+        return jsonify({'error': 'Sessione non trovata'}), 404
+
+    records, names = loaded
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(0, request.args.get('limit', 1000, type=int))
+    return jsonify({
+        'session_id': session_id,
+        'total': len(records),
+        'offset': offset,
+        'events': [record_to_event(r, names) for r in records[offset:offset + limit]],
+    })
+
+
+def _export_source(fmt):
+    """
+    Generatore dell'export richiesto. Query: from/to (unix timestamp),
+    name, session (id di una sessione persistita; default: sessione live).
+    Ritorna None se la sessione richiesta non esiste.
+    """
+    start = request.args.get('from', type=float)
+    end = request.args.get('to', type=float)
+    name = request.args.get('name') or None
+    session_id = request.args.get('session')
+
+    if not session_id:
+        export = analytics_tracker.export_json if fmt == 'json' else analytics_tracker.export_csv
+        return export(start, end, name)
+
+    loaded = load_session(session_id)
+    if loaded is None:
+        return None
+    records, names = loaded
+    blocks = iter_session_blocks(records, names, start, end, name)
+    if fmt == 'json':
+        meta = next((m for m in list_sessions() if m['session_id'] == session_id), {})
+        return json_stream({'session': meta}, blocks)
+    return csv_stream(blocks)
+
+
+def _cooperative(chunks):
+    """Cede il loop eventlet tra un blocco e l'altro: l'export non blocca i frame video."""
+    for chunk in chunks:
+        yield chunk
+        socketio.sleep(0)
+
+
 @app.route('/api/analytics/export/json', methods=['GET'])
 def export_json():
-    """Export sessione JSON."""
-    data = analytics_tracker.export_json()
-    return jsonify(data)
+    """Export sessione JSON (streaming)."""
+    chunks = _export_source('json')
+    if chunks is None:
+        return jsonify({'error': 'Sessione non trovata'}), 404
+    return Response(
+        _cooperative(chunks),
+        mimetype='application/json',
+        headers={'Content-Disposition': 'attachment; filename=session.json'}
+    )
 
 
 @app.route('/api/analytics/export/csv', methods=['GET'])
 def export_csv():
-    """Export eventi CSV."""
-    csv_data = analytics_tracker.export_csv()
+    """Export eventi CSV (streaming)."""
+    chunks = _export_source('csv')
+    if chunks is None:
+        return jsonify({'error': 'Sessione non trovata'}), 404
     return Response(
-        csv_data,
+        _cooperative(chunks),
         mimetype='text/csv',
         headers={'Content-Disposition': 'attachment; filename=session_events.csv'}
     )
@@ -184,8 +289,31 @@ def export_csv():
 
 @app.route('/api/performance', methods=['GET'])
 def performance_stats():
-    """Stats performance per Tech showcase."""
-    return jsonify(video_processor.get_performance_stats())
+    """
+    Stats performance per Tech showcase.
+    Query sid: stream specifico, altrimenti lo stream attivo più di recente.
+    """
+    sid = request.args.get('sid')
+    processor = video_processors.get(sid) if sid else None
+    if processor is None and video_processors:
+        processor = max(video_processors.values(), key=lambda p: p.last_frame_time)
+    if processor is None:
+        processor = VideoProcessor(face_detector, face_recognizer, analytics_tracker)
+
+    stats = processor.get_performance_stats()
+    stats['streams'] = {
+        stream_sid: {'fps': p.fps, 'frame_count': p.frame_count, 'frames': dict(p.ingest_stats)}
+        for stream_sid, p in list(video_processors.items())
+    }
+    stats['totals'] = metrics.snapshot(list(video_processors.values()), face_recognizer)
+    return jsonify(stats)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Metriche in formato testo Prometheus (scrape endpoint)."""
+    body = metrics.render_prometheus(list(video_processors.values()), face_recognizer)
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 
 # ==========================================
@@ -195,58 +323,76 @@ def performance_stats():
 @socketio.on('connect')
 def handle_connect():
     print('[WS] Client connesso')
+    get_video_processor(request.sid)
     emit('connected', {'status': 'ok'})
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print('[WS] Client disconnesso')
+    processor = video_processors.pop(request.sid, None)
+    if processor:
+        processor.ingest.discard()
+        metrics.retire(processor)
+
+
+def _ingest_frame(item):
+    """
+    Passa il frame allo slot del client: se il client ha già un frame in
+    processing, questo sostituisce quello in attesa invece di accodarsi.
+    """
+    sid = request.sid
+    processor = get_video_processor(sid)
+    processor.ingest.run(item, lambda it: _process_stream_frame(sid, processor, *it),
+                         yield_fn=lambda: socketio.sleep(0))
+
+
+def _process_stream_frame(sid, processor, event, frame_data, challenge_type):
+    result = processor.process_frame(frame_data)
+    if not result:
+        return None
+    if event == 'challenge_result':
+        result['challenge'] = challenge_type
+    socketio.emit(event, result, to=sid)
+    return result
 
 
 @socketio.on('video_frame')
 def handle_video_frame(data):
-    """Riceve frame video, processa e ritorna risultati."""
-    frame_data = data.get('frame', '')
+    """Riceve frame video (binario o base64), processa e ritorna risultati."""
+    frame_data = frame_payload(data)
     if not frame_data:
         return
 
-    result = video_processor.process_frame(frame_data)
-    if result:
-        emit('frame_processed', result)
+    _ingest_frame(('frame_processed', frame_data, None))
 
 
 @socketio.on('update_settings')
 def handle_update_settings(data):
     """Aggiorna impostazioni processing."""
-    video_processor.update_settings(data)
+    get_video_processor(request.sid).update_settings(data)
     emit('settings_updated', {'status': 'ok', 'settings': data})
 
 
 @socketio.on('enrollment_frame')
 def handle_enrollment_frame(data):
     """Frame dedicato per enrollment con quality check."""
-    frame_data = data.get('frame', '')
+    frame_data = frame_payload(data)
     if not frame_data:
         return
 
     # Quick detection per quality feedback
-    import cv2
-    import numpy as np
-    import base64
-
     try:
-        raw = frame_data.split(',')[1] if ',' in frame_data else frame_data
-        img_bytes = base64.b64decode(raw)
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        frame = decode_image(frame_data)
 
         if frame is None:
             emit('enrollment_feedback', {'quality': {'is_good': False, 'message': 'Frame non valido'}})
             return
 
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        import face_recognition
-        locations = face_recognition.face_locations(rgb, model='hog')
+        # Detection sul frame ridotto a ENROLLMENT_FEEDBACK_WIDTH, box alla risoluzione originale
+        ctx = FrameContext(frame)
+        scale = min(1.0, ENROLLMENT_FEEDBACK_WIDTH / float(ctx.shape[1]))
+        locations = feedback_detector.detect_faces(ctx, scale=scale, upsample=0)
 
         if not locations:
             emit('enrollment_feedback', {
@@ -262,14 +408,24 @@ def handle_enrollment_frame(data):
             })
             return
 
-        quality = face_detector.check_quality(frame, locations[0])
+        quality = feedback_detector.check_quality(ctx, locations[0])
         top, right, bottom, left = locations[0]
-
-        emit('enrollment_feedback', {
+        feedback = {
             'quality': quality,
             'face_count': 1,
             'face_box': [left, top, right - left, bottom - top],
-        })
+        }
+
+        # Auto-capture: il server sceglie i sample migliori per posa da questo stream
+        enrollment = enrollment_mgr.current_enrollment
+        if quality['is_good'] and enrollment and enrollment['auto']:
+            landmarks = feedback_detector.get_face_landmarks(ctx, locations[:1])
+            angle = feedback_detector.estimate_face_angle(landmarks[0] if landmarks else None)
+            step = data.get('step') if isinstance(data, dict) else None
+            feedback['auto_capture'] = enrollment_mgr.offer_auto_frame(
+                frame, locations[0], quality, angle, step)
+
+        emit('enrollment_feedback', feedback)
     except Exception as e:
         emit('enrollment_feedback', {
             'quality': {'is_good': False, 'message': f'Errore: {str(e)}'},
@@ -279,16 +435,13 @@ def handle_enrollment_frame(data):
 @socketio.on('challenge_frame')
 def handle_challenge_frame(data):
     """Frame per challenge con metriche aggiuntive."""
-    frame_data = data.get('frame', '')
-    challenge_type = data.get('challenge', '')
+    frame_data = frame_payload(data)
+    challenge_type = data.get('challenge', '') if isinstance(data, dict) else ''
 
     if not frame_data:
         return
 
-    result = video_processor.process_frame(frame_data)
-    if result:
-        result['challenge'] = challenge_type
-        emit('challenge_result', result)
+    _ingest_frame(('challenge_result', frame_data, challenge_type))
 
 
 @socketio.on('save_challenge_score')
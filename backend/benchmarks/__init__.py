@@ -0,0 +1 @@
+"""Benchmark riproducibili (indice gallery e pipeline di riconoscimento)."""
@@ -0,0 +1,121 @@
+"""
+Benchmark recall vs latenza degli indici IVF e a prototipi rispetto alla ricerca esatta.
+
+Uso (dalla directory backend):
+    python -m benchmarks.ann_benchmark --identities 10000 --samples 5 --nprobe 1,2,4,8,16,32
+    python -m benchmarks.ann_benchmark --samples 15 --prototypes 3 --tolerance 0,0.05
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+from services.gallery_index import ExactIndex, IVFIndex, PrototypeIndex
+
+DIM = 128
+
+
+def make_gallery(identities, samples, seed=0):
+    """
+    Gallery sintetica: un centro per identità sulla sfera (come gli embedding
+    dlib, norma ~1) più rumore per sample. Le query sono nuovi sample rumorosi.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(identities, DIM)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = rng.normal(scale=0.03, size=(identities, samples, DIM)).astype(np.float32)
+    vectors = (centers[:, None, :] + noise).reshape(-1, DIM)
+    labels = np.repeat(np.arange(identities), samples)
+    return centers, vectors, labels
+
+
+def make_queries(centers, count, seed=1):
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(0, len(centers), count)
+    noise = rng.normal(scale=0.03, size=(count, DIM)).astype(np.float32)
+    return centers[ids] + noise
+
+
+def time_search(index, queries, **params):
+    """Latenza media per query (ms), cercando un volto alla volta come nel frame path."""
+    start = time.perf_counter()
+    labels = [index.search(q, k=1, **params)[1][0, 0] for q in queries]
+    elapsed = time.perf_counter() - start
+    return np.asarray(labels), elapsed * 1000 / len(queries)
+
+
+def run(identities, samples, queries_count, nprobes, nlist, prototypes=3, tolerances=()):
+    centers, vectors, labels = make_gallery(identities, samples)
+    queries = make_queries(centers, queries_count)
+
+    exact = ExactIndex(DIM)
+    exact.build(vectors, labels)
+    exact_labels, exact_ms = time_search(exact, queries)
+
+    ivf = IVFIndex(DIM, nlist=nlist)
+    t0 = time.perf_counter()
+    ivf.build(vectors, labels)
+    build_s = time.perf_counter() - t0
+
+    rows = [{'index': 'exact', 'nprobe': None, 'recall@1': 1.0, 'latency_ms': round(exact_ms, 3)}]
+    for nprobe in nprobes:
+        ivf_labels, ivf_ms = time_search(ivf, queries, nprobe=nprobe)
+        rows.append({
+            'index': 'ivf',
+            'nprobe': nprobe,
+            'recall@1': round(float(np.mean(ivf_labels == exact_labels)), 4),
+            'latency_ms': round(ivf_ms, 3),
+        })
+
+    for tolerance in tolerances:
+        proto = PrototypeIndex(DIM, prototypes=prototypes, tolerance=tolerance)
+        proto.build(vectors, labels)
+        proto_labels, proto_ms = time_search(proto, queries)
+        rows.append({
+            'index': 'proto',
+            'tolerance': tolerance,
+            'recall@1': round(float(np.mean(proto_labels == exact_labels)), 4),
+            'latency_ms': round(proto_ms, 3),
+        })
+
+    return {
+        'gallery_size': len(vectors),
+        'identities': identities,
+        'nlist': len(ivf.centroids),
+        'ivf_build_s': round(build_s, 2),
+        'results': rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--identities', type=int, default=10000)
+    parser.add_argument('--samples', type=int, default=5, help='Encoding per identità')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--nlist', type=int, default=0, help='Liste IVF (0 = ~sqrt(N))')
+    parser.add_argument('--nprobe', default='1,2,4,8,16,32')
+    parser.add_argument('--prototypes', type=int, default=3, help='Prototipi per identità')
+    parser.add_argument('--tolerance', default='', help='Tolleranze indice a prototipi (es. 0,0.05)')
+    parser.add_argument('--json', action='store_true', help='Output JSON invece della tabella')
+    args = parser.parse_args()
+
+    nprobes = [int(x) for x in args.nprobe.split(',') if x]
+    tolerances = [float(x) for x in args.tolerance.split(',') if x]
+    report = run(args.identities, args.samples, args.queries, nprobes, args.nlist,
+                 args.prototypes, tolerances)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Gallery: {report['gallery_size']} encoding, {report['identities']} identità, "
+          f"nlist={report['nlist']}, build IVF {report['ivf_build_s']}s")
+    print(f"{'index':<8}{'param':>8}{'recall@1':>12}{'ms/query':>12}")
+    for r in report['results']:
+        param = r.get('nprobe', r.get('tolerance'))
+        param = '-' if param is None else param
+        print(f"{r['index']:<8}{param:>8}{r['recall@1']:>12.4f}{r['latency_ms']:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
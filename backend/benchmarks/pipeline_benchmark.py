@@ -0,0 +1,305 @@
+"""
+Micro-benchmark riproducibile della pipeline di riconoscimento.
+
+Misura decode, preprocess, detection, encoding, qualità, recognition e i
+metodi di AnalyticsTracker su fixture sintetiche (seed fisso) al variare di
+dimensione frame, numero volti, dimensione gallery e modello di detection.
+Il report JSON ha un id stabile per caso, così due report di commit diversi
+si confrontano con --compare.
+
+Uso (dalla directory backend):
+    python -m benchmarks.pipeline_benchmark --output bench_HEAD.json
+    python -m benchmarks.pipeline_benchmark --compare bench_main.json --tolerance 0.15
+
+Con --face-image i frame contengono volti veri (il crop viene ripetuto in
+griglia); senza, detection e encoding girano su pixel sintetici: il costo
+HOG dipende dalla risoluzione, quello dell'encoding dal numero di box.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from benchmarks.ann_benchmark import make_gallery, make_queries
+from services.face_detector import FaceDetector
+from services.face_recognizer import FaceRecognizer
+from services.analytics_tracker import AnalyticsTracker
+from services.video_processor import VideoProcessor
+
+SEED = 0
+FRAME_SIZES = [(640, 480), (1280, 720), (1920, 1080)]
+FACE_COUNTS = [1, 2, 4, 8]
+GALLERY_SIZES = [10, 100, 1000, 10000]  # Identità (5 sample ciascuna)
+EVENT_COUNTS = [1000, 10000, 100000]
+
+
+# ==========================================
+# Fixture sintetiche
+# ==========================================
+
+def make_frame(width, height, seed=SEED):
+    """Frame BGR deterministico: gradiente + rumore (comprime come un'immagine reale)."""
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width]
+    base = (xs * 255 // max(1, width - 1) + ys * 255 // max(1, height - 1)) // 2
+    frame = np.repeat(base[:, :, None], 3, axis=2).astype(np.int16)
+    frame += rng.integers(-20, 20, size=frame.shape, dtype=np.int16)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def grid_boxes(width, height, count, size=120):
+    """count box (top, right, bottom, left) disposti in griglia nel frame."""
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / cols))
+    size = min(size, width // cols, height // rows)
+    boxes = []
+    for i in range(count):
+        r, c = divmod(i, cols)
+        top = r * (height // rows) + (height // rows - size) // 2
+        left = c * (width // cols) + (width // cols - size) // 2
+        boxes.append((top, left + size, top + size, left))
+    return boxes
+
+
+def paste_faces(frame, face_image, boxes):
+    """Copia il crop del volto in ogni box (fixture con volti reali)."""
+    frame = frame.copy()
+    for top, right, bottom, left in boxes:
+        frame[top:bottom, left:right] = cv2.resize(face_image, (right - left, bottom - top))
+    return frame
+
+
+def make_profiles(identities, samples=5):
+    centers, vectors, labels = make_gallery(identities, samples, seed=SEED)
+    profiles = [{
+        'id': f'p{i}', 'name': f'Profilo {i}', 'color': '#00d9ff',
+        'encodings': vectors[labels == i],
+    } for i in range(identities)]
+    return centers, profiles
+
+
+def fake_faces(count, rng):
+    return [{
+        'name': f'Profilo {int(rng.integers(0, 4))}',
+        'confidence': float(rng.uniform(0.4, 1.0)),
+        'box': [int(rng.integers(0, 500)), int(rng.integers(0, 350)), 120, 120],
+    } for _ in range(count)]
+
+
+# ==========================================
+# Misura
+# ==========================================
+
+def measure(fn, repeat, warmup=2):
+    """Esegue fn warmup + repeat volte; statistiche in ms sulle ripetizioni."""
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - t0
+    samples *= 1000
+    return {
+        'n': repeat,
+        'median_ms': round(float(np.median(samples)), 4),
+        'mean_ms': round(float(samples.mean()), 4),
+        'p95_ms': round(float(np.percentile(samples, 95)), 4),
+        'min_ms': round(float(samples.min()), 4),
+    }
+
+
+def case_id(name, params):
+    return name + '[' + ','.join(f'{k}={v}' for k, v in sorted(params.items())) + ']'
+
+
+class Suite:
+    def __init__(self, repeat, index_file, face_image=None, models=('hog',)):
+        self.repeat = repeat
+        self.face_image = face_image
+        self.models = models
+        self.results = []
+        self.detector = FaceDetector()
+        # Indice su un file temporaneo: non sovrascrive INDEX_FILE della gallery reale
+        self.recognizer = FaceRecognizer(index_file=index_file)
+        self.processor = VideoProcessor(self.detector, self.recognizer,
+                                        AnalyticsTracker(persist=False), qos_enabled=False)
+
+    def add(self, name, params, fn, repeat=None):
+        stats = measure(fn, repeat or self.repeat)
+        self.results.append({'id': case_id(name, params), 'name': name, 'params': params, **stats})
+        sys.stderr.write(f"  {self.results[-1]['id']:<60}{stats['median_ms']:>12.3f} ms\n")
+
+    def frame(self, width, height, faces=0):
+        frame = make_frame(width, height)
+        boxes = grid_boxes(width, height, faces) if faces else []
+        if self.face_image is not None and boxes:
+            frame = paste_faces(frame, self.face_image, boxes)
+        return frame, boxes
+
+    def bench_frames(self, sizes):
+        for width, height in sizes:
+            params = {'size': f'{width}x{height}'}
+            frame, _ = self.frame(width, height, faces=1)
+            jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+            self.add('decode_frame', params, lambda: self.processor._decode_frame(jpeg))
+            self.add('preprocess', params, lambda: self.processor._preprocess(frame))
+
+            small = self.processor._preprocess(frame)
+            default_model = self.detector.model
+            try:
+                for model in self.models:
+                    self.detector.model = model
+                    self.add('detect_faces', {**params, 'model': model},
+                             lambda: self.detector.detect_faces(small),
+                             repeat=max(3, self.repeat // 5))
+            finally:
+                self.detector.model = default_model  # I casi successivi usano il modello di default
+
+    def bench_faces(self, counts):
+        for faces in counts:
+            frame, boxes = self.frame(640, 480, faces)
+            params = {'faces': faces}
+            self.add('get_face_encodings', params,
+                     lambda: self.detector.get_face_encodings(frame, boxes),
+                     repeat=max(3, self.repeat // 5))
+            self.add('check_quality', params,
+                     lambda: [self.detector.check_quality(frame, box) for box in boxes])
+
+    def bench_recognition(self, gallery_sizes, counts):
+        for identities in gallery_sizes:
+            centers, profiles = make_profiles(identities)
+            self.recognizer.load_profiles(profiles)
+            for faces in counts:
+                queries = make_queries(centers, faces, seed=SEED + 1)
+                boxes = grid_boxes(640, 480, faces)
+                params = {'gallery': identities, 'faces': faces}
+                self.add('recognize_faces', params,
+                         lambda: self.recognizer.recognize_faces(queries, boxes))
+                self.add('get_confusion_data', params,
+                         lambda: self.recognizer.get_confusion_data(queries, boxes))
+
+    def bench_analytics(self, event_counts):
+        rng = np.random.default_rng(SEED)
+        faces = fake_faces(4, rng)
+        for events in event_counts:
+            tracker = AnalyticsTracker(persist=False)
+            for _ in range(events // len(faces)):
+                tracker.track_detection(fake_faces(len(faces), rng), 15.0, 40.0)
+            params = {'events': events}
+            self.add('track_detection', params, lambda: tracker.track_detection(faces, 15.0, 40.0))
+            self.add('get_session_stats', params, tracker.get_session_stats)
+            self.add('get_timeline_data', params, tracker.get_timeline_data)
+            self.add('get_confidence_distribution', params, tracker.get_confidence_distribution)
+            self.add('get_heatmap_data', params, tracker.get_heatmap_data)
+            self.add('get_recent_events', params, tracker.get_recent_events)
+            self.add('export_csv', params, lambda: sum(len(c) for c in tracker.export_csv()),
+                     repeat=max(3, self.repeat // 5))
+
+
+def environment():
+    """Metadati per rendere confrontabili i report."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': SEED,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Casi con mediana peggiorata oltre tolerance rispetto al baseline."""
+    base = {r['id']: r for r in baseline['results']}
+    regressions = []
+    for r in report['results']:
+        b = base.get(r['id'])
+        if b is None or b['median_ms'] <= 0:
+            continue
+        ratio = r['median_ms'] / b['median_ms']
+        if ratio > 1.0 + tolerance:
+            regressions.append({'id': r['id'], 'baseline_ms': b['median_ms'],
+                                'current_ms': r['median_ms'], 'ratio': round(ratio, 3)})
+    return regressions
+
+
+def run(repeat=30, quick=False, face_image=None, models=('hog',)):
+    sizes = FRAME_SIZES[:1] if quick else FRAME_SIZES
+    counts = FACE_COUNTS[:2] if quick else FACE_COUNTS
+    galleries = GALLERY_SIZES[:2] if quick else GALLERY_SIZES
+    events = EVENT_COUNTS[:1] if quick else EVENT_COUNTS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        suite = Suite(repeat, os.path.join(tmp, 'gallery_index.npz'), face_image, models)
+        sys.stderr.write('[Bench] frame\n')
+        suite.bench_frames(sizes)
+        sys.stderr.write('[Bench] volti\n')
+        suite.bench_faces(counts)
+        sys.stderr.write('[Bench] recognition\n')
+        suite.bench_recognition(galleries, [1, 4])
+        sys.stderr.write('[Bench] analytics\n')
+        suite.bench_analytics(events)
+
+    return {
+        'environment': environment(),
+        'config': {'repeat': repeat, 'quick': quick, 'models': list(models),
+                   'face_image': face_image is not None},
+        'results': suite.results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=30, help='Ripetizioni per caso')
+    parser.add_argument('--quick', action='store_true', help='Solo le taglie più piccole')
+    parser.add_argument('--models', default='hog', help="Modelli di detection (es. 'hog,cnn')")
+    parser.add_argument('--face-image', default=None, help='Crop di un volto per fixture realistiche')
+    parser.add_argument('--output', default=None, help='Scrive il report JSON su file')
+    parser.add_argument('--compare', default=None, help='Report baseline da confrontare')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Peggioramento relativo della mediana tollerato (0.15 = +15%%)')
+    args = parser.parse_args()
+
+    face_image = None
+    if args.face_image:
+        face_image = cv2.imread(args.face_image)
+        if face_image is None:
+            parser.error(f'Immagine non leggibile: {args.face_image}')
+
+    models = tuple(m for m in args.models.split(',') if m)
+    report = run(args.repeat, args.quick, face_image, models)
+
+    if args.compare:
+        with open(args.compare) as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    for r in report.get('regressions', []):
+        sys.stderr.write(f"[Bench] REGRESSIONE {r['id']}: {r['baseline_ms']} → "
+                         f"{r['current_ms']} ms (x{r['ratio']})\n")
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,18 +8,50 @@ MODELS_DIR = os.path.join(BASE_DIR, 'models')
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 ENROLLED_FACES_DIR = os.path.join(DATA_DIR, 'enrolled_faces')
 SESSIONS_DIR = os.path.join(DATA_DIR, 'sessions')
-ENCODINGS_FILE = os.path.join(MODELS_DIR, 'face_encodings.pkl')
+ENCODINGS_FILE = os.path.join(MODELS_DIR, 'face_encodings.pkl')  # Formato legacy (solo migrazione)
+GALLERY_META_FILE = os.path.join(MODELS_DIR, 'gallery.meta.json')
+INDEX_FILE = os.path.join(MODELS_DIR, 'gallery_index.npz')
 
 # Crea directory se non esistono
 for d in [MODELS_DIR, DATA_DIR, ENROLLED_FACES_DIR, SESSIONS_DIR]:
     os.makedirs(d, exist_ok=True)
 
 # Face Detection
-MAX_PROFILES = 4
+MAX_PROFILES = 4  # Profili massimi con l'enrollment da webcam
+BULK_MAX_PROFILES = 0  # Profili massimi in gallery per tools.bulk_enroll (0 = nessun limite)
 FRAME_RESIZE_WIDTH = 640
-DETECTION_MODEL = 'hog'  # 'hog' (veloce) o 'cnn' (accurato)
+DETECTION_MODEL = 'hog'  # 'hog' (veloce), 'cnn' (accurato), 'haar' o 'dnn' (OpenCV)
 DEFAULT_THRESHOLD = 0.6  # Distanza massima per match (più basso = più strict)
 MIN_FACE_SIZE = 40  # Pixel minimi per lato bounding box
+# Detection su frame ridotto: 'auto' = fattore derivato da MIN_FACE_SIZE
+# (il più piccolo che trova ancora volti di MIN_FACE_SIZE px), oppure float 0-1
+DETECTION_SCALE = 'auto'
+DETECTION_UPSAMPLE = 1  # Upsample del detector (1 = default face_recognition)
+# Backend OpenCV DNN (SSD ResNet-10): file del modello da scaricare in MODELS_DIR
+DNN_PROTOTXT = os.path.join(MODELS_DIR, 'deploy.prototxt')
+DNN_MODEL = os.path.join(MODELS_DIR, 'res10_300x300_ssd_iter_140000.caffemodel')
+DNN_CONFIDENCE = 0.6  # Confidenza minima di una detection DNN
+
+# Gallery index
+INDEX_TYPE = 'exact'  # 'exact' (esaustivo), 'ivf' (approssimato, gallery grandi) o 'prototype' (due stadi)
+IVF_NLIST = 0  # Numero liste IVF (0 = automatico ~sqrt(N))
+IVF_NPROBE = 8  # Liste visitate per query (più alto = recall migliore, più lento)
+PROTOTYPES_PER_PROFILE = 3  # Prototipi (k-medoids dei campioni) per profilo nello screening
+PROTOTYPE_RERANK = 3  # Profili ri-valutati sui campioni completi dopo lo screening
+PROTOTYPE_TOLERANCE = 0.0  # Scarto di distanza ammesso rispetto all'esatto (0 = risultati identici)
+GALLERY_DTYPE = 'float32'  # Gallery in memoria: 'float32', 'float16' (2x, ricerca più lenta in NumPy) o 'int8' (4x); solo con INDEX_TYPE 'exact'
+QUANT_RERANK = 16  # Righe della shortlist quantizzata ri-valutate in float32 esatto
+QUANT_CHUNK_ROWS = 1024  # Righe convertite per blocco durante la ricerca (buffer da 512 KB, resta in cache)
+QUANT_RETRAIN_SATURATION = 0.01  # Frazione di valori int8 saturati oltre cui ricalibrare la scala
+GALLERY_COMPACT_RATIO = 0.5  # Compatta la matrice quando le righe eliminate superano questa frazione
+GALLERY_JOURNAL_MAX = 1000  # Modifiche nel journal oltre cui vengono incorporate in un nuovo checkpoint
+
+# Face Tracking (riuso identità tra frame)
+TRACK_IOU_THRESHOLD = 0.3  # IoU minima per associare detection e track
+TRACK_REENCODE_INTERVAL = 10  # Ri-encoda un volto tracciato ogni N frame
+TRACK_MIN_CONFIDENCE = 0.5  # Sotto questa IoU il track è incerto → ri-encoda
+TRACK_MAX_MISSES = 5  # Frame senza detection prima di eliminare il track
+TRACK_PREDICTION_DECAY = 0.8  # Fattore sulla confidenza per ogni frame con solo box previsto (detection saltata)
 
 # Enrollment
 ENROLLMENT_SAMPLES = {
@@ -30,6 +62,10 @@ ENROLLMENT_SAMPLES = {
     'down': 3,
 }
 TOTAL_ENROLLMENT_SAMPLES = sum(ENROLLMENT_SAMPLES.values())  # 21
+ENROLLMENT_FEEDBACK_MODEL = 'haar'  # Backend per il feedback live (il più economico)
+ENROLLMENT_FEEDBACK_WIDTH = 320  # Larghezza del frame su cui gira la detection di feedback
+AUTO_CAPTURE_MIN_INTERVAL = 0.15  # Secondi minimi tra due candidati dello stesso step
+AUTO_CAPTURE_PITCH_DELTA = 0.06  # Scarto di pitch dalla posa frontale per 'up'/'down'
 
 # Quality Checks
 MIN_BRIGHTNESS = 40
@@ -40,7 +76,23 @@ BLUR_THRESHOLD = 50.0  # Soglia Laplacian variance
 
 # Performance
 TARGET_FPS = 15
-FRAME_SKIP = 2  # Processa 1 frame ogni N ricevuti
+LATENCY_BUDGET_MS = 0  # Budget processing per frame (0 = 1000 / TARGET_FPS)
+QOS_ENABLED = True  # Degrada automaticamente la pipeline per tenere TARGET_FPS
+QOS_COOLDOWN_FRAMES = 15  # Frame minimi tra due cambi di livello
+FRAME_SKIP = 1  # Processa 1 frame ogni N ricevuti (oltre al drop dei frame vecchi)
+WORKER_PROCESSES = 0  # Processi per detection/encoding (0 = nel processo del server)
+ENCODING_BATCH_WINDOW_MS = 5  # Attesa massima per raccogliere volti da più stream in un batch (0 = encoding per frame)
+ENCODING_BATCH_MAX = 32  # Volti massimi per batch di encoding
+ENCODING_STREAM_IDLE = 1.0  # Secondi senza richieste dopo cui uno stream non è più atteso nel batch
+
+# Analytics (serie a capacità fissa)
+ANALYTICS_WINDOW_SECONDS = 600  # Finestra dati live (10 minuti)
+ANALYTICS_MAX_FRAMES = 30000  # Campioni fps/latency in memoria
+ANALYTICS_MAX_EVENTS = 100000  # Eventi detection in memoria
+HEATMAP_MAX_POSITIONS = 500  # Posizioni usate per la heatmap
+SESSION_LOG_ENABLED = True  # Log eventi persistente in SESSIONS_DIR
+SESSION_FLUSH_INTERVAL = 1.0  # Secondi tra due scritture batch del log
+EXPORT_CHUNK_SIZE = 2000  # Eventi per blocco negli export in streaming
 
 # Server
 HOST = '0.0.0.0'
@@ -1,37 +1,142 @@
 """Tracker analytics - registra eventi detection e calcola statistiche."""
 
 import time
-import json
-import os
-import csv
-import io
-from collections import defaultdict
-from config.settings import SESSIONS_DIR
+import uuid
+from collections import defaultdict, deque
+import numpy as np
+from services.ring_buffer import RingBuffer
+from services.session_log import SessionLog
+from services.export_stream import iter_chunks, json_stream, csv_stream
+from config.settings import (
+    ANALYTICS_WINDOW_SECONDS, ANALYTICS_MAX_FRAMES,
+    ANALYTICS_MAX_EVENTS, HEATMAP_MAX_POSITIONS, SESSION_LOG_ENABLED
+)
 
 
-class AnalyticsTracker:
+# Dtype dei record (array strutturati NumPy, memoria fissa per capacità)
+FRAME_DTYPE = np.dtype([('time', 'f8'), ('fps', 'f8'), ('latency', 'f8')])
+EVENT_DTYPE = np.dtype([
+    ('timestamp', 'f8'), ('name', 'O'), ('confidence', 'f8'),
+    ('box_x', 'i4'), ('box_y', 'i4'), ('box_w', 'i4'), ('box_h', 'i4'),
+])
+POSITION_DTYPE = np.dtype([('x', 'f8'), ('y', 'f8'), ('name', 'O')])
+
+
+def _event_dict(record):
+    return {
+        'timestamp': float(record['timestamp']),
+        'name': record['name'],
+        'confidence': round(float(record['confidence']), 3),
+        'box': [int(record['box_x']), int(record['box_y']),
+                int(record['box_w']), int(record['box_h'])],
+    }
+
+
+TIMELINE_BUCKET = 10  # Secondi per barra della timeline
+CONFIDENCE_BINS = 20  # Bin da 5% per l'istogramma
+HEATMAP_GRID = 10  # Griglia heatmap 10x10
+
+
+def _confidence_bins(confidences):
+    return np.minimum((np.asarray(confidences) / 0.05).astype(np.int64), CONFIDENCE_BINS - 1)
+
+
+def _heatmap_cells(x, y):
+    gx = np.minimum((np.asarray(x) * HEATMAP_GRID).astype(np.int64), HEATMAP_GRID - 1)
+    gy = np.minimum((np.asarray(y) * HEATMAP_GRID).astype(np.int64), HEATMAP_GRID - 1)
+    return gy, gx
+
+
+class _SlidingExtremes:
+    """
+    Min/max su una finestra FIFO con deque monotone: append ed eviction
+    O(1) ammortizzati, lettura O(1).
+    """
+
     def __init__(self):
-        self.session_id = f"session_{int(time.time())}"
-        self.events = []
-        self.fps_history = []
-        self.latency_history = []
+        self._mins = deque()  # (seq, value) con valori crescenti
+        self._maxs = deque()  # (seq, value) con valori decrescenti
+        self._next_seq = 0
+        self._first_seq = 0
+
+    def append(self, value):
+        seq = self._next_seq
+        self._next_seq += 1
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        self._mins.append((seq, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        self._maxs.append((seq, value))
+
+    def evict(self, count):
+        """Rimuove i count valori più vecchi."""
+        self._first_seq += count
+        while self._mins and self._mins[0][0] < self._first_seq:
+            self._mins.popleft()
+        while self._maxs and self._maxs[0][0] < self._first_seq:
+            self._maxs.popleft()
+
+    @property
+    def min(self):
+        return self._mins[0][1] if self._mins else 0
+
+    @property
+    def max(self):
+        return self._maxs[0][1] if self._maxs else 0
+
+
+def _new_session_id():
+    """Id univoco anche per reset nello stesso secondo (ms + suffisso casuale)."""
+    return f"session_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
+
+
+class AnalyticsTracker:
+    def __init__(self, persist=SESSION_LOG_ENABLED):
+        self.persist = persist  # False: nessun log su disco (es. processing offline)
+        self.session_id = _new_session_id()
+        # Serie a capacità fissa: append O(1), eviction a finestra O(k)
+        self.frames = RingBuffer(FRAME_DTYPE, ANALYTICS_MAX_FRAMES)  # fps + latency
+        self.events = RingBuffer(EVENT_DTYPE, ANALYTICS_MAX_EVENTS,  # Anche confidence scores
+                                 on_evict=self._on_events_evicted)
+        self.face_positions = RingBuffer(POSITION_DTYPE, HEATMAP_MAX_POSITIONS,  # Per heatmap
+                                         on_evict=self._on_positions_evicted)
         self.detection_counts = defaultdict(int)
-        self.confidence_scores = []
-        self.face_positions = []  # Per heatmap
         self.session_start = time.time()
         self.challenge_scores = {}
 
+        # Log persistente della sessione (scritto a batch in background)
+        self.session_log = SessionLog(self.session_id, self.session_start) \
+            if persist else None
+
+        # Aggregati mantenuti incrementalmente (decrementati alla scadenza degli eventi)
+        self.timeline_buckets = defaultdict(lambda: defaultdict(int))
+        self.confidence_hist = np.zeros(CONFIDENCE_BINS, dtype=np.int64)
+        self.confidence_sum = 0.0
+        self.confidence_extremes = _SlidingExtremes()
+        self.heatmap = np.zeros((HEATMAP_GRID, HEATMAP_GRID), dtype=np.int64)
+
+    def _on_events_evicted(self, records):
+        for ts, name in zip(records['timestamp'], records['name']):
+            bucket = int(ts / TIMELINE_BUCKET) * TIMELINE_BUCKET
+            counts = self.timeline_buckets[bucket]
+            counts[name] -= 1
+            if counts[name] <= 0:
+                del counts[name]
+                if not counts:
+                    del self.timeline_buckets[bucket]
+        np.subtract.at(self.confidence_hist, _confidence_bins(records['confidence']), 1)
+        self.confidence_sum -= float(records['confidence'].sum())
+        self.confidence_extremes.evict(len(records))
+
+    def _on_positions_evicted(self, records):
+        np.subtract.at(self.heatmap, _heatmap_cells(records['x'], records['y']), 1)
+
     def track_detection(self, faces, fps, latency_ms):
         """Registra evento di detection."""
         timestamp = time.time()
 
-        self.fps_history.append({'time': timestamp, 'fps': fps})
-        self.latency_history.append({'time': timestamp, 'latency': latency_ms})
-
-        # Mantieni solo ultimi 10 minuti di dati
-        cutoff = timestamp - 600
-        self.fps_history = [x for x in self.fps_history if x['time'] > cutoff]
-        self.latency_history = [x for x in self.latency_history if x['time'] > cutoff]
+        self.frames.append((timestamp, fps, latency_ms))
 
         for face in faces:
             name = face.get('name', 'Unknown')
@@ -39,28 +144,31 @@ class AnalyticsTracker:
             box = face.get('box', [0, 0, 0, 0])
 
             self.detection_counts[name] += 1
-            self.confidence_scores.append({
-                'time': timestamp,
-                'name': name,
-                'confidence': confidence,
-            })
 
             # Posizione per heatmap (centro del box normalizzato 0-1)
             if box[2] > 0 and box[3] > 0:
                 cx = (box[0] + box[2] / 2) / 640  # Normalizzato su 640px
                 cy = (box[1] + box[3] / 2) / 480
-                self.face_positions.append({'x': cx, 'y': cy, 'name': name})
+                self.face_positions.append((cx, cy, name))
+                gx = min(int(cx * HEATMAP_GRID), HEATMAP_GRID - 1)
+                gy = min(int(cy * HEATMAP_GRID), HEATMAP_GRID - 1)
+                self.heatmap[gy, gx] += 1
 
-            self.events.append({
-                'timestamp': timestamp,
-                'name': name,
-                'confidence': confidence,
-                'box': box,
-            })
+            self.events.append((timestamp, name, confidence, box[0], box[1], box[2], box[3]))
+            if self.session_log:
+                self.session_log.append(timestamp, name, confidence, box)
+            bucket = int(timestamp / TIMELINE_BUCKET) * TIMELINE_BUCKET
+            self.timeline_buckets[bucket][name] += 1
+            self.confidence_hist[min(int(confidence / 0.05), CONFIDENCE_BINS - 1)] += 1
+            self.confidence_sum += confidence
+            self.confidence_extremes.append(confidence)
 
-        # Limita eventi a ultimi 10 minuti
-        self.events = [e for e in self.events if e['timestamp'] > cutoff]
-        self.confidence_scores = [c for c in self.confidence_scores if c['time'] > cutoff]
+        # Mantieni solo ultimi 10 minuti di dati
+        cutoff = timestamp - ANALYTICS_WINDOW_SECONDS
+        self.frames.evict_older('time', cutoff)
+        self.events.evict_older('timestamp', cutoff)
+        if not len(self.events):
+            self.confidence_sum = 0.0  # Azzera l'errore di arrotondamento accumulato
 
     def get_session_stats(self):
         """Ritorna statistiche sessione corrente."""
@@ -68,20 +176,20 @@ class AnalyticsTracker:
         duration = now - self.session_start
 
         # FPS stats
-        fps_values = [x['fps'] for x in self.fps_history[-100:]]
-        fps_avg = sum(fps_values) / len(fps_values) if fps_values else 0
-        fps_min = min(fps_values) if fps_values else 0
-        fps_max = max(fps_values) if fps_values else 0
+        fps_values = self.frames.column('fps', last=100)
+        fps_avg = float(fps_values.mean()) if len(fps_values) else 0
+        fps_min = float(fps_values.min()) if len(fps_values) else 0
+        fps_max = float(fps_values.max()) if len(fps_values) else 0
 
         # Latency stats
-        lat_values = [x['latency'] for x in self.latency_history[-100:]]
-        lat_avg = sum(lat_values) / len(lat_values) if lat_values else 0
+        lat_values = self.frames.column('latency', last=100)
+        lat_avg = float(lat_values.mean()) if len(lat_values) else 0
 
-        # Confidence stats
-        conf_values = [c['confidence'] for c in self.confidence_scores]
-        conf_avg = sum(conf_values) / len(conf_values) if conf_values else 0
-        conf_min = min(conf_values) if conf_values else 0
-        conf_max = max(conf_values) if conf_values else 0
+        # Confidence stats (aggregati incrementali)
+        count = len(self.events)
+        conf_avg = self.confidence_sum / count if count else 0
+        conf_min = float(self.confidence_extremes.min)
+        conf_max = float(self.confidence_extremes.max)
 
         return {
             'session_id': self.session_id,
@@ -90,7 +198,7 @@ class AnalyticsTracker:
             'unique_faces': len(self.detection_counts),
             'detection_counts': dict(self.detection_counts),
             'fps': {
-                'current': fps_values[-1] if fps_values else 0,
+                'current': round(float(fps_values[-1]), 1) if len(fps_values) else 0,
                 'avg': round(fps_avg, 1),
                 'min': round(fps_min, 1),
                 'max': round(fps_max, 1),
@@ -108,13 +216,20 @@ class AnalyticsTracker:
     def get_timeline_data(self, last_seconds=600):
         """Dati per timeline chart (ultimi N secondi)."""
         cutoff = time.time() - last_seconds
-        recent = [e for e in self.events if e['timestamp'] > cutoff]
 
-        # Raggruppa per intervalli di 10 secondi
-        buckets = defaultdict(lambda: defaultdict(int))
-        for event in recent:
-            bucket = int(event['timestamp'] / 10) * 10
-            buckets[bucket][event['name']] += 1
+        # I bucket interamente dopo il cutoff si leggono dagli aggregati;
+        # solo il bucket a cavallo del cutoff viene ricontato sugli eventi
+        boundary = int(cutoff / TIMELINE_BUCKET) * TIMELINE_BUCKET
+        buckets = {ts: counts for ts, counts in self.timeline_buckets.items()
+                   if ts > boundary and counts}
+        if boundary in self.timeline_buckets:
+            edge = self.events.view_since('timestamp', cutoff)
+            edge = edge[edge['timestamp'] < boundary + TIMELINE_BUCKET]
+            if len(edge):
+                counts = defaultdict(int)
+                for name in edge['name']:
+                    counts[name] += 1
+                buckets[boundary] = counts
 
         timeline = []
         for ts in sorted(buckets.keys()):
@@ -126,37 +241,21 @@ class AnalyticsTracker:
 
     def get_confidence_distribution(self):
         """Distribuzione confidence scores per istogramma."""
-        if not self.confidence_scores:
+        if not len(self.events):
             return []
 
-        # Crea bins da 0 a 1 con step 0.05
-        bins = {}
-        for i in range(20):
-            lower = i * 0.05
-            upper = (i + 1) * 0.05
-            label = f"{int(lower*100)}-{int(upper*100)}%"
-            bins[label] = 0
-
-        for score in self.confidence_scores:
-            idx = min(int(score['confidence'] / 0.05), 19)
-            label = f"{idx*5}-{(idx+1)*5}%"
-            bins[label] = bins.get(label, 0) + 1
-
-        return [{'range': k, 'count': v} for k, v in bins.items()]
+        # Bins da 0 a 1 con step 0.05, contati incrementalmente
+        return [{'range': f"{i*5}-{(i+1)*5}%", 'count': int(count)}
+                for i, count in enumerate(self.confidence_hist)]
 
     def get_heatmap_data(self):
         """Dati posizioni per heatmap."""
-        # Griglia 10x10
-        grid = [[0] * 10 for _ in range(10)]
-        for pos in self.face_positions[-500:]:
-            gx = min(int(pos['x'] * 10), 9)
-            gy = min(int(pos['y'] * 10), 9)
-            grid[gy][gx] += 1
-        return grid
+        # Griglia 10x10 sulle ultime HEATMAP_MAX_POSITIONS posizioni
+        return self.heatmap.tolist()
 
     def get_recent_events(self, limit=50):
         """Ultimi eventi per tabella storia."""
-        return sorted(self.events[-limit:], key=lambda x: x['timestamp'], reverse=True)
+        return [_event_dict(r) for r in self.events.view(limit)[::-1]]
 
     def record_challenge_score(self, challenge_name, score, details=None):
         """Registra punteggio challenge."""
@@ -171,31 +270,28 @@ class AnalyticsTracker:
         """Ritorna punteggi challenge."""
         return self.challenge_scores
 
-    def export_json(self):
-        """Export dati sessione in JSON."""
-        return {
+    def _export_blocks(self, start=None, end=None, name=None):
+        """Blocchi di eventi live filtrati (snapshot limitato da ANALYTICS_MAX_EVENTS)."""
+        name_mask = (lambda chunk: chunk['name'] == name) if name else None
+        for chunk in iter_chunks(self.events.view(), start, end, name_mask):
+            yield [_event_dict(r) for r in chunk]
+
+    def export_json(self, start=None, end=None, name=None):
+        """Export dati sessione in JSON, generato in streaming a blocchi."""
+        header = {
             'session': self.get_session_stats(),
-            'events': self.events[-1000:],
             'timeline': self.get_timeline_data(),
             'confidence_distribution': self.get_confidence_distribution(),
             'challenge_scores': self.challenge_scores,
         }
+        return json_stream(header, self._export_blocks(start, end, name))
 
-    def export_csv(self):
-        """Export eventi in formato CSV."""
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['timestamp', 'name', 'confidence', 'box_x', 'box_y', 'box_w', 'box_h'])
-        for event in self.events:
-            box = event.get('box', [0, 0, 0, 0])
-            writer.writerow([
-                event['timestamp'],
-                event['name'],
-                event['confidence'],
-                box[0], box[1], box[2], box[3],
-            ])
-        return output.getvalue()
+    def export_csv(self, start=None, end=None, name=None):
+        """Export eventi in formato CSV, generato in streaming a blocchi."""
+        return csv_stream(self._export_blocks(start, end, name))
 
     def reset_session(self):
         """Reset sessione corrente."""
-        self.__init__()
+        if self.session_log:
+            self.session_log.close()
+        self.__init__(self.persist)
@@ -0,0 +1,29 @@
+"""Scritture atomiche su file - temporaneo univoco nella stessa directory, fsync e rename."""
+
+import json
+import os
+import tempfile
+
+
+def write_atomic(path, data, mode='w'):
+    """
+    Scrive data su un file temporaneo univoco accanto a path e lo rinomina:
+    chi legge vede il file vecchio o quello nuovo, mai uno a metà, e più
+    processi (server, tools.bulk_enroll) non condividono il temporaneo.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def write_json_atomic(path, data):
+    write_atomic(path, json.dumps(data))
@@ -0,0 +1,117 @@
+"""
+Auto-capture dell'enrollment dallo stream di feedback.
+
+Ogni frame di buona qualità viene classificato per posa (estimate_face_angle)
+e valutato per nitidezza; per ogni step si tengono solo i migliori N candidati
+(N = sample richiesti dallo step) come crop del volto. Gli encoding vengono
+calcolati una sola volta, a fine enrollment, sui candidati selezionati.
+"""
+
+import heapq
+import itertools
+import math
+import time
+from config.settings import (
+    ENROLLMENT_SAMPLES, AUTO_CAPTURE_MIN_INTERVAL, AUTO_CAPTURE_PITCH_DELTA
+)
+
+PITCH_NEUTRAL = 0.4  # Pitch di riferimento finché non ci sono candidati frontali
+CROP_MARGIN = 0.5  # Margine del crop attorno al volto (frazione del lato)
+
+
+def _crop(frame, face_location, margin=CROP_MARGIN):
+    """Crop del volto con margine; ritorna (crop, box relativo al crop)."""
+    top, right, bottom, left = face_location
+    h, w = frame.shape[:2]
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    y0, x0 = max(0, top - pad_y), max(0, left - pad_x)
+    y1, x1 = min(h, bottom + pad_y), min(w, right + pad_x)
+    crop = frame[y0:y1, x0:x1].copy()
+    return crop, (top - y0, right - x0, bottom - y0, left - x0)
+
+
+class AutoCapture:
+    def __init__(self, samples=ENROLLMENT_SAMPLES, min_interval=AUTO_CAPTURE_MIN_INTERVAL,
+                 pitch_delta=AUTO_CAPTURE_PITCH_DELTA):
+        self.required = dict(samples)
+        self.min_interval = min_interval
+        self.pitch_delta = pitch_delta
+        self.candidates = {step: [] for step in samples}  # Min-heap (score, seq, crop, box, angle)
+        self.last_accepted = {step: 0.0 for step in samples}
+        self._seq = itertools.count()
+
+    def pitch_baseline(self):
+        """Pitch medio dei candidati frontali (neutro del volto corrente)."""
+        pitches = [c[4]['pitch'] for c in self.candidates['front'] if c[4].get('pitch') is not None]
+        return sum(pitches) / len(pitches) if pitches else PITCH_NEUTRAL
+
+    def classify(self, angle):
+        """Step di posa compatibile con l'angolo stimato, o None."""
+        if angle is None:
+            return None
+        if angle['is_frontal']:
+            pitch = angle.get('pitch')
+            if pitch is not None and self.candidates['front']:
+                baseline = self.pitch_baseline()
+                if pitch < baseline - self.pitch_delta:
+                    return 'up'
+                if pitch > baseline + self.pitch_delta:
+                    return 'down'
+            return 'front'
+        if angle['is_right']:
+            return 'right'
+        if angle['is_left']:
+            return 'left'
+        return None
+
+    def offer(self, frame, face_location, quality, angle, step=None):
+        """
+        Valuta un frame già passato da check_quality.
+        step: posa richiesta dal client (opzionale); se indicata, il frame è
+        accettato solo se la posa stimata corrisponde.
+        Ritorna dict con posa rilevata, esito e progresso.
+        """
+        pose = self.classify(angle)
+        result = {'pose': pose, 'accepted': False}
+        if pose is None or (step is not None and pose != step) or not quality.get('is_good'):
+            result['progress'] = self.progress()
+            return result
+
+        now = time.time()
+        if now - self.last_accepted[pose] < self.min_interval:
+            result['progress'] = self.progress()
+            return result
+
+        score = math.log1p(quality.get('sharpness', 0.0))
+        heap = self.candidates[pose]
+        if len(heap) < self.required[pose] or score > heap[0][0]:
+            crop, box = _crop(frame, face_location)
+            entry = (score, next(self._seq), crop, box, angle)
+            if len(heap) < self.required[pose]:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heapreplace(heap, entry)
+            self.last_accepted[pose] = now
+            result['accepted'] = True
+            result['score'] = round(score, 3)
+
+        result['progress'] = self.progress()
+        return result
+
+    def progress(self):
+        return {step: {'captured': len(self.candidates[step]), 'required': required}
+                for step, required in self.required.items()}
+
+    @property
+    def total_captured(self):
+        return sum(len(c) for c in self.candidates.values())
+
+    def is_complete(self):
+        return all(len(self.candidates[s]) >= r for s, r in self.required.items())
+
+    def selected(self):
+        """Candidati finali per step, dal migliore: [(step, crop, box)]."""
+        return [(step, crop, box)
+                for step, heap in self.candidates.items()
+                for _, _, crop, box, _ in sorted(heap, key=lambda c: (-c[0], c[1]))]
@@ -0,0 +1,102 @@
+"""
+Backend di face detection intercambiabili.
+
+Ogni backend riceve un FrameContext e un fattore di scala e ritorna i box
+(top, right, bottom, left) nelle coordinate del frame ridimensionato;
+FaceDetector li riporta alla risoluzione originale.
+
+  hog   dlib HOG (face_recognition) - default, CPU
+  cnn   dlib CNN - più accurato, lento senza GPU
+  haar  OpenCV Haar cascade - il più economico, adatto al feedback live
+  dnn   OpenCV DNN (SSD ResNet-10) - richiede i file del modello in MODELS_DIR
+"""
+
+import functools
+import cv2
+import numpy as np
+import face_recognition
+from config.settings import DNN_PROTOTXT, DNN_MODEL, DNN_CONFIDENCE
+
+
+class DlibBackend:
+    """face_recognition.face_locations con modello HOG o CNN."""
+
+    min_face = 80  # Lato minimo rilevabile senza upsample (finestra 80x80)
+    supports_upsample = True
+
+    def __init__(self, model):
+        self.name = model
+
+    def detect(self, ctx, scale, upsample):
+        return face_recognition.face_locations(
+            ctx.scaled_rgb(scale), number_of_times_to_upsample=upsample, model=self.name)
+
+
+class HaarCascadeBackend:
+    """Cascade di Haar frontale di OpenCV su immagine grayscale."""
+
+    name = 'haar'
+    min_face = 24  # Dimensione della finestra della cascade
+    supports_upsample = False
+
+    def __init__(self, scale_factor=1.1, min_neighbors=5):
+        path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise ValueError(f'Cascade non trovata: {path}')
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def detect(self, ctx, scale, upsample):
+        rects = self.cascade.detectMultiScale(
+            ctx.scaled_gray(scale), scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors, minSize=(self.min_face, self.min_face))
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in rects]
+
+
+class OpenCVDnnBackend:
+    """SSD ResNet-10 (res10_300x300) tramite cv2.dnn."""
+
+    name = 'dnn'
+    min_face = 30
+    supports_upsample = False
+    input_size = (300, 300)
+    mean = (104.0, 177.0, 123.0)
+
+    def __init__(self, prototxt=DNN_PROTOTXT, model=DNN_MODEL, confidence=DNN_CONFIDENCE):
+        try:
+            self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        except cv2.error as e:
+            raise ValueError(f'Modello DNN non caricabile ({prototxt}, {model}): {e}')
+        self.confidence = confidence
+
+    def detect(self, ctx, scale, upsample):
+        image = cv2.cvtColor(ctx.scaled_rgb(scale), cv2.COLOR_RGB2BGR)
+        h, w = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, self.input_size), 1.0,
+                                     self.input_size, self.mean)
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]  # (N, 7): _, _, conf, x1, y1, x2, y2
+        detections = detections[detections[:, 2] >= self.confidence]
+        boxes = np.clip(detections[:, 3:7] * [w, h, w, h], 0, [w, h, w, h]).astype(int)
+        return [(int(y1), int(x2), int(y2), int(x1)) for x1, y1, x2, y2 in boxes if x2 > x1 and y2 > y1]
+
+
+DETECTOR_BACKENDS = {
+    'hog': functools.partial(DlibBackend, 'hog'),
+    'cnn': functools.partial(DlibBackend, 'cnn'),
+    'haar': HaarCascadeBackend,
+    'dnn': OpenCVDnnBackend,
+}
+
+_instances = {}
+
+
+def get_backend(name):
+    """Istanza condivisa del backend (cascade e reti vengono caricate una volta)."""
+    if name not in DETECTOR_BACKENDS:
+        raise ValueError(f'Backend di detection non valido: {name}')
+    backend = _instances.get(name)
+    if backend is None:
+        backend = _instances[name] = DETECTOR_BACKENDS[name]()
+    return backend
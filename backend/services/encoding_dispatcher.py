@@ -0,0 +1,145 @@
+"""
+Micro-batching dell'encoding tra stream diversi.
+
+Ogni stream estrae i crop allineati dei volti dal proprio frame e li
+consegna al dispatcher; un thread nativo raccoglie i crop di tutti gli
+stream per al più ENCODING_BATCH_WINDOW_MS, li codifica con una sola
+chiamata al modello e restituisce a ogni richiesta i propri encoding.
+Il batch parte prima della finestra quando contiene già una richiesta da
+ogni stream attivo (con una sola telecamera non si aspetta mai).
+
+Come in worker_pool, il chiamante attende il risultato in un thread nativo
+(eventlet.tpool), quindi il loop eventlet continua a servire gli altri
+stream, che nel frattempo possono aggiungere volti allo stesso batch.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from services.metrics import LatencyHistogram
+from config.settings import ENCODING_BATCH_WINDOW_MS, ENCODING_BATCH_MAX, ENCODING_STREAM_IDLE
+
+try:
+    from eventlet import tpool
+except ImportError:  # Esecuzione fuori dal server (CLI, benchmark)
+    tpool = None
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _Request:
+    __slots__ = ('stream', 'chips', 'future', 'queued_at')
+
+    def __init__(self, stream, chips):
+        self.stream = stream
+        self.chips = chips
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class EncodingDispatcher:
+    def __init__(self, detector, window_ms=ENCODING_BATCH_WINDOW_MS, max_batch=ENCODING_BATCH_MAX,
+                 stream_idle=ENCODING_STREAM_IDLE):
+        self.detector = detector
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.stream_idle = stream_idle
+        self._queue = queue.Queue()
+        self._carry = None  # Richiesta che non entrava nel batch precedente
+        self._last_seen = {}  # stream -> ultimo invio (per sapere chi attendere)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        # Metriche: volti per batch, attesa in coda (ms) e durata del batch (ms)
+        self.batch_size = LatencyHistogram(BATCH_SIZE_BUCKETS)
+        self.wait_ms = LatencyHistogram()
+        self.encode_ms = LatencyHistogram()
+        self.requests = 0
+        atexit.register(self.shutdown)
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='encoding-dispatcher',
+                                                daemon=True)
+                self._thread.start()
+
+    def encode(self, frame, face_locations, stream=None):
+        """
+        Encodings dei volti di un frame, codificati insieme a quelli degli
+        altri stream. Stessa forma di ritorno di get_face_encodings.
+        """
+        if not face_locations:
+            return []
+        request = _Request(stream, self.detector.get_face_chips(frame, face_locations))
+        self._last_seen[stream] = request.queued_at
+        self._ensure_thread()
+        self._queue.put(request)
+        if tpool is not None:
+            return tpool.execute(request.future.result)
+        return request.future.result()
+
+    def _active_streams(self, now):
+        return {s for s, seen in list(self._last_seen.items()) if now - seen < self.stream_idle}
+
+    def _collect(self):
+        """Prossimo batch: la prima richiesta più quelle arrivate entro la finestra."""
+        first, self._carry = self._carry or self._queue.get(), None
+        if first is None:
+            return None
+        batch, faces = [first], len(first.chips)
+        deadline = first.queued_at + self.window
+        waiting = self._active_streams(first.queued_at) - {first.stream}
+        while faces < self.max_batch and waiting:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)  # Shutdown dopo aver servito il batch corrente
+                break
+            if faces + len(request.chips) > self.max_batch:
+                self._carry = request
+                break
+            batch.append(request)
+            faces += len(request.chips)
+            waiting.discard(request.stream)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            chips = [chip for request in batch for chip in request.chips]
+            try:
+                encodings = self.detector.encode_face_chips(chips)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            self.batch_size.observe(len(chips))
+            self.encode_ms.observe((time.perf_counter() - started) * 1000)
+            offset = 0
+            for request in batch:
+                self.wait_ms.observe((started - request.queued_at) * 1000)
+                request.future.set_result(encodings[offset:offset + len(request.chips)])
+                offset += len(request.chips)
+            self.requests += len(batch)
+            self._prune(started)
+
+    def _prune(self, now):
+        for stream, seen in list(self._last_seen.items()):
+            if now - seen >= self.stream_idle:
+                self._last_seen.pop(stream, None)
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._queue.put(None)
@@ -4,35 +4,58 @@ import os
 import pickle
 import uuid
 import time
-import json
 import base64
 import cv2
 import numpy as np
 import face_recognition
+from services.gallery_store import GalleryStore
+from services.auto_capture import AutoCapture
+from services.face_tracker import box_iou
+from services.frame_codec import decode_image
+from services.frame_context import FrameContext
 from config.settings import (
-    ENCODINGS_FILE, ENROLLED_FACES_DIR, MAX_PROFILES,
+    ENCODINGS_FILE, MAX_PROFILES,
     ENROLLMENT_SAMPLES, TOTAL_ENROLLMENT_SAMPLES
 )
 
+MIN_SAMPLES = 3  # Sample minimi per salvare un profilo
+
+
+def make_thumbnail(frame, face_location, pad=30):
+    """Thumbnail JPEG 100x100 (base64) del volto, con padding."""
+    top, right, bottom, left = face_location
+    h, w = frame.shape[:2]
+    top = max(0, top - pad)
+    left = max(0, left - pad)
+    bottom = min(h, bottom + pad)
+    right = min(w, right + pad)
+    face_img = frame[top:bottom, left:right]
+    face_img = cv2.resize(face_img, (100, 100))
+    _, buffer = cv2.imencode('.jpg', face_img)
+    return base64.b64encode(buffer).decode('utf-8')
+
 
 class EnrollmentManager:
     def __init__(self):
         self.profiles = []
         self.current_enrollment = None
+        self.store = GalleryStore()
         self._load_profiles()
 
     def _load_profiles(self):
-        """Carica profili da file pickle."""
-        if os.path.exists(ENCODINGS_FILE):
-            with open(ENCODINGS_FILE, 'rb') as f:
-                self.profiles = pickle.load(f)
-        else:
-            self.profiles = []
-
-    def _save_profiles(self):
-        """Salva profili su file pickle."""
-        with open(ENCODINGS_FILE, 'wb') as f:
-            pickle.dump(self.profiles, f)
+        """Carica profili dalla gallery mappata in memoria (migra il pickle legacy)."""
+        if not self.store.exists and os.path.exists(ENCODINGS_FILE):
+            self._migrate_pickle()
+        self.profiles = self.store.profiles()
+
+    def _migrate_pickle(self):
+        """Importa face_encodings.pkl nel nuovo formato e lo rinomina in .bak."""
+        with open(ENCODINGS_FILE, 'rb') as f:
+            legacy = pickle.load(f)
+        for profile in legacy:
+            self.store.add_profile(profile, np.asarray(profile['encodings'], dtype=np.float32))
+        os.replace(ENCODINGS_FILE, ENCODINGS_FILE + '.bak')
+        print(f'[Enrollment] Migrati {len(legacy)} profili da {ENCODINGS_FILE}')
 
     def get_profiles(self):
         """Ritorna lista profili (senza encodings per response leggera)."""
@@ -49,18 +72,26 @@ class EnrollmentManager:
         """Ritorna profili completi con encodings (per recognizer)."""
         return self.profiles
 
-    def start_enrollment(self, name, color):
+    def get_full_profile(self, profile_id):
+        """Ritorna il profilo completo con encodings, o None."""
+        for p in self.profiles:
+            if p['id'] == profile_id:
+                return p
+        return None
+
+    def start_enrollment(self, name, color, auto_capture=False):
         """
         Inizia processo enrollment per nuovo profilo.
+        auto_capture: i sample vengono scelti dal server tra i frame dello
+        stream di feedback (vedi offer_auto_frame) invece che caricati uno a uno.
         Ritorna enrollment session info.
         """
         if len(self.profiles) >= MAX_PROFILES:
             return {'error': f'Massimo {MAX_PROFILES} profili raggiunto'}
 
         # Controlla nome duplicato
-        for p in self.profiles:
-            if p['name'].lower() == name.lower():
-                return {'error': f'Profilo "{name}" già esistente'}
+        if self.find_profile_by_name(name):
+            return {'error': f'Profilo "{name}" già esistente'}
 
         self.current_enrollment = {
             'id': str(uuid.uuid4())[:8],
@@ -75,12 +106,14 @@ class EnrollmentManager:
             },
             'encodings': [],
             'started_at': time.time(),
+            'auto': AutoCapture() if auto_capture else None,
         }
 
         return {
             'status': 'started',
             'id': self.current_enrollment['id'],
             'name': name,
+            'auto_capture': bool(auto_capture),
             'required_samples': ENROLLMENT_SAMPLES,
             'total_required': TOTAL_ENROLLMENT_SAMPLES,
         }
@@ -88,7 +121,7 @@ class EnrollmentManager:
     def capture_sample(self, frame_data, step):
         """
         Cattura un sample per l'enrollment corrente.
-        frame_data: base64 encoded image
+        frame_data: immagine JPEG/WebP binaria o base64
         step: 'front', 'right', 'left', 'up', 'down'
         """
         if not self.current_enrollment:
@@ -97,6 +130,9 @@ class EnrollmentManager:
         if step not in ENROLLMENT_SAMPLES:
             return {'error': f'Step non valido: {step}'}
 
+        if self.current_enrollment['auto']:
+            return {'error': 'Enrollment in modalità auto-capture: i sample arrivano dallo stream'}
+
         required = ENROLLMENT_SAMPLES[step]
         current = len(self.current_enrollment['samples'][step])
 
@@ -109,8 +145,8 @@ class EnrollmentManager:
             return {'error': 'Frame non valido'}
 
         # Rileva volto
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        locations = face_recognition.face_locations(rgb)
+        ctx = FrameContext(frame)
+        locations = face_recognition.face_locations(ctx.rgb)
 
         if len(locations) == 0:
             return {'error': 'Nessun volto rilevato', 'quality': 'no_face'}
@@ -119,29 +155,19 @@ class EnrollmentManager:
             return {'error': 'Troppi volti nel frame, inquadra solo il tuo', 'quality': 'multiple_faces'}
 
         # Genera encoding
-        encoding = face_recognition.face_encodings(rgb, locations)
+        encoding = face_recognition.face_encodings(ctx.rgb, locations)
         if not encoding:
             return {'error': 'Impossibile generare encoding', 'quality': 'encoding_failed'}
 
         # Salva sample
-        self.current_enrollment['samples'][step].append(encoding[0].tolist())
-        self.current_enrollment['encodings'].append(encoding[0].tolist())
+        sample = encoding[0].astype(np.float32)
+        self.current_enrollment['samples'][step].append(sample)
+        self.current_enrollment['encodings'].append(sample)
 
         # Genera thumbnail dal primo sample frontale
         thumbnail = None
         if step == 'front' and current == 0:
-            top, right, bottom, left = locations[0]
-            # Aggiungi padding
-            pad = 30
-            h, w = frame.shape[:2]
-            top = max(0, top - pad)
-            left = max(0, left - pad)
-            bottom = min(h, bottom + pad)
-            right = min(w, right + pad)
-            face_img = frame[top:bottom, left:right]
-            face_img = cv2.resize(face_img, (100, 100))
-            _, buffer = cv2.imencode('.jpg', face_img)
-            thumbnail = base64.b64encode(buffer).decode('utf-8')
+            thumbnail = make_thumbnail(frame, locations[0])
             self.current_enrollment['thumbnail'] = thumbnail
 
         # Calcola progresso
@@ -157,29 +183,61 @@ class EnrollmentManager:
             'thumbnail': thumbnail,
         }
 
+    def offer_auto_frame(self, frame, face_location, quality, angle, step=None):
+        """
+        Propone un frame dello stream di feedback all'auto-capture.
+        Ritorna None se non c'è un enrollment in modalità auto-capture.
+        """
+        if not self.current_enrollment or not self.current_enrollment['auto']:
+            return None
+        auto = self.current_enrollment['auto']
+        result = auto.offer(frame, face_location, quality, angle, step)
+        result['total_progress'] = auto.total_captured
+        result['total_required'] = TOTAL_ENROLLMENT_SAMPLES
+        result['complete'] = auto.is_complete()
+        return result
+
+    def _encode_auto_candidates(self):
+        """Encoding (una volta sola) dei candidati selezionati dall'auto-capture."""
+        enrollment = self.current_enrollment
+        enrollment['samples'] = {step: [] for step in enrollment['samples']}
+        enrollment['encodings'] = []
+        enrollment['thumbnail'] = None
+        for step, crop, box in enrollment['auto'].selected():
+            rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+            # Box dlib sul crop (il box di feedback viene da un detector diverso)
+            locations = face_recognition.face_locations(rgb)
+            location = max(locations, key=lambda loc: box_iou(loc, box)) if locations else box
+            encoding = face_recognition.face_encodings(rgb, [location])
+            if not encoding:
+                continue
+            sample = encoding[0].astype(np.float32)
+            enrollment['samples'][step].append(sample)
+            enrollment['encodings'].append(sample)
+            if step == 'front' and not enrollment['thumbnail']:
+                enrollment['thumbnail'] = make_thumbnail(crop, location)
+
     def complete_enrollment(self):
         """Completa enrollment e salva profilo."""
         if not self.current_enrollment:
             return {'error': 'Nessun enrollment attivo'}
 
-        total_captured = sum(len(s) for s in self.current_enrollment['samples'].values())
+        if self.current_enrollment['auto']:
+            self._encode_auto_candidates()
 
-        # Permetti completamento anche con samples parziali (minimo 3)
-        if total_captured < 3:
-            return {'error': f'Servono almeno 3 samples (catturati: {total_captured})'}
-
-        profile = {
-            'id': self.current_enrollment['id'],
-            'name': self.current_enrollment['name'],
-            'color': self.current_enrollment['color'],
-            'encodings': self.current_enrollment['encodings'],
-            'samples_count': total_captured,
-            'created_at': time.time(),
-            'thumbnail': self.current_enrollment.get('thumbnail'),
-        }
+        total_captured = sum(len(s) for s in self.current_enrollment['samples'].values())
 
-        self.profiles.append(profile)
-        self._save_profiles()
+        # Permetti completamento anche con samples parziali (minimo MIN_SAMPLES)
+        if total_captured < MIN_SAMPLES:
+            return {'error': f'Servono almeno {MIN_SAMPLES} samples (catturati: {total_captured})'}
+
+        profile = self.save_profile(
+            self.current_enrollment['id'],
+            self.current_enrollment['name'],
+            self.current_enrollment['color'],
+            self.current_enrollment['encodings'],
+            self.current_enrollment.get('thumbnail'),
+        )
         self.current_enrollment = None
 
         return {
@@ -192,10 +250,32 @@ class EnrollmentManager:
             }
         }
 
+    def save_profile(self, profile_id, name, color, encodings, thumbnail=None):
+        """Scrive un profilo completo nella gallery (append). Ritorna il profilo salvato."""
+        encodings = np.stack(encodings).astype(np.float32)
+        profile = {
+            'id': profile_id,
+            'name': name,
+            'color': color,
+            'samples_count': len(encodings),
+            'created_at': time.time(),
+            'thumbnail': thumbnail,
+        }
+        self.store.add_profile(profile, encodings)
+        self.profiles = self.store.profiles()
+        return profile
+
+    def find_profile_by_name(self, name):
+        """Profilo con questo nome (case-insensitive), o None."""
+        for p in self.profiles:
+            if p['name'].lower() == name.lower():
+                return p
+        return None
+
     def delete_profile(self, profile_id):
         """Elimina un profilo."""
-        self.profiles = [p for p in self.profiles if p['id'] != profile_id]
-        self._save_profiles()
+        self.store.remove_profile(profile_id)
+        self.profiles = self.store.profiles()
         return {'status': 'deleted', 'id': profile_id}
 
     def cancel_enrollment(self):
@@ -208,33 +288,29 @@ class EnrollmentManager:
         if not self.current_enrollment:
             return {'active': False}
 
-        progress = {}
-        for step, samples in self.current_enrollment['samples'].items():
-            progress[step] = {
-                'captured': len(samples),
-                'required': ENROLLMENT_SAMPLES[step],
-            }
-
-        total_captured = sum(len(s) for s in self.current_enrollment['samples'].values())
+        auto = self.current_enrollment['auto']
+        if auto:
+            progress = auto.progress()
+            total_captured = auto.total_captured
+        else:
+            progress = {}
+            for step, samples in self.current_enrollment['samples'].items():
+                progress[step] = {
+                    'captured': len(samples),
+                    'required': ENROLLMENT_SAMPLES[step],
+                }
+            total_captured = sum(len(s) for s in self.current_enrollment['samples'].values())
 
         return {
             'active': True,
             'id': self.current_enrollment['id'],
             'name': self.current_enrollment['name'],
+            'auto_capture': auto is not None,
             'progress': progress,
             'total_captured': total_captured,
             'total_required': TOTAL_ENROLLMENT_SAMPLES,
         }
 
     def _decode_frame(self, frame_data):
-        """Decodifica frame da base64 a numpy array OpenCV."""
-        try:
-            # Rimuovi header data URI se presente
-            if ',' in frame_data:
-                frame_data = frame_data.split(',')[1]
-            img_bytes = base64.b64decode(frame_data)
-            nparr = np.frombuffer(img_bytes, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            return frame
-        except Exception:
-            return None
+        """Decodifica frame (JPEG/WebP binario o base64) a numpy array OpenCV."""
+        return decode_image(frame_data)
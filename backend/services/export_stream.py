@@ -0,0 +1,61 @@
+"""Export in streaming (CSV/JSON) di eventi live o persistiti, con filtri temporali e per nome."""
+
+import csv
+import io
+import json
+import numpy as np
+from config.settings import EXPORT_CHUNK_SIZE
+
+CSV_HEADER = ['timestamp', 'name', 'confidence', 'box_x', 'box_y', 'box_w', 'box_h']
+
+
+def time_slice(timestamps, start=None, end=None):
+    """Intervallo [lo, hi) di indici con start <= t <= end su timestamp ordinati."""
+    lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+    hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='right'))
+    return lo, max(lo, hi)
+
+
+def iter_chunks(records, start=None, end=None, name_mask=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Scorre records (array o memmap ordinato per 'timestamp') a blocchi di
+    chunk_size, restituendo solo i record nel range e accettati da name_mask.
+    Memoria costante: un blocco alla volta.
+    """
+    lo, hi = time_slice(records['timestamp'], start, end)
+    for i in range(lo, hi, chunk_size):
+        chunk = np.asarray(records[i:min(i + chunk_size, hi)])
+        if name_mask is not None:
+            chunk = chunk[name_mask(chunk)]
+        if len(chunk):
+            yield chunk
+
+
+def csv_stream(events_blocks):
+    """Genera il CSV un blocco alla volta; events_blocks: iterabile di liste di eventi."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_HEADER)
+    yield output.getvalue()
+    for block in events_blocks:
+        output.seek(0)
+        output.truncate()
+        writer.writerows([e['timestamp'], e['name'], e['confidence'], *e['box']] for e in block)
+        yield output.getvalue()
+
+
+def json_stream(header, events_blocks):
+    """
+    Genera un oggetto JSON {**header, "events": [...]} senza materializzarlo:
+    le chiavi di header (piccole) vengono serializzate subito, gli eventi a blocchi.
+    """
+    head = json.dumps(header)
+    yield head[:-1] + (', ' if header else '') + '"events": ['
+    first = True
+    for block in events_blocks:
+        parts = ', '.join(json.dumps(e) for e in block)
+        if not parts:
+            continue
+        yield parts if first else ', ' + parts
+        first = False
+    yield ']}'
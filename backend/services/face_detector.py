@@ -1,28 +1,74 @@
 """Servizio di Face Detection - rileva volti e landmarks nel frame."""
 
 import cv2
+import dlib
 import numpy as np
 import face_recognition
+from services.frame_context import FrameContext
+from services.detector_backends import get_backend
 from config.settings import (
     DETECTION_MODEL, MIN_FACE_SIZE, MIN_BRIGHTNESS,
-    MAX_BRIGHTNESS, BLUR_THRESHOLD, MIN_FACE_RATIO, MAX_FACE_RATIO
+    MAX_BRIGHTNESS, BLUR_THRESHOLD, MIN_FACE_RATIO, MAX_FACE_RATIO,
+    DETECTION_SCALE, DETECTION_UPSAMPLE
 )
 
+# Crop allineato usato dal modello di encoding dlib (come face_encodings)
+FACE_CHIP_SIZE = 150
+FACE_CHIP_PADDING = 0.25
+
+# Lato minimo (px) di un volto trovato dai detector dlib senza upsample
+# (finestra di scansione HOG 80x80); ogni upsample lo dimezza.
+DETECTOR_MIN_FACE = 80
+
+
+def auto_detection_scale(min_face_size=MIN_FACE_SIZE, upsample=DETECTION_UPSAMPLE,
+                         detector_min_face=DETECTOR_MIN_FACE):
+    """
+    Fattore di downscale più aggressivo che trova ancora volti di
+    min_face_size px nel frame originale: un volto di lato L diventa L*scale
+    e il detector vede fino a detector_min_face / 2^upsample.
+    """
+    detectable = detector_min_face / (2 ** upsample)
+    return min(1.0, detectable / float(min_face_size))
 
-class FaceDetector:
-    def __init__(self):
-        self.model = DETECTION_MODEL
 
-    def detect_faces(self, frame):
+class FaceDetector:
+    def __init__(self, model=DETECTION_MODEL):
+        self.upsample = DETECTION_UPSAMPLE
+        self.model = model
+
+    @property
+    def model(self):
+        return self.backend.name
+
+    @model.setter
+    def model(self, name):
+        """Seleziona il backend ('hog', 'cnn', 'haar', 'dnn') e ricalcola la scala."""
+        self.backend = get_backend(name)
+        if DETECTION_SCALE == 'auto':
+            upsample = self.upsample if self.backend.supports_upsample else 0
+            self.scale = auto_detection_scale(upsample=upsample,
+                                              detector_min_face=self.backend.min_face)
+        else:
+            self.scale = min(1.0, float(DETECTION_SCALE))
+
+    def detect_faces(self, frame, scale=None, upsample=None):
         """
         Rileva volti nel frame.
+        frame: numpy array BGR oppure FrameContext già costruito.
+        scale: fattore di downscale per la detection (default self.scale);
+        i box sono riportati alla risoluzione originale, su cui restano
+        encoding e landmarks.
         Ritorna lista di dict con bounding box e landmarks.
         """
-        # face_recognition usa RGB, OpenCV usa BGR
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        ctx = FrameContext.wrap(frame)
+        scale = self.scale if scale is None else scale
+        upsample = self.upsample if upsample is None else upsample
 
-        # Rileva posizioni volti (top, right, bottom, left)
-        face_locations = face_recognition.face_locations(rgb_frame, model=self.model)
+        # Rileva posizioni volti (top, right, bottom, left) sul frame ridotto
+        face_locations = self.backend.detect(ctx, scale, upsample)
+        if scale < 1.0:
+            face_locations = self._rescale_locations(face_locations, scale, ctx.shape)
 
         # Filtra volti troppo piccoli
         valid_faces = []
@@ -35,18 +81,52 @@ class FaceDetector:
 
         return valid_faces
 
+    @staticmethod
+    def _rescale_locations(face_locations, scale, shape):
+        """Riporta i box dal frame ridotto alle coordinate del frame originale."""
+        h, w = shape[:2]
+        rescaled = []
+        for top, right, bottom, left in face_locations:
+            rescaled.append((
+                max(0, int(round(top / scale))),
+                min(w, int(round(right / scale))),
+                min(h, int(round(bottom / scale))),
+                max(0, int(round(left / scale))),
+            ))
+        return rescaled
+
     def get_face_landmarks(self, frame, face_locations=None):
         """Estrai i 68 face landmarks per ogni volto."""
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        landmarks_list = face_recognition.face_landmarks(rgb_frame, face_locations)
+        ctx = FrameContext.wrap(frame)
+        landmarks_list = face_recognition.face_landmarks(ctx.rgb, face_locations)
         return landmarks_list
 
     def get_face_encodings(self, frame, face_locations=None):
         """Genera i 128-d face encodings per ogni volto."""
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        ctx = FrameContext.wrap(frame)
+        encodings = face_recognition.face_encodings(ctx.rgb, face_locations)
         return encodings
 
+    def get_face_chips(self, frame, face_locations):
+        """
+        Crop allineati (150x150) dei volti, gli stessi che face_encodings
+        calcola internamente: possono essere codificati in batch anche
+        insieme a volti di altri frame (vedi encode_face_chips).
+        """
+        ctx = FrameContext.wrap(frame)
+        rgb = ctx.rgb
+        api = face_recognition.api
+        return [dlib.get_face_chip(rgb, api.pose_predictor_5_point(rgb, api._css_to_rect(loc)),
+                                   size=FACE_CHIP_SIZE, padding=FACE_CHIP_PADDING)
+                for loc in face_locations]
+
+    def encode_face_chips(self, chips):
+        """128-d encodings di una lista di crop allineati, in una sola chiamata al modello."""
+        if not chips:
+            return []
+        descriptors = face_recognition.api.face_encoder.compute_face_descriptor(chips)
+        return [np.array(d) for d in descriptors]
+
     def check_quality(self, frame, face_location):
         """
         Verifica qualità del frame per enrollment.
@@ -61,7 +141,8 @@ class FaceDetector:
             'message': 'Perfetto!'
         }
 
-        h, w = frame.shape[:2]
+        ctx = FrameContext.wrap(frame)
+        h, w = ctx.shape[:2]
         top, right, bottom, left = face_location
         face_w = right - left
         face_h = bottom - top
@@ -69,7 +150,7 @@ class FaceDetector:
         frame_area = w * h
 
         # Check luminosità
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = ctx.gray
         brightness = np.mean(gray)
         if brightness < MIN_BRIGHTNESS:
             quality['brightness'] = 'low'
@@ -86,6 +167,7 @@ class FaceDetector:
         face_roi = gray[top:bottom, left:right]
         if face_roi.size > 0:
             blur_score = cv2.Laplacian(face_roi, cv2.CV_64F).var()
+            quality['sharpness'] = round(float(blur_score), 1)
             if blur_score < BLUR_THRESHOLD:
                 quality['blur'] = 'blurry'
                 quality['is_good'] = False
@@ -148,9 +230,26 @@ class FaceDetector:
                 yaw_ratio = (nose_tip[0] - chin_center_x) / face_width
                 return {
                     'yaw': yaw_ratio,  # -0.5 a 0.5 (negativo = sinistra, positivo = destra)
+                    'pitch': self._pitch_ratio(landmarks, nose_tip, chin),
                     'is_frontal': abs(yaw_ratio) < 0.1,
                     'is_right': yaw_ratio > 0.15,
                     'is_left': yaw_ratio < -0.15,
                 }
 
         return None
+
+    @staticmethod
+    def _pitch_ratio(landmarks, nose_tip, chin):
+        """
+        Posizione verticale del naso tra occhi e mento (0-1): diminuisce
+        alzando la testa, aumenta abbassandola. Il valore neutro dipende dal
+        volto, quindi va confrontato con quello della posa frontale.
+        """
+        eyes = landmarks.get('left_eye', []) + landmarks.get('right_eye', [])
+        if not eyes:
+            return None
+        eye_y = sum(p[1] for p in eyes) / len(eyes)
+        chin_y = max(p[1] for p in chin)
+        if chin_y <= eye_y:
+            return None
+        return (nose_tip[1] - eye_y) / (chin_y - eye_y)
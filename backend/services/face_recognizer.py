@@ -1,40 +1,404 @@
 """Servizio di Face Recognition - confronta volti con profili enrollati."""
 
+import functools
+import hashlib
+import threading
 import numpy as np
-import face_recognition
-from config.settings import DEFAULT_THRESHOLD
+from services.gallery_index import ExactIndex, QuantizedIndex, create_index, load_index
+from services.quantization import get_codec, decoded_sq_norms
+from config.settings import (
+    DEFAULT_THRESHOLD, INDEX_FILE, INDEX_TYPE, IVF_NLIST, IVF_NPROBE,
+    PROTOTYPES_PER_PROFILE, PROTOTYPE_RERANK, PROTOTYPE_TOLERANCE,
+    GALLERY_DTYPE, QUANT_RERANK, QUANT_RETRAIN_SATURATION
+)
+
+ENCODING_DIM = 128
+INDEX_PARAMS = {
+    'ivf': {'nlist': IVF_NLIST, 'nprobe': IVF_NPROBE},
+    'prototype': {'prototypes': PROTOTYPES_PER_PROFILE, 'rerank': PROTOTYPE_RERANK,
+                  'tolerance': PROTOTYPE_TOLERANCE},
+}
+
+
+def _fetch_rows(sources, labels, starts, rows):
+    """Righe float32 esatte della gallery, lette dai campioni originali di ogni slot."""
+    slots = labels[rows]
+    return np.stack([sources[p][r - starts[p]] for r, p in zip(rows, slots)]).astype(np.float32)
+
+
+class GallerySnapshot:
+    """
+    Stato immutabile della gallery pubblicato dal recognizer.
+    Le modifiche costruiscono un nuovo snapshot e lo sostituiscono con un
+    solo assegnamento: chi sta facendo matching continua sul precedente.
+    Gli slot dei profili sono stabili; un profilo rimosso resta come slot
+    morto (righe con norma inf) fino alla compattazione.
+    Con una gallery quantizzata, gallery contiene i codici (decodificabili
+    con codec) e sources i campioni float32 originali di ogni slot.
+    """
+
+    __slots__ = ('gallery', 'sq_norms', 'profile_idx', 'profile_starts', 'profile_counts',
+                 'profile_ids', 'profile_names', 'profile_colors', 'live', 'dead_rows',
+                 'codec', 'sources', 'index', 'version')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    def replace(self, **fields):
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(fields)
+        return GallerySnapshot(**values)
+
+    @property
+    def live_slots(self):
+        return [p for p, alive in enumerate(self.live) if alive]
 
 
 class FaceRecognizer:
-    def __init__(self):
+    def __init__(self, index_file=INDEX_FILE):
         self.threshold = DEFAULT_THRESHOLD
-        self.known_encodings = []  # Lista di encoding arrays
-        self.known_names = []       # Lista di nomi corrispondenti
-        self.known_colors = []      # Lista di colori per UI
-        self.known_ids = []         # Lista di profile IDs
+        self.index_file = index_file  # Persistenza degli indici non esatti
+        self._lock = threading.RLock()  # Serializza le modifiche (i lettori non lo usano)
+
+        # Gallery quantizzata solo con la ricerca esaustiva (gli altri indici hanno copie float32)
+        dtype = GALLERY_DTYPE if INDEX_TYPE == 'exact' else 'float32'
+        if dtype != GALLERY_DTYPE:
+            print(f'[Recognizer] GALLERY_DTYPE={GALLERY_DTYPE} ignorato con INDEX_TYPE={INDEX_TYPE}')
+        self.codec = get_codec(dtype)
+
+        # Buffer con capacità di riserva: le righe oltre quelle pubblicate non sono
+        # visibili agli snapshot esistenti, quindi l'append vi scrive senza copie
+        self._vectors = np.empty((0, ENCODING_DIM), dtype=self.codec.dtype)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int64)
+
+        self.snapshot = self._publish_rows(0, [], [], [], [], [], [], [], 0, self._new_index(), 0)
+
+    @property
+    def quantized(self):
+        return self.codec.name != 'float32'
+
+    # Accesso in sola lettura allo snapshot corrente
+    @property
+    def gallery(self):
+        return self.snapshot.gallery
+
+    @property
+    def gallery_version(self):
+        return self.snapshot.version
+
+    @property
+    def profile_names(self):
+        return [self.snapshot.profile_names[p] for p in self.snapshot.live_slots]
+
+    @staticmethod
+    def _index_params():
+        return INDEX_PARAMS.get(INDEX_TYPE, {})
+
+    def _new_index(self):
+        return create_index(INDEX_TYPE, ENCODING_DIM, **self._index_params())
+
+    def _build_index(self, gallery, sq_norms, labels, profile_ids):
+        """
+        Costruisce l'indice sulla gallery data.
+        Gli indici non esatti vengono persistiti in self.index_file e riusati
+        all'avvio se la gallery non è cambiata.
+        """
+        digest = hashlib.sha1(gallery.tobytes())
+        digest.update('\n'.join(profile_ids).encode('utf-8'))
+        digest.update(labels.astype(np.int32).tobytes())
+        fingerprint = digest.hexdigest()
+
+        cached = load_index(self.index_file, ENCODING_DIM, INDEX_TYPE, **self._index_params())
+        if cached is not None and cached.fingerprint == fingerprint:
+            return cached
+
+        index = self._new_index()
+        index.build(gallery, labels)
+        index.fingerprint = fingerprint
+        index.save(self.index_file)
+        return index
+
+    def _publish_rows(self, rows, starts, counts, ids, names, colors, sources, live, dead_rows,
+                      index, version):
+        """Crea lo snapshot sulle prime `rows` righe dei buffer."""
+        gallery = self._vectors[:rows]
+        sq_norms = self._sq_norms[:rows]
+        labels = self._labels[:rows]
+        starts = np.asarray(starts, dtype=np.int64)
+        sources = tuple(sources) if self.quantized else ()
+        if INDEX_TYPE == 'exact' and self.quantized:
+            fetch = functools.partial(_fetch_rows, sources, labels, starts)
+            index = QuantizedIndex.wrap(gallery, sq_norms, labels, self.codec, fetch, QUANT_RERANK)
+        elif INDEX_TYPE == 'exact':
+            index = ExactIndex.wrap(gallery, sq_norms, labels)
+        elif index is None:
+            index = self._build_index(gallery, sq_norms, labels, list(ids))
+        return GallerySnapshot(
+            gallery=gallery, sq_norms=sq_norms, profile_idx=labels, profile_starts=starts,
+            profile_counts=tuple(counts), profile_ids=tuple(ids),
+            profile_names=tuple(names), profile_colors=tuple(colors),
+            live=tuple(live), dead_rows=dead_rows, codec=self.codec, sources=sources,
+            index=index, version=version,
+        )
+
+    def _reserve(self, rows):
+        """Garantisce capacità per `rows` righe (raddoppio, costo ammortizzato O(1))."""
+        if rows <= len(self._vectors):
+            return
+        capacity = max(rows, 2 * len(self._vectors), 16)
+        used = len(self.snapshot.gallery)
+        vectors = np.empty((capacity, ENCODING_DIM), dtype=self.codec.dtype)
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        labels = np.empty(capacity, dtype=np.int64)
+        vectors[:used] = self._vectors[:used]
+        sq_norms[:used] = self._sq_norms[:used]
+        labels[:used] = self._labels[:used]
+        self._vectors, self._sq_norms, self._labels = vectors, sq_norms, labels
+
+    @staticmethod
+    def _profile_encodings(profile):
+        # Senza copia se sono già float32 (es. viste sulla matrice mappata della GalleryStore)
+        return np.asarray(profile['encodings'], dtype=np.float32).reshape(-1, ENCODING_DIM)
+
+    def _profile_codes(self, profile, encodings):
+        """Codici del profilo: quelli salvati dalla GalleryStore se compatibili, altrimenti encode."""
+        if self.codec.same_as(profile.get('codec')):
+            return profile['codes']
+        return self.codec.encode(encodings)
+
+    def _write_rows(self, start, codes):
+        """Scrive codici e norme (dei vettori decodificati) nei buffer da start."""
+        end = start + len(codes)
+        self._vectors[start:end] = codes
+        if self.quantized:
+            self._sq_norms[start:end] = decoded_sq_norms(self.codec, codes)
+        else:
+            self._sq_norms[start:end] = np.einsum('ij,ij->i', codes, codes)
+
+    def _slot_encodings(self, snap, p):
+        """Campioni float32 di uno slot."""
+        if self.quantized:
+            return snap.sources[p]
+        start = snap.profile_starts[p]
+        return snap.gallery[start:start + snap.profile_counts[p]]
+
+    def _calibrate(self, entries):
+        """
+        Codec per la ricostruzione: quello dei codici salvati se tutti i profili
+        li hanno compatibili tra loro, altrimenti un nuovo codec calibrato sui campioni.
+        """
+        codecs = [p.get('codec') for p, _ in entries]
+        if codecs and codecs[0] is not None and codecs[0].name == self.codec.name \
+                and all(codecs[0].same_as(c) for c in codecs):
+            return codecs[0]
+        codec = get_codec(self.codec.name)
+        codec.version = self.codec.version
+        codec.train(enc for _, enc in entries)
+        return codec
 
     def load_profiles(self, profiles):
-        """Carica i profili enrollati per il confronto."""
-        self.known_encodings = []
-        self.known_names = []
-        self.known_colors = []
-        self.known_ids = []
+        """Carica (da zero) i profili enrollati per il confronto."""
+        with self._lock:
+            self._rebuild([(p, self._profile_encodings(p)) for p in profiles])
+
+    def _rebuild(self, entries):
+        """Ricostruisce buffer, indice e snapshot da (profilo, encodings), senza slot morti."""
+        entries = [(p, enc) for p, enc in entries if len(enc)]
+        rows = sum(len(enc) for _, enc in entries)
+        if self.quantized:
+            self.codec = self._calibrate(entries)
+        self._vectors = np.empty((rows, ENCODING_DIM), dtype=self.codec.dtype)
+        self._sq_norms = np.empty(rows, dtype=np.float32)
+        self._labels = np.empty(rows, dtype=np.int64)
+
+        starts, counts = [], []
+        offset = 0
+        for slot, (profile, enc) in enumerate(entries):
+            self._write_rows(offset, self._profile_codes(profile, enc))
+            self._labels[offset:offset + len(enc)] = slot
+            starts.append(offset)
+            counts.append(len(enc))
+            offset += len(enc)
+
+        self.snapshot = self._publish_rows(
+            rows, starts, counts,
+            [p['id'] for p, _ in entries], [p['name'] for p, _ in entries],
+            [p.get('color', '#00d9ff') for p, _ in entries], [enc for _, enc in entries],
+            [True] * len(entries), 0, None, self.snapshot.version + 1,
+        )
+
+    def _live_entries(self, snap):
+        """(profilo, campioni float32) degli slot vivi, per ricostruire da zero."""
+        return [({'id': snap.profile_ids[p], 'name': snap.profile_names[p],
+                  'color': snap.profile_colors[p]}, self._slot_encodings(snap, p))
+                for p in snap.live_slots]
+
+    def _needs_recalibration(self, encodings):
+        # Campioni fuori dal range int8: va ricalibrata e ricodificata tutta la gallery
+        return self.quantized and (not self.codec.trained or
+                                   self.codec.saturation(encodings) > QUANT_RETRAIN_SATURATION)
 
-        for profile in profiles:
-            for encoding in profile['encodings']:
-                self.known_encodings.append(np.array(encoding))
-                self.known_names.append(profile['name'])
-                self.known_colors.append(profile.get('color', '#00d9ff'))
-                self.known_ids.append(profile['id'])
+    @staticmethod
+    def _slots_of(snap, profile_id):
+        return [p for p in snap.live_slots if snap.profile_ids[p] == profile_id]
 
-    def recognize_faces(self, frame_encodings, face_locations):
+    @staticmethod
+    def _dead(snap, slots):
+        """Snap con gli slot dati marcati morti (per ricostruire dai soli vivi)."""
+        live = list(snap.live)
+        for p in slots:
+            live[p] = False
+        return snap.replace(live=tuple(live))
+
+    def _appended(self, snap, profile, encodings):
+        """
+        Snapshot (non ancora pubblicato) con le righe del profilo scritte nella
+        capacità libera del buffer, oltre la fine di snap: snap resta valido.
+        """
+        start = len(snap.gallery)
+        end = start + len(encodings)
+        slot = len(snap.live)
+        self._reserve(end)
+        self._write_rows(start, self._profile_codes(profile, encodings))
+        self._labels[start:end] = slot
+
+        index = None if INDEX_TYPE == 'exact' else snap.index.copy()
+        if index is not None:
+            index.add(encodings, self._labels[start:end])
+        return self._publish_rows(
+            end, list(snap.profile_starts) + [start], snap.profile_counts + (len(encodings),),
+            snap.profile_ids + (profile['id'],), snap.profile_names + (profile['name'],),
+            snap.profile_colors + (profile.get('color', '#00d9ff'),),
+            snap.sources + (encodings,), snap.live + (True,), snap.dead_rows,
+            index or snap.index, snap.version + 1,
+        )
+
+    def _tombstoned(self, snap, slots):
+        """
+        Snapshot (non ancora pubblicato) con gli slot morti: le loro righe hanno
+        norma inf (mai più il match migliore). Le norme sono copy-on-write.
+        """
+        live = list(snap.live)
+        sq_norms = self._sq_norms.copy()
+        dead_rows = snap.dead_rows
+        for p in slots:
+            live[p] = False
+            start = snap.profile_starts[p]
+            sq_norms[start:start + snap.profile_counts[p]] = np.inf
+            dead_rows += snap.profile_counts[p]
+        self._sq_norms = sq_norms
+
+        index = None if INDEX_TYPE == 'exact' else snap.index.copy()
+        if index is not None:
+            index.remove(slots)
+        return self._publish_rows(
+            len(snap.gallery), snap.profile_starts, snap.profile_counts, snap.profile_ids,
+            snap.profile_names, snap.profile_colors, snap.sources, live, dead_rows,
+            index or snap.index, snap.version + 1,
+        )
+
+    @staticmethod
+    def _compaction_due(snap, slots):
+        dead_rows = snap.dead_rows + sum(snap.profile_counts[p] for p in slots)
+        return dead_rows > len(snap.gallery) - dead_rows
+
+    def add_profile(self, profile):
+        """
+        Aggiunge un profilo in O(samples del profilo): le righe vengono
+        scritte nella capacità libera del buffer e pubblicate con un nuovo snapshot.
+        """
+        encodings = self._profile_encodings(profile)
+        if len(encodings) == 0:
+            return
+        with self._lock:
+            snap = self.snapshot
+            if self._needs_recalibration(encodings):
+                self._rebuild(self._live_entries(snap) + [(profile, encodings)])
+                return
+            self.snapshot = self._appended(snap, profile, encodings)
+
+    def remove_profile(self, profile_id):
+        """
+        Rimuove un profilo: lo slot diventa morto e le sue righe hanno norma inf
+        (mai più il match migliore). Compatta quando le righe morte superano quelle vive.
+        """
+        with self._lock:
+            snap = self.snapshot
+            slots = self._slots_of(snap, profile_id)
+            if not slots:
+                return False
+            if self._compaction_due(snap, slots):
+                self._rebuild(self._live_entries(self._dead(snap, slots)))
+            else:
+                self.snapshot = self._tombstoned(snap, slots)
+            return True
+
+    def update_profile(self, profile):
+        """
+        Aggiorna un profilo. Con 'encodings' sostituisce i campioni: le righe
+        vecchie vengono tombstonate e le nuove appese in un unico snapshot, così
+        i lettori non vedono mai la gallery senza il profilo. Altrimenti
+        aggiorna solo nome/colore in O(profili).
+        """
+        if 'encodings' in profile:
+            encodings = self._profile_encodings(profile)
+            with self._lock:
+                snap = self.snapshot
+                slots = self._slots_of(snap, profile['id'])
+                added = [(profile, encodings)] if len(encodings) else []
+                if self._compaction_due(snap, slots) or \
+                        (added and self._needs_recalibration(encodings)):
+                    self._rebuild(self._live_entries(self._dead(snap, slots)) + added)
+                    return
+                if slots:
+                    snap = self._tombstoned(snap, slots)
+                if added:
+                    snap = self._appended(snap, profile, encodings)
+                self.snapshot = snap.replace(version=self.snapshot.version + 1)
+            return
+
+        with self._lock:
+            snap = self.snapshot
+            names, colors = list(snap.profile_names), list(snap.profile_colors)
+            for p in snap.live_slots:
+                if snap.profile_ids[p] == profile['id']:
+                    names[p] = profile.get('name', names[p])
+                    colors[p] = profile.get('color', colors[p])
+            self.snapshot = snap.replace(profile_names=tuple(names), profile_colors=tuple(colors),
+                                         version=snap.version + 1)
+
+    @staticmethod
+    def _distance_matrix(snap, frame_encodings):
+        """
+        Distanze euclidee (F x N) tra tutti i volti del frame e tutta la gallery,
+        calcolate con un solo prodotto matriciale.
+        """
+        queries = np.asarray(frame_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        q_sq = np.einsum('ij,ij->i', queries, queries)
+        gallery = snap.codec.decode(snap.gallery)  # Senza copia se float32
+        d2 = q_sq[:, None] + snap.sq_norms[None, :] - 2.0 * (queries @ gallery.T)
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    @staticmethod
+    def _profile_min_distances(snap, distances):
+        """Riduce (F x N) a (F x P): distanza minima per slot profilo."""
+        return np.minimum.reduceat(distances, snap.profile_starts, axis=1)
+
+    def recognize_faces(self, frame_encodings, face_locations, threshold=None):
         """
         Confronta face encodings con profili noti.
+        threshold: distanza massima per il match (default: soglia globale).
         Ritorna lista di risultati per ogni volto trovato.
         """
+        if threshold is None:
+            threshold = self.threshold
         results = []
+        snap = self.snapshot  # Un solo snapshot per tutta la chiamata
 
-        if not self.known_encodings:
+        if not any(snap.live):
             # Nessun profilo enrollato, tutti i volti sono unknown
             for i, loc in enumerate(face_locations):
                 top, right, bottom, left = loc
@@ -47,24 +411,15 @@ class FaceRecognizer:
                 })
             return results
 
-        for i, encoding in enumerate(frame_encodings):
-            # Calcola distanze da tutti gli encoding noti
-            distances = face_recognition.face_distance(self.known_encodings, encoding)
+        if len(frame_encodings) == 0:
+            return results
 
-            if len(distances) == 0:
-                top, right, bottom, left = face_locations[i]
-                results.append({
-                    'box': [left, top, right - left, bottom - top],
-                    'name': 'Unknown',
-                    'confidence': 0.0,
-                    'color': '#666666',
-                    'profile_id': None,
-                })
-                continue
+        # Match migliore per ogni volto in un'unica ricerca sull'indice
+        best_distances, best_profiles = snap.index.search(frame_encodings, k=1)
 
-            # Trova il match migliore
-            best_idx = np.argmin(distances)
-            best_distance = distances[best_idx]
+        for i in range(len(best_profiles)):
+            best_distance = float(best_distances[i, 0])
+            p = int(best_profiles[i, 0])
 
             # Converti distanza in confidence (0-1)
             # Distanza 0 = match perfetto, distanza 0.6 = soglia default
@@ -72,13 +427,13 @@ class FaceRecognizer:
 
             top, right, bottom, left = face_locations[i]
 
-            if best_distance <= self.threshold:
+            if p >= 0 and best_distance <= threshold:
                 results.append({
                     'box': [left, top, right - left, bottom - top],
-                    'name': self.known_names[best_idx],
+                    'name': snap.profile_names[p],
                     'confidence': round(confidence, 3),
-                    'color': self.known_colors[best_idx],
-                    'profile_id': self.known_ids[best_idx],
+                    'color': snap.profile_colors[p],
+                    'profile_id': snap.profile_ids[p],
                 })
             else:
                 results.append({
@@ -97,30 +452,36 @@ class FaceRecognizer:
         threshold: valore 0.0-1.0, convertito da percentuale frontend (50-99%).
         Più basso = più strict.
         """
+        self.threshold = self.percent_to_distance(threshold)
+
+    @staticmethod
+    def percent_to_distance(threshold):
+        """Converte la soglia percentuale del frontend in distanza massima."""
         # Frontend invia percentuale (50-99), convertiamo in distanza
         # 99% → distanza 0.3 (molto strict), 50% → distanza 0.8 (permissivo)
-        self.threshold = 1.0 - (threshold / 100.0)
+        return 1.0 - (threshold / 100.0)
 
     def get_confusion_data(self, frame_encodings, face_locations):
         """
         Per Multi-Face Challenge: genera matrice di confusione.
         Mostra quanto ogni volto assomiglia a ogni profilo.
         """
-        if not self.known_encodings or not frame_encodings:
+        snap = self.snapshot
+        live = snap.live_slots
+        if not live or len(frame_encodings) == 0:
             return []
 
-        confusion = []
-        # Raggruppa encoding per profilo
-        profile_names = list(dict.fromkeys(self.known_names))  # Nomi unici ordinati
+        # Similarità massima per profilo = 1 - distanza minima per profilo
+        profile_dist = self._profile_min_distances(snap, self._distance_matrix(snap, frame_encodings))
+        similarities = np.maximum(0.0, 1.0 - profile_dist)
 
-        for i, encoding in enumerate(frame_encodings):
-            distances = face_recognition.face_distance(self.known_encodings, encoding)
+        confusion = []
+        for i in range(len(similarities)):
             row = {}
-            for j, name in enumerate(self.known_names):
-                dist = distances[j]
-                conf = max(0.0, 1.0 - dist)
-                if name not in row or conf > row[name]:
-                    row[name] = round(conf, 3)
+            for p in live:
+                # Profili con lo stesso nome: tiene la similarità massima
+                name = snap.profile_names[p]
+                row[name] = max(row.get(name, 0.0), round(float(similarities[i, p]), 3))
 
             top, right, bottom, left = face_locations[i]
             confusion.append({
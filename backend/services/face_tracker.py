@@ -0,0 +1,183 @@
+"""Tracker multi-volto - associa i box tra frame per riusare l'identità già calcolata."""
+
+import itertools
+from config.settings import (
+    TRACK_IOU_THRESHOLD, TRACK_REENCODE_INTERVAL,
+    TRACK_MIN_CONFIDENCE, TRACK_MAX_MISSES, TRACK_PREDICTION_DECAY
+)
+
+
+def box_iou(a, b):
+    """IoU tra due box (top, right, bottom, left)."""
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    __slots__ = ('track_id', 'box', 'velocity', 'identity', 'gallery_version',
+                 'frames_since_encode', 'confidence', 'detected_confidence',
+                 'frames_since_detection', 'misses', 'hits')
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.velocity = (0.0, 0.0)  # Spostamento (dy, dx) del centro per frame
+        self.identity = None  # Ultimo risultato del recognizer (dict)
+        self.gallery_version = -1
+        self.frames_since_encode = 0
+        self.confidence = 1.0  # IoU dell'ultima associazione, decaduta sui frame previsti
+        self.detected_confidence = 1.0  # IoU dell'ultima associazione con una detection reale
+        self.frames_since_detection = 0
+        self.misses = 0
+        self.hits = 1
+
+    def predicted_box(self):
+        """Box previsto nel frame corrente applicando la velocità stimata."""
+        dy, dx = self.velocity
+        top, right, bottom, left = self.box
+        return (top + dy, right + dx, bottom + dy, left + dx)
+
+    def update(self, box, iou):
+        """Associazione con una detection reale."""
+        old_cy = (self.box[0] + self.box[2]) / 2
+        old_cx = (self.box[1] + self.box[3]) / 2
+        new_cy = (box[0] + box[2]) / 2
+        new_cx = (box[1] + box[3]) / 2
+        # Media esponenziale della velocità per assorbire il jitter del detector
+        vy, vx = self.velocity
+        self.velocity = (0.5 * vy + 0.5 * (new_cy - old_cy), 0.5 * vx + 0.5 * (new_cx - old_cx))
+        self.box = box
+        self.confidence = self.detected_confidence = iou
+        self.frames_since_detection = 0
+        self.misses = 0
+        self.hits += 1
+        self.frames_since_encode += 1
+
+    def advance(self, box, decay):
+        """
+        Frame con il solo box previsto (detection saltata): l'IoU con la propria
+        previsione non dice nulla, quindi la confidenza decade con i frame
+        trascorsi dall'ultima detection reale e la velocità resta invariata.
+        """
+        self.box = box
+        self.frames_since_detection += 1
+        self.confidence = self.detected_confidence * decay ** self.frames_since_detection
+        self.misses = 0
+        self.frames_since_encode += 1
+
+
+class FaceTracker:
+    """
+    Associa le detection ai track esistenti per IoU sul box previsto
+    (posizione + velocità). Un volto tracciato mantiene l'identità e viene
+    ri-encodato solo ogni TRACK_REENCODE_INTERVAL frame, quando l'associazione
+    è incerta (anche per troppi frame senza detection reale) o quando la
+    gallery/soglia del recognizer cambia.
+    """
+
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD,
+                 reencode_interval=TRACK_REENCODE_INTERVAL,
+                 min_confidence=TRACK_MIN_CONFIDENCE,
+                 max_misses=TRACK_MAX_MISSES,
+                 prediction_decay=TRACK_PREDICTION_DECAY):
+        self.iou_threshold = iou_threshold
+        self.prediction_decay = prediction_decay
+        self.reencode_interval = reencode_interval
+        self.min_confidence = min_confidence
+        self.max_misses = max_misses
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, face_locations, detected=True):
+        """
+        Associa le detection del frame ai track.
+        detected: False se face_locations sono i box previsti (predicted_locations).
+        Ritorna la lista di Track, uno per ogni detection (stesso ordine).
+        """
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            predicted = track.predicted_box()
+            for di, loc in enumerate(face_locations):
+                iou = box_iou(predicted, loc)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, ti, di))
+
+        # Associazione greedy per IoU decrescente
+        pairs.sort(reverse=True)
+        assigned = [None] * len(face_locations)
+        used_tracks = set()
+        for iou, ti, di in pairs:
+            if ti in used_tracks or assigned[di] is not None:
+                continue
+            track = self.tracks[ti]
+            if detected:
+                track.update(tuple(face_locations[di]), iou)
+            else:
+                track.advance(tuple(face_locations[di]), self.prediction_decay)
+            assigned[di] = track
+            used_tracks.add(ti)
+
+        survivors = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            survivors.append(track)
+
+        for di, loc in enumerate(face_locations):
+            if assigned[di] is None:
+                track = Track(next(self._ids), tuple(loc))
+                assigned[di] = track
+                survivors.append(track)
+
+        self.tracks = survivors
+        return assigned
+
+    def predicted_locations(self, shape):
+        """
+        Box previsti dei track visti nell'ultimo frame, limitati al frame.
+        Usati al posto della detection nei frame in cui viene saltata.
+        """
+        h, w = shape[:2]
+        locations = []
+        for track in self.tracks:
+            if track.misses:
+                continue
+            top, right, bottom, left = track.predicted_box()
+            locations.append((
+                max(0, int(round(top))), min(w, int(round(right))),
+                min(h, int(round(bottom))), max(0, int(round(left))),
+            ))
+        return locations
+
+    def needs_encoding(self, track, gallery_version, interval_factor=1):
+        """
+        True se il track deve essere ri-encodato e ri-riconosciuto.
+        interval_factor: allunga l'intervallo di ri-encoding (degrado QoS).
+        """
+        return (track.identity is None
+                or track.gallery_version != gallery_version
+                or track.frames_since_encode >= self.reencode_interval * interval_factor
+                or track.confidence < self.min_confidence)
+
+    def set_identity(self, track, identity, gallery_version):
+        track.identity = identity
+        track.gallery_version = gallery_version
+        track.frames_since_encode = 0
+
+    def invalidate(self):
+        """Forza il ri-encoding di tutti i track (es. cambio soglia)."""
+        for track in self.tracks:
+            track.identity = None
+
+    def reset(self):
+        self.tracks = []
@@ -0,0 +1,44 @@
+"""Decodifica frame condivisa - payload binari JPEG/WebP o base64 (data URI)."""
+
+import base64
+import cv2
+import numpy as np
+
+BINARY_TYPES = (bytes, bytearray, memoryview)
+
+
+def frame_payload(data):
+    """
+    Estrae il payload del frame da un evento socket.
+    Il client può inviare direttamente il buffer binario oppure un dict
+    con chiave 'frame' (binario o stringa base64).
+    """
+    if isinstance(data, BINARY_TYPES):
+        return data
+    if isinstance(data, dict):
+        return data.get('frame') or None
+    return None
+
+
+def decode_image(frame_data):
+    """
+    Decodifica un'immagine in numpy array BGR.
+    frame_data: bytes/bytearray/memoryview con JPEG/WebP grezzo (decodificato
+    direttamente sul buffer ricevuto, senza copie) oppure stringa base64,
+    con o senza header data URI.
+    Ritorna None se il payload non è un'immagine valida.
+    """
+    try:
+        if isinstance(frame_data, BINARY_TYPES):
+            buf = np.frombuffer(frame_data, np.uint8)
+        else:
+            # Fallback base64: rimuovi header data URI se presente
+            comma = frame_data.find(',')
+            if comma >= 0:
+                frame_data = frame_data[comma + 1:]
+            buf = np.frombuffer(base64.b64decode(frame_data), np.uint8)
+        if buf.size == 0:
+            return None
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    except Exception:
+        return None
@@ -0,0 +1,82 @@
+"""Contesto per-frame - conversioni colore e viste ridimensionate calcolate una sola volta."""
+
+import cv2
+
+
+class FrameContext:
+    """
+    Incapsula un frame BGR e le sue viste derivate (RGB, grayscale, downscale).
+    Ogni vista viene calcolata alla prima richiesta e poi riusata da
+    detector, encoder e quality check dello stesso frame.
+    """
+
+    __slots__ = ('bgr', 'shared', '_rgb', '_gray', '_scaled', '_release_callbacks')
+
+    def __init__(self, frame):
+        self.bgr = frame
+        self.shared = None  # Descrittore shared memory se il frame è condiviso con i worker
+        self._rgb = None
+        self._gray = None
+        self._scaled = {}
+        self._release_callbacks = []
+
+    @classmethod
+    def wrap(cls, frame):
+        """Ritorna il frame se è già un FrameContext, altrimenti lo incapsula."""
+        if isinstance(frame, cls):
+            return frame
+        return cls(frame)
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    @property
+    def rgb(self):
+        """Vista RGB (face_recognition usa RGB, OpenCV usa BGR)."""
+        if self._rgb is None:
+            self._rgb = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    @property
+    def gray(self):
+        """Vista grayscale per luminosità e blur."""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    def scaled_rgb(self, scale):
+        """
+        Vista RGB ridimensionata di un fattore scale (< 1 = downscale).
+        Il risultato è memorizzato per fattore.
+        """
+        if scale >= 1.0:
+            return self.rgb
+        view = self._scaled.get(scale)
+        if view is None:
+            h, w = self.bgr.shape[:2]
+            size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            view = cv2.resize(self.rgb, size, interpolation=cv2.INTER_AREA)
+            self._scaled[scale] = view
+        return view
+
+    def scaled_gray(self, scale):
+        """Vista grayscale ridimensionata (detector OpenCV), memorizzata per fattore."""
+        if scale >= 1.0:
+            return self.gray
+        key = ('gray', scale)
+        view = self._scaled.get(key)
+        if view is None:
+            view = cv2.cvtColor(self.scaled_rgb(scale), cv2.COLOR_RGB2GRAY)
+            self._scaled[key] = view
+        return view
+
+    def on_release(self, callback):
+        """Registra una callback da eseguire quando il frame non serve più."""
+        self._release_callbacks.append(callback)
+
+    def release(self):
+        """Libera le risorse associate al frame (es. slot shared memory)."""
+        callbacks, self._release_callbacks = self._release_callbacks, []
+        for callback in callbacks:
+            callback()
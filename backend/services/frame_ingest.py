@@ -0,0 +1,90 @@
+"""Ingestion frame per client - backpressure 'latest frame wins'."""
+
+import threading
+from config.settings import FRAME_SKIP
+
+
+def new_ingest_stats():
+    """Contatori di ingestion (condivisi tra gli slot che alimentano lo stesso processor)."""
+    return {'received': 0, 'processed': 0, 'dropped': 0, 'skipped': 0, 'errors': 0}
+
+
+class LatestFrameSlot:
+    """
+    Slot di ingestion di un client: al massimo un frame in processing e uno
+    in attesa. Un frame che arriva mentre lo slot è occupato sostituisce
+    quello in attesa (il più vecchio viene scartato), così la latenza resta
+    limitata a circa un frame anche quando il processing è più lento della cattura.
+    """
+
+    def __init__(self, stats=None, frame_skip=FRAME_SKIP):
+        self.stats = stats if stats is not None else new_ingest_stats()
+        self.frame_skip = max(1, frame_skip)
+        self._lock = threading.Lock()
+        self._pending = None
+        self._busy = False
+        self._received = 0
+
+    def offer(self, item):
+        """
+        Propone un frame. Ritorna True se il chiamante deve processarlo
+        (slot libero), False se è stato messo in attesa o saltato.
+        """
+        with self._lock:
+            self.stats['received'] += 1
+            self._received += 1
+            if (self._received - 1) % self.frame_skip:
+                self.stats['skipped'] += 1
+                return False
+            if self._busy:
+                if self._pending is not None:
+                    self.stats['dropped'] += 1
+                self._pending = item
+                return False
+            self._busy = True
+            return True
+
+    def next(self):
+        """
+        Chiamato a fine processing. Ritorna il frame in attesa più recente,
+        oppure None liberando lo slot.
+        """
+        with self._lock:
+            item, self._pending = self._pending, None
+            if item is None:
+                self._busy = False
+            return item
+
+    def run(self, item, handler, yield_fn=None):
+        """
+        Processa item se lo slot è libero, poi continua con l'ultimo frame
+        arrivato nel frattempo finché non ce ne sono altri.
+        yield_fn: cede il controllo al loop (es. socketio.sleep(0)) così i
+        frame ricevuti durante il processing vengono accodati prima di next().
+        Il frame conta come processato solo se handler ritorna un risultato:
+        un risultato vuoto (es. decodifica fallita) è già contato negli errori.
+        """
+        if not self.offer(item):
+            return
+        while item is not None:
+            try:
+                if handler(item):
+                    self.stats['processed'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f'[WS] Errore processing frame: {e}')
+            if yield_fn is not None:
+                yield_fn()
+            item = self.next()
+
+    @property
+    def depth(self):
+        """Frame nello slot: in processing + in attesa (0-2)."""
+        return int(self._busy) + int(self._pending is not None)
+
+    def discard(self):
+        """Scarta il frame in attesa (es. disconnessione del client)."""
+        with self._lock:
+            if self._pending is not None:
+                self.stats['dropped'] += 1
+            self._pending = None
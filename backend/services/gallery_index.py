@@ -0,0 +1,552 @@
+"""Indici di ricerca sulla gallery - esatta, quantizzata, approssimata (IVF) e a prototipi, in NumPy."""
+
+import os
+import tempfile
+import numpy as np
+from services.quantization import asymmetric_sq_dist
+
+
+def _sq_norms(vectors):
+    return np.einsum('ij,ij->i', vectors, vectors)
+
+
+def _pairwise_sq_dist(queries, vectors, vectors_sq=None):
+    """Distanze euclidee al quadrato (Q x N) con un solo prodotto matriciale."""
+    if vectors_sq is None:
+        vectors_sq = _sq_norms(vectors)
+    d2 = _sq_norms(queries)[:, None] + vectors_sq[None, :] - 2.0 * (queries @ vectors.T)
+    np.maximum(d2, 0.0, out=d2)
+    return d2
+
+
+def _top_k(d2, k):
+    """Indici dei k valori minimi per riga, ordinati per distanza."""
+    k = min(k, d2.shape[1])
+    if k < d2.shape[1]:
+        part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(d2.shape[1]), d2.shape)
+    order = np.take_along_axis(d2, part, axis=1).argsort(axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+class ExactIndex:
+    """
+    Ricerca esaustiva su tutta la gallery.
+    Riferimento per la recall dell'indice approssimato.
+    """
+
+    kind = 'exact'
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.fingerprint = ''  # Impronta della gallery da cui è stato costruito
+
+    @property
+    def ntotal(self):
+        return len(self.labels)
+
+    def build(self, vectors, labels):
+        """Costruisce l'indice da zero."""
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self.sq_norms = _sq_norms(self.vectors)
+        self.labels = np.asarray(labels, dtype=np.int64)
+
+    @classmethod
+    def wrap(cls, vectors, sq_norms, labels):
+        """Indice sugli array dati, senza copie (i vettori con norma inf sono esclusi)."""
+        index = cls(vectors.shape[1])
+        index.vectors, index.sq_norms, index.labels = vectors, sq_norms, labels
+        return index
+
+    def copy(self):
+        """Copia superficiale: add/remove riassegnano gli array, l'originale resta intatto."""
+        index = ExactIndex.wrap(self.vectors, self.sq_norms, self.labels)
+        index.fingerprint = self.fingerprint
+        return index
+
+    def add(self, vectors, labels):
+        """Aggiunge vettori con le rispettive label."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.sq_norms = np.concatenate([self.sq_norms, _sq_norms(vectors)])
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=np.int64)])
+
+    def remove(self, labels):
+        """Rimuove tutti i vettori con una delle label indicate."""
+        keep = ~np.isin(self.labels, np.asarray(labels, dtype=np.int64))
+        self.vectors = self.vectors[keep]
+        self.sq_norms = self.sq_norms[keep]
+        self.labels = self.labels[keep]
+
+    def search(self, queries, k=1, nprobe=None):
+        """
+        Ritorna (distanze, label) di forma (Q x k), ordinate per distanza.
+        Le posizioni senza risultato hanno distanza inf e label -1.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+        lab = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.ntotal == 0 or len(queries) == 0:
+            return dist, lab
+
+        d2 = _pairwise_sq_dist(queries, self.vectors, self.sq_norms)
+        top = _top_k(d2, k)
+        n = top.shape[1]
+        dist[:, :n] = np.sqrt(np.take_along_axis(d2, top, axis=1))
+        lab[:, :n] = self.labels[top]
+        return dist, lab
+
+    def save(self, path):
+        _atomic_savez(path, kind=self.kind, fingerprint=self.fingerprint,
+                      vectors=self.vectors, labels=self.labels)
+
+    def _load_arrays(self, data):
+        self.build(data['vectors'], data['labels'])
+
+
+class QuantizedIndex:
+    """
+    Ricerca esaustiva sui codici compatti (float16/int8) della gallery, poi
+    re-ranking esatto in float32 della shortlist di `rerank` righe per query.
+    I vettori float32 non stanno nell'indice: fetch(rows) li legge (tipicamente
+    dalla matrice mappata su disco), quindi la memoria residente è solo quella
+    dei codici.
+    """
+
+    kind = 'quantized'
+
+    def __init__(self, dim, codec, fetch, rerank=16):
+        self.dim = dim
+        self.codec = codec
+        self.fetch = fetch
+        self.rerank = rerank
+        self.codes = np.empty((0, dim), dtype=codec.dtype)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.fingerprint = ''
+
+    @property
+    def ntotal(self):
+        return len(self.labels)
+
+    @classmethod
+    def wrap(cls, codes, sq_norms, labels, codec, fetch, rerank=16):
+        """Indice sugli array dati, senza copie (le righe con norma inf sono escluse)."""
+        index = cls(codes.shape[1], codec, fetch, rerank)
+        index.codes, index.sq_norms, index.labels = codes, sq_norms, labels
+        return index
+
+    def shortlist(self, queries, size):
+        """Righe candidate (Q x size) e distanze approssimate al quadrato."""
+        d2 = asymmetric_sq_dist(queries, self.codec, self.codes, self.sq_norms)
+        top = _top_k(d2, size)
+        return top, np.take_along_axis(d2, top, axis=1)
+
+    def search(self, queries, k=1, nprobe=None):
+        """
+        Ritorna (distanze, label) di forma (Q x k), ordinate per distanza esatta.
+        Le posizioni senza risultato hanno distanza inf e label -1.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+        lab = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.ntotal == 0 or len(queries) == 0:
+            return dist, lab
+
+        top, approx = self.shortlist(queries, max(self.rerank, k))
+        for qi in range(len(queries)):
+            rows = top[qi][np.isfinite(approx[qi])]
+            if len(rows) == 0:
+                continue
+            d2 = _pairwise_sq_dist(queries[qi:qi + 1], self.fetch(rows))[0]
+            order = d2.argsort()[:k]
+            dist[qi, :len(order)] = np.sqrt(d2[order])
+            lab[qi, :len(order)] = self.labels[rows[order]]
+        return dist, lab
+
+
+class IVFIndex:
+    """
+    Inverted File Index: k-means grossolano sulla gallery, ogni vettore è
+    assegnato alla lista del centroide più vicino. In ricerca si visitano
+    solo le nprobe liste più vicine alla query.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, dim, nlist=0, nprobe=8, train_iters=10, seed=0):
+        self.dim = dim
+        self.nlist = nlist  # 0 = automatico (~sqrt(N))
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.seed = seed
+        self.centroids = np.empty((0, dim), dtype=np.float32)
+        self.lists = []  # Per lista: [vectors, sq_norms, labels]
+        self.fingerprint = ''  # Impronta della gallery da cui è stato costruito
+
+    @property
+    def ntotal(self):
+        return sum(len(lst[2]) for lst in self.lists)
+
+    def train(self, vectors):
+        """Calcola i centroidi con k-means (Lloyd) sui vettori dati."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        n = len(vectors)
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(self.seed)
+        centroids = vectors[rng.choice(n, nlist, replace=False)].copy() if n else \
+            np.empty((0, self.dim), dtype=np.float32)
+        v_sq = _sq_norms(vectors)
+
+        for _ in range(self.train_iters if n else 0):
+            assign = _pairwise_sq_dist(centroids, vectors, v_sq).argmin(axis=0)
+            counts = np.bincount(assign, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+        self.centroids = centroids
+        self.lists = [[np.empty((0, self.dim), dtype=np.float32),
+                       np.empty(0, dtype=np.float32),
+                       np.empty(0, dtype=np.int64)] for _ in range(len(centroids))]
+
+    def build(self, vectors, labels):
+        """Addestra i centroidi e inserisce tutti i vettori."""
+        self.train(vectors)
+        self.add(vectors, labels)
+
+    def copy(self):
+        """Copia delle sole liste (O(nlist)): add/remove sulla copia non toccano l'originale."""
+        index = IVFIndex(self.dim, self.nlist, self.nprobe, self.train_iters, self.seed)
+        index.centroids = self.centroids
+        index.lists = [list(lst) for lst in self.lists]
+        index.fingerprint = self.fingerprint
+        return index
+
+    def _assign(self, vectors):
+        return _pairwise_sq_dist(vectors, self.centroids).argmin(axis=1)
+
+    def add(self, vectors, labels):
+        """Aggiunge vettori alle liste dei centroidi più vicini (senza riaddestrare)."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(vectors) == 0:
+            return
+        if len(self.centroids) == 0:
+            self.build(vectors, labels)
+            return
+
+        assign = self._assign(vectors)
+        for c in np.unique(assign):
+            mask = assign == c
+            lst = self.lists[c]
+            lst[0] = np.concatenate([lst[0], vectors[mask]])
+            lst[1] = np.concatenate([lst[1], _sq_norms(vectors[mask])])
+            lst[2] = np.concatenate([lst[2], labels[mask]])
+
+    def remove(self, labels):
+        """Rimuove tutti i vettori con una delle label indicate."""
+        labels = np.asarray(labels, dtype=np.int64)
+        for lst in self.lists:
+            keep = ~np.isin(lst[2], labels)
+            if not keep.all():
+                lst[0], lst[1], lst[2] = lst[0][keep], lst[1][keep], lst[2][keep]
+
+    def search(self, queries, k=1, nprobe=None):
+        """
+        Ritorna (distanze, label) di forma (Q x k), ordinate per distanza.
+        Le posizioni senza risultato hanno distanza inf e label -1.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+        lab = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(self.centroids) == 0 or len(queries) == 0:
+            return dist, lab
+
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = _top_k(_pairwise_sq_dist(queries, self.centroids), nprobe)
+
+        for qi, q in enumerate(queries):
+            cand = [self.lists[c] for c in probes[qi] if len(self.lists[c][2])]
+            if not cand:
+                continue
+            vecs = np.concatenate([c[0] for c in cand])
+            sq = np.concatenate([c[1] for c in cand])
+            labs = np.concatenate([c[2] for c in cand])
+            d2 = _pairwise_sq_dist(q[None, :], vecs, sq)
+            top = _top_k(d2, k)[0]
+            dist[qi, :len(top)] = np.sqrt(d2[0, top])
+            lab[qi, :len(top)] = labs[top]
+        return dist, lab
+
+    def save(self, path):
+        sizes = np.array([len(lst[2]) for lst in self.lists], dtype=np.int64)
+        _atomic_savez(
+            path,
+            kind=self.kind,
+            fingerprint=self.fingerprint,
+            centroids=self.centroids,
+            list_sizes=sizes,
+            vectors=np.concatenate([lst[0] for lst in self.lists]) if self.lists
+            else np.empty((0, self.dim), dtype=np.float32),
+            labels=np.concatenate([lst[2] for lst in self.lists]) if self.lists
+            else np.empty(0, dtype=np.int64),
+        )
+
+    def _load_arrays(self, data):
+        self.centroids = np.asarray(data['centroids'], dtype=np.float32)
+        vectors = np.asarray(data['vectors'], dtype=np.float32)
+        labels = np.asarray(data['labels'], dtype=np.int64)
+        bounds = np.concatenate([[0], np.cumsum(data['list_sizes'])])
+        self.lists = []
+        for i in range(len(self.centroids)):
+            v = vectors[bounds[i]:bounds[i + 1]]
+            self.lists.append([v, _sq_norms(v), labels[bounds[i]:bounds[i + 1]]])
+
+
+def _k_medoids(vectors, k, iters=10):
+    """
+    Medoidi (campioni reali) di vectors: inizializzazione farthest-point dal
+    campione più vicino al centroide, poi alternanza assegnazione/aggiornamento.
+    Ritorna gli indici dei medoidi.
+    """
+    n = len(vectors)
+    if k >= n:
+        return np.arange(n)
+    d2 = _pairwise_sq_dist(vectors, vectors)
+    centroid = vectors.mean(axis=0, keepdims=True)
+    medoids = [int(_pairwise_sq_dist(centroid, vectors)[0].argmin())]
+    while len(medoids) < k:
+        medoids.append(int(d2[medoids].min(axis=0).argmax()))
+    medoids = np.asarray(medoids)
+
+    for _ in range(iters):
+        assign = d2[:, medoids].argmin(axis=1)
+        updated = medoids.copy()
+        for c in range(k):
+            members = np.flatnonzero(assign == c)
+            if len(members):
+                updated[c] = members[d2[np.ix_(members, members)].sum(axis=1).argmin()]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+    return medoids
+
+
+class PrototypeIndex:
+    """
+    Matching a due stadi per profilo (label):
+      1. screening sui pochi prototipi di ogni label (k-medoids dei campioni)
+      2. re-ranking esatto sui campioni completi delle label più vicine
+
+    radius(label) è la distanza massima di un campione dal suo prototipo più
+    vicino, quindi dist(prototipo) - radius è un limite inferiore della
+    distanza vera: vengono ri-valutate anche tutte le label il cui limite è
+    sotto la distanza migliore trovata meno tolerance. Con tolerance=0 il
+    top-k coincide con la ricerca esatta; tolerance > 0 accetta risultati
+    peggiori al più di tolerance in cambio di meno re-ranking.
+    Ritorna le k label più vicine (distinte), non i k campioni.
+    """
+
+    kind = 'prototype'
+
+    def __init__(self, dim, prototypes=3, rerank=3, tolerance=0.0):
+        self.dim = dim
+        self.prototypes = prototypes
+        self.rerank = rerank
+        self.tolerance = tolerance
+        self.members = {}  # label -> [vectors, sq_norms] (campioni completi)
+        self._set_prototypes(np.empty((0, dim), dtype=np.float32),
+                             np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        self.fingerprint = ''
+
+    @property
+    def ntotal(self):
+        return sum(len(m[1]) for m in self.members.values())
+
+    def _set_prototypes(self, protos, proto_labels, radius):
+        """Prototipi raggruppati per label (contigui), con offset di gruppo per reduceat."""
+        self.protos = protos
+        self.proto_sq = _sq_norms(protos)
+        self.proto_labels = proto_labels
+        if len(proto_labels):
+            self.group_starts = np.flatnonzero(np.r_[True, proto_labels[1:] != proto_labels[:-1]])
+        else:
+            self.group_starts = np.empty(0, dtype=np.int64)
+        self.group_labels = proto_labels[self.group_starts]
+        self.group_radius = radius
+
+    def _summarize(self, vectors):
+        """(prototipi, raggio) di un insieme di campioni."""
+        protos = vectors[_k_medoids(vectors, self.prototypes)]
+        radius = float(np.sqrt(_pairwise_sq_dist(vectors, protos).min(axis=1).max()))
+        return protos, radius
+
+    def build(self, vectors, labels):
+        self.members = {}
+        self._set_prototypes(self.protos[:0], self.proto_labels[:0], self.group_radius[:0])
+        self.add(vectors, labels)
+
+    def copy(self):
+        index = PrototypeIndex(self.dim, self.prototypes, self.rerank, self.tolerance)
+        index.members = dict(self.members)
+        index._set_prototypes(self.protos, self.proto_labels, self.group_radius)
+        index.fingerprint = self.fingerprint
+        return index
+
+    def add(self, vectors, labels):
+        """Aggiunge campioni: prototipi ricalcolati solo per le label toccate."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        labels = np.asarray(labels, dtype=np.int64)
+        touched = np.unique(labels)
+        for label in touched:
+            new = vectors[labels == label]
+            if label in self.members:
+                new = np.concatenate([self.members[label][0], new])
+            self.members[int(label)] = [new, _sq_norms(new)]
+        self._replace_groups(touched)
+
+    def remove(self, labels):
+        labels = np.asarray(labels, dtype=np.int64)
+        for label in labels:
+            self.members.pop(int(label), None)
+        self._replace_groups(labels)
+
+    def _replace_groups(self, labels):
+        """Sostituisce i gruppi di prototipi delle label indicate (in coda)."""
+        keep_groups = ~np.isin(self.group_labels, labels)
+        keep_protos = ~np.isin(self.proto_labels, labels)
+        protos = [self.protos[keep_protos]]
+        proto_labels = [self.proto_labels[keep_protos]]
+        radius = [self.group_radius[keep_groups]]
+        for label in labels:
+            member = self.members.get(int(label))
+            if member is None:
+                continue
+            p, r = self._summarize(member[0])
+            protos.append(p)
+            proto_labels.append(np.full(len(p), label, dtype=np.int64))
+            radius.append(np.asarray([r], dtype=np.float32))
+        self._set_prototypes(np.concatenate(protos), np.concatenate(proto_labels),
+                             np.concatenate(radius))
+
+    def _exact(self, query, group):
+        vectors, sq = self.members[int(self.group_labels[group])]
+        return float(np.sqrt(_pairwise_sq_dist(query[None, :], vectors, sq).min()))
+
+    def search(self, queries, k=1, nprobe=None):
+        """
+        Ritorna (distanze, label) di forma (Q x k), ordinate per distanza.
+        Le posizioni senza risultato hanno distanza inf e label -1.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+        lab = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(self.group_labels) == 0 or len(queries) == 0:
+            return dist, lab
+
+        # Stadio 1: distanza minima dai prototipi di ogni label
+        proto_d2 = _pairwise_sq_dist(queries, self.protos, self.proto_sq)
+        group_dist = np.sqrt(np.minimum.reduceat(proto_d2, self.group_starts, axis=1))
+        lower = np.maximum(group_dist - self.group_radius[None, :], 0.0)
+        rerank = max(self.rerank, k)
+
+        for qi, q in enumerate(queries):
+            # Stadio 2: esatto sulle label più promettenti...
+            order = np.argsort(group_dist[qi])
+            exact = {int(g): self._exact(q, g) for g in order[:rerank]}
+            # ...più quelle che per il limite inferiore potrebbero ancora entrare nel top-k
+            while True:
+                kth = sorted(exact.values())[min(k, len(exact)) - 1]
+                pending = [int(g) for g in np.flatnonzero(lower[qi] < kth - self.tolerance)
+                           if int(g) not in exact]
+                if not pending:
+                    break
+                for g in pending:
+                    exact[g] = self._exact(q, g)
+
+            best = sorted(exact.items(), key=lambda item: item[1])[:k]
+            dist[qi, :len(best)] = [d for _, d in best]
+            lab[qi, :len(best)] = [self.group_labels[g] for g, _ in best]
+        return dist, lab
+
+    def save(self, path):
+        labels = sorted(self.members)
+        _atomic_savez(
+            path, kind=self.kind, fingerprint=self.fingerprint,
+            protos=self.protos, proto_labels=self.proto_labels, radius=self.group_radius,
+            vectors=np.concatenate([self.members[l][0] for l in labels]) if labels
+            else np.empty((0, self.dim), dtype=np.float32),
+            labels=np.concatenate([np.full(len(self.members[l][0]), l, dtype=np.int64)
+                                   for l in labels]) if labels else np.empty(0, dtype=np.int64),
+        )
+
+    def _load_arrays(self, data):
+        vectors = np.asarray(data['vectors'], dtype=np.float32)
+        labels = np.asarray(data['labels'], dtype=np.int64)
+        self.members = {}
+        for label in np.unique(labels):
+            v = vectors[labels == label]
+            self.members[int(label)] = [v, _sq_norms(v)]
+        self._set_prototypes(np.asarray(data['protos'], dtype=np.float32),
+                             np.asarray(data['proto_labels'], dtype=np.int64),
+                             np.asarray(data['radius'], dtype=np.float32))
+
+
+INDEX_TYPES = {
+    ExactIndex.kind: ExactIndex,
+    IVFIndex.kind: IVFIndex,
+    PrototypeIndex.kind: PrototypeIndex,
+}
+
+
+def create_index(kind, dim, **params):
+    """Factory per tipo di indice ('exact', 'ivf' o 'prototype')."""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f'Tipo indice non valido: {kind}')
+    if kind == ExactIndex.kind:
+        return ExactIndex(dim)
+    return INDEX_TYPES[kind](dim, **params)
+
+
+def load_index(path, dim, kind=None, **params):
+    """
+    Carica un indice salvato con save(). Ritorna None se assente, non valido o
+    (con kind) di un tipo diverso: i params valgono solo per il tipo richiesto.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            saved = str(data['kind'])
+            if kind is not None and saved != kind:
+                return None  # Indice di un altro INDEX_TYPE: da ricostruire
+            index = create_index(saved, dim, **params)
+            index._load_arrays(data)
+            index.fingerprint = str(data['fingerprint'])
+            return index
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _atomic_savez(path, **arrays):
+    """
+    Scrive un .npz su un file temporaneo univoco nella stessa directory e lo
+    rinomina (nessun file a metà, nessun conflitto tra processi che salvano insieme).
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
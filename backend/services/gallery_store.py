@@ -0,0 +1,352 @@
+"""
+Storage della gallery: matrice float32 memory-mappable + sidecar JSON di metadati.
+
+  gallery.<gen>.f32        encoding (N x 128 float32), solo append
+  gallery.<gen>.<v>.i8|f16 codici compatti delle stesse righe (GALLERY_DTYPE)
+  gallery.meta.json        checkpoint: profili con range di righe, tombstone, codec
+  gallery.<cp>.journal     modifiche successive al checkpoint cp (JSON per riga)
+  thumbnails/<id>.jpg      thumbnail dei profili (fuori dai metadati)
+
+Ogni aggiunta o eliminazione costa un append alla matrice e una riga di
+journal con fsync (la riga è il punto di commit), indipendentemente dal
+numero di profili. Le righe della matrice oltre quelle committate e una
+riga di journal incompleta (scrittura interrotta) vengono ignorate e
+troncate all'append successivo. Il journal viene incorporato in un nuovo
+checkpoint, sostituito atomicamente, alla compattazione (che riscrive la
+matrice in una nuova generazione), alla ricalibrazione dei codici o dopo
+GALLERY_JOURNAL_MAX modifiche.
+
+Con una gallery quantizzata la matrice float32 resta la fonte di verità
+(serve al re-ranking esatto e alla ricalibrazione); i codici vengono
+riscritti per intero, con una nuova versione del codec, quando i campioni
+aggiunti escono dal range int8 e a ogni compattazione.
+"""
+
+import base64
+import json
+import os
+import numpy as np
+from services.atomic_file import write_atomic, write_json_atomic
+from services.quantization import get_codec
+from config.settings import (
+    MODELS_DIR, GALLERY_META_FILE, GALLERY_COMPACT_RATIO, GALLERY_DTYPE, QUANT_RETRAIN_SATURATION,
+    GALLERY_JOURNAL_MAX
+)
+
+ENCODING_DIM = 128
+
+
+class GalleryStore:
+    def __init__(self, meta_file=GALLERY_META_FILE, directory=MODELS_DIR,
+                 compact_ratio=GALLERY_COMPACT_RATIO, dtype=GALLERY_DTYPE,
+                 journal_max=GALLERY_JOURNAL_MAX):
+        self.meta_file = meta_file
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        self.journal_max = journal_max
+        self.meta = {'generation': 0, 'checkpoint': 0, 'rows': 0, 'tombstoned_rows': 0,
+                     'profiles': []}
+        self.matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self.codes = None
+        self._thumbnails = {}  # id -> base64 (cache dei file in thumbnails/)
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                self.meta = json.load(f)
+        self.meta.setdefault('checkpoint', 0)
+        self._journal_size = 0  # Byte validi del journal (oltre: riga interrotta)
+        self._journal_records = 0
+        self._replay()
+
+        state = self.meta.get('codec')
+        self.codec = get_codec(dtype, state if state and state['name'] == dtype else None)
+        self._map(codes=False)
+        if state and not self.quantized:
+            # Tornati a float32: i codici non sono più mantenuti
+            self._commit({k: v for k, v in self.meta.items() if k != 'codec'}, self.codec)
+        elif self.quantized and self.meta['rows'] and state != self.codec.state():
+            self.requantize()  # Gallery esistente senza codici in questo formato
+        else:
+            self._map()
+        if any('thumbnail' in p for p in self.meta['profiles']):
+            self._migrate_thumbnails()
+
+    @property
+    def quantized(self):
+        return self.codec.name != 'float32'
+
+    @property
+    def exists(self):
+        return os.path.exists(self.meta_file)
+
+    def _matrix_path(self, generation=None):
+        gen = self.meta['generation'] if generation is None else generation
+        return os.path.join(self.directory, f'gallery.{gen}.f32')
+
+    def _codes_path(self, generation=None, codec=None):
+        gen = self.meta['generation'] if generation is None else generation
+        codec = codec or self.codec
+        return os.path.join(self.directory, f'gallery.{gen}.{codec.version}.{codec.suffix}')
+
+    def _journal_path(self, checkpoint=None):
+        cp = self.meta['checkpoint'] if checkpoint is None else checkpoint
+        return os.path.join(self.directory, f'gallery.{cp}.journal')
+
+    def _thumbnail_path(self, profile_id):
+        return os.path.join(self.directory, 'thumbnails', f'{profile_id}.jpg')
+
+    def _files(self, meta):
+        """File di dati referenziati da un sidecar."""
+        files = {self._matrix_path(meta['generation']), self._journal_path(meta['checkpoint'])}
+        state = meta.get('codec')
+        if state:
+            files.add(self._codes_path(meta['generation'], get_codec(state['name'], state)))
+        return files
+
+    def _map(self, codes=True):
+        """Mappa in memoria (read-only) le righe committate della matrice (e dei codici)."""
+        rows = self.meta['rows']
+        if rows == 0:
+            self.matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        else:
+            self.matrix = np.memmap(self._matrix_path(), dtype=np.float32, mode='r',
+                                    shape=(rows, ENCODING_DIM))
+        if not codes:
+            return
+        if not self.quantized:
+            self.codes = None
+        elif rows == 0 or not self.codec.trained:
+            self.codes = np.empty((0, ENCODING_DIM), dtype=self.codec.dtype)
+        else:
+            self.codes = np.memmap(self._codes_path(), dtype=self.codec.dtype, mode='r',
+                                   shape=(rows, ENCODING_DIM))
+
+    # ==========================================
+    # Journal e thumbnail
+    # ==========================================
+
+    def _apply(self, record):
+        """Applica una modifica del journal ai metadati in memoria."""
+        if record['op'] == 'add':
+            entry = record['profile']
+            self.meta['profiles'].append(entry)
+            self.meta['rows'] = entry['row_start'] + entry['row_count']
+        elif record['op'] == 'remove':
+            for p in self.meta['profiles']:
+                if p['id'] == record['id'] and not p.get('deleted'):
+                    p['deleted'] = True
+                    self.meta['tombstoned_rows'] += p['row_count']
+
+    def _replay(self):
+        """Riapplica il journal del checkpoint corrente, fino all'ultima riga completa."""
+        path = self._journal_path()
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record)
+                self._journal_size += len(line)
+                self._journal_records += 1
+
+    def _log(self, record):
+        """
+        Commit di una modifica già applicata in memoria: una riga di journal con
+        fsync. Senza un checkpoint su disco (gallery nuova) scrive invece il checkpoint.
+        """
+        if not os.path.exists(self.meta_file):
+            write_json_atomic(self.meta_file, self.meta)
+            return
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with open(self._journal_path(), 'ab') as f:
+            f.truncate(self._journal_size)  # Scarta una riga interrotta
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_size += len(line)
+        self._journal_records += 1
+        if self._journal_records >= self.journal_max:
+            self._commit(self.meta, self.codec)
+
+    def _save_thumbnail(self, profile_id, thumbnail):
+        os.makedirs(os.path.dirname(self._thumbnail_path(profile_id)), exist_ok=True)
+        write_atomic(self._thumbnail_path(profile_id), base64.b64decode(thumbnail), mode='wb')
+        self._thumbnails[profile_id] = thumbnail
+
+    def _thumbnail(self, profile_id):
+        """Thumbnail base64 del profilo (letta dal file una volta sola), o None."""
+        if profile_id not in self._thumbnails:
+            path = self._thumbnail_path(profile_id)
+            thumbnail = None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    thumbnail = base64.b64encode(f.read()).decode('utf-8')
+            self._thumbnails[profile_id] = thumbnail
+        return self._thumbnails[profile_id]
+
+    def _migrate_thumbnails(self):
+        """Sposta le thumbnail dei metadati (formato precedente) nei file dedicati."""
+        for p in self.meta['profiles']:
+            thumbnail = p.pop('thumbnail', None)
+            if thumbnail and not p.get('deleted'):
+                self._save_thumbnail(p['id'], thumbnail)
+        self._commit(self.meta, self.codec)
+
+    # ==========================================
+    # Profili
+    # ==========================================
+
+    def profiles(self):
+        """
+        Profili attivi; 'encodings' è una vista (senza copia) sulla matrice mappata.
+        Con una gallery quantizzata anche 'codes' (vista sui codici) e 'codec'.
+        """
+        result = []
+        for p in self.meta['profiles']:
+            if p.get('deleted'):
+                continue
+            profile = {k: v for k, v in p.items() if k not in ('row_start', 'row_count', 'deleted')}
+            profile['thumbnail'] = self._thumbnail(p['id'])
+            rows = slice(p['row_start'], p['row_start'] + p['row_count'])
+            profile['encodings'] = self.matrix[rows]
+            if self.quantized:
+                profile['codes'] = self.codes[rows]
+                profile['codec'] = self.codec
+            result.append(profile)
+        return result
+
+    @staticmethod
+    def _append(path, offset, data):
+        """Scrive data da offset (scartando le righe non committate) con fsync."""
+        with open(path, 'ab') as f:
+            f.truncate(offset)
+            f.write(data.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add_profile(self, profile, encodings):
+        """
+        Aggiunge un profilo: append delle righe alla matrice, poi commit nel journal.
+        profile: metadati (id, name, color, thumbnail, ...), encodings: array (K x 128).
+        """
+        encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        row_start = self.meta['rows']
+        # Eventuali righe non committate da una scrittura interrotta vengono scartate
+        self._append(self._matrix_path(), row_start * ENCODING_DIM * 4, encodings)
+
+        recalibrate = self.quantized and (not self.codec.trained or
+                                          self.codec.saturation(encodings) > QUANT_RETRAIN_SATURATION)
+        if self.quantized and not recalibrate:
+            self._append(self._codes_path(), row_start * ENCODING_DIM * self.codec.row_bytes,
+                         self.codec.encode(encodings))
+
+        if profile.get('thumbnail'):
+            self._save_thumbnail(profile['id'], profile['thumbnail'])
+
+        entry = {k: v for k, v in profile.items()
+                 if k not in ('encodings', 'codes', 'codec', 'thumbnail')}
+        entry.update({'row_start': row_start, 'row_count': len(encodings)})
+        record = {'op': 'add', 'profile': entry}
+        self._apply(record)
+        if recalibrate:
+            self._map(codes=False)  # I codici delle nuove righe vengono scritti da requantize
+            self.requantize()
+        elif self.quantized and self.meta.get('codec') != self.codec.state():
+            # Primo file di codici (codec senza calibrazione, es. float16): il
+            # codec va registrato subito nel checkpoint, altrimenti alla
+            # riapertura la gallery verrebbe riquantizzata e la compattazione
+            # lascerebbe il file orfano
+            self._commit(self.meta, self.codec)
+        else:
+            self._log(record)
+            self._map()
+
+    def remove_profile(self, profile_id):
+        """Tombstone del profilo; compatta se le righe morte superano la soglia."""
+        if not any(p['id'] == profile_id and not p.get('deleted') for p in self.meta['profiles']):
+            return False
+        record = {'op': 'remove', 'id': profile_id}
+        self._apply(record)
+
+        if self.meta['tombstoned_rows'] > self.compact_ratio * self.meta['rows']:
+            self.compact()
+        else:
+            self._log(record)
+        path = self._thumbnail_path(profile_id)
+        if os.path.exists(path):
+            os.remove(path)
+        self._thumbnails.pop(profile_id, None)
+        return True
+
+    def _live_blocks(self):
+        return [self.matrix[p['row_start']:p['row_start'] + p['row_count']]
+                for p in self.meta['profiles'] if not p.get('deleted')]
+
+    def _write_codes(self, generation, codec, blocks):
+        """Scrive i codici di tutte le righe (blocchi float32 in ordine di riga)."""
+        with open(self._codes_path(generation, codec), 'wb') as f:
+            for block in blocks:
+                f.write(codec.encode(block).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _commit(self, meta, codec):
+        """
+        Nuovo checkpoint (journal incorporato) e rimozione dei file della
+        generazione/codec/journal precedenti.
+        """
+        old_files = self._files(self.meta)
+        meta['checkpoint'] = self.meta['checkpoint'] + 1
+        if self.quantized and codec.trained:
+            meta['codec'] = codec.state()
+        write_json_atomic(self.meta_file, meta)
+        self.meta, self.codec = meta, codec
+        self._journal_size = self._journal_records = 0
+        self._map()
+        for path in old_files - self._files(meta):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _calibrated_codec(self, blocks):
+        """Nuovo codec (versione successiva) calibrato sui blocchi dati."""
+        codec = get_codec(self.codec.name)
+        codec.version = self.codec.version
+        codec.train(blocks)
+        return codec
+
+    def requantize(self):
+        """Ricalibra il codec sulle righe vive e riscrive tutti i codici (nuova versione)."""
+        codec = self._calibrated_codec(self._live_blocks())
+        if not codec.trained:
+            return
+        self._write_codes(self.meta['generation'], codec,
+                          np.array_split(self.matrix, max(1, len(self.matrix) // 65536)))
+        self._commit(dict(self.meta), codec)
+
+    def compact(self):
+        """Riscrive solo le righe vive in una nuova generazione della matrice."""
+        new_gen = self.meta['generation'] + 1
+        live = [p for p in self.meta['profiles'] if not p.get('deleted')]
+        blocks = self._live_blocks()
+
+        row = 0
+        with open(self._matrix_path(new_gen), 'wb') as f:
+            for p, block in zip(live, blocks):
+                f.write(np.ascontiguousarray(block).tobytes())
+                p['row_start'] = row
+                row += p['row_count']
+            f.flush()
+            os.fsync(f.fileno())
+
+        codec = self.codec
+        if self.quantized:
+            codec = self._calibrated_codec(blocks)
+            if codec.trained:
+                self._write_codes(new_gen, codec, blocks)
+
+        self._commit({'generation': new_gen, 'checkpoint': self.meta['checkpoint'], 'rows': row,
+                      'tombstoned_rows': 0, 'profiles': live}, codec)
@@ -0,0 +1,187 @@
+"""
+Metriche di produzione: istogrammi di latenza a bucket fissi, contatori e
+gauge, esposti in /api/performance e in formato testo Prometheus su /metrics.
+
+Gli istogrammi hanno bucket fissi, quindi observe è O(log B) senza
+allocazioni e gli istogrammi di stream diversi si sommano bucket per bucket.
+"""
+
+import bisect
+from collections import defaultdict
+
+# Limiti superiori (ms) dei bucket di latenza; l'ultimo bucket è +Inf
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 2000, 5000)
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = 'facerec'
+
+
+class LatencyHistogram:
+    """Istogramma a bucket fissi (default: latenze in ms)."""
+
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(self.bounds, value_ms)] += 1
+        self.total += value_ms
+        self.count += 1
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+        self.count += other.count
+
+    def quantile(self, q):
+        """Quantile stimato con interpolazione lineare nel bucket (come histogram_quantile)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            if cumulative + c >= rank and c:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return float(lower)  # Bucket +Inf: limite inferiore noto
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / c
+            cumulative += c
+        return float(self.bounds[-1])
+
+    def summary(self):
+        result = {f'p{int(q * 100)}': round(self.quantile(q), 2) for q in QUANTILES}
+        result['mean'] = round(self.total / self.count, 2) if self.count else 0.0
+        result['count'] = self.count
+        return result
+
+
+class StageLatency:
+    """Un istogramma per stage di pipeline_timing (creato al primo valore)."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def observe(self, timing):
+        for stage, value in timing.items():
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = LatencyHistogram()
+            histogram.observe(value)
+
+    def merge(self, other):
+        for stage, histogram in other.stages.items():
+            self.stages.setdefault(stage, LatencyHistogram()).merge(histogram)
+
+    def summary(self):
+        return {stage: h.summary() for stage, h in self.stages.items()}
+
+
+class MetricsRegistry:
+    """
+    Totali del processo. Gli stream attivi vengono sommati al momento della
+    lettura; quando uno stream termina i suoi valori confluiscono in retired,
+    così i contatori restano monotoni.
+    """
+
+    def __init__(self, dispatcher=None):
+        self.retired_latency = StageLatency()
+        self.retired_frames = defaultdict(int)
+        self.dispatcher = dispatcher  # EncodingDispatcher (micro-batching), se attivo
+
+    def retire(self, processor):
+        self.retired_latency.merge(processor.latency)
+        for key, value in processor.ingest_stats.items():
+            self.retired_frames[key] += value
+
+    def collect(self, processors, recognizer):
+        """Latenze, contatori e gauge aggregati su tutti gli stream."""
+        latency = StageLatency()
+        latency.merge(self.retired_latency)
+        frames = defaultdict(int, self.retired_frames)
+        queue_depth = 0
+        for processor in processors:
+            latency.merge(processor.latency)
+            for key, value in processor.ingest_stats.items():
+                frames[key] += value
+            queue_depth += processor.ingest.depth
+
+        snap = recognizer.snapshot
+        batching = None
+        if self.dispatcher is not None:
+            batching = {
+                'batch_size': self.dispatcher.batch_size,
+                'wait_ms': self.dispatcher.wait_ms,
+                'encode_ms': self.dispatcher.encode_ms,
+                'requests': self.dispatcher.requests,
+            }
+        return {
+            'latency': latency,
+            'batching': batching,
+            'frames': dict(frames),
+            'gauges': {
+                'streams': len(processors),
+                'queue_depth': queue_depth,
+                'gallery_profiles': len(snap.live_slots),
+                'gallery_rows': len(snap.gallery) - snap.dead_rows,
+                'gallery_dead_rows': snap.dead_rows,
+                'gallery_bytes': snap.gallery.nbytes + snap.sq_norms.nbytes,
+                'gallery_version': snap.version,
+            },
+        }
+
+    def snapshot(self, processors, recognizer):
+        """Versione JSON (quantili invece dei bucket) per /api/performance."""
+        data = self.collect(processors, recognizer)
+        data['latency'] = data['latency'].summary()
+        if data['batching'] is not None:
+            data['batching'] = {key: value.summary() if isinstance(value, LatencyHistogram) else value
+                                for key, value in data['batching'].items()}
+        return data
+
+    @staticmethod
+    def _histogram_lines(name, h, labels=''):
+        """Righe _bucket/_sum/_count di un istogramma (labels: 'k="v",' o vuoto)."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(h.bounds) + ['+Inf'], h.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        selector = f'{{{labels.rstrip(",")}}}' if labels else ''
+        lines.append(f'{name}_sum{selector} {h.total:.3f}')
+        lines.append(f'{name}_count{selector} {h.count}')
+        return lines
+
+    def render_prometheus(self, processors, recognizer):
+        """Formato testo Prometheus (exposition format 0.0.4)."""
+        data = self.collect(processors, recognizer)
+        name = f'{METRIC_PREFIX}_stage_latency_ms'
+        lines = [f'# HELP {name} Latenza per stage della pipeline (ms)',
+                 f'# TYPE {name} histogram']
+        for stage, h in sorted(data['latency'].stages.items()):
+            lines += self._histogram_lines(name, h, f'stage="{stage}",')
+
+        name = f'{METRIC_PREFIX}_frames_total'
+        lines += [f'# HELP {name} Frame per esito (ricevuti, processati, scartati, saltati, errori)',
+                  f'# TYPE {name} counter']
+        for key, value in sorted(data['frames'].items()):
+            lines.append(f'{name}{{result="{key}"}} {value}')
+
+        if data['batching'] is not None:
+            batching = data['batching']
+            for key, help_text in (('batch_size', 'Volti per batch di encoding'),
+                                   ('wait_ms', 'Attesa in coda delle richieste di encoding (ms)'),
+                                   ('encode_ms', 'Durata di un batch di encoding (ms)')):
+                name = f'{METRIC_PREFIX}_encoding_{key}'
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                lines += self._histogram_lines(name, batching[key])
+            name = f'{METRIC_PREFIX}_encoding_requests_total'
+            lines += [f'# TYPE {name} counter', f'{name} {batching["requests"]}']
+
+        for key, value in data['gauges'].items():
+            name = f'{METRIC_PREFIX}_{key}'
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
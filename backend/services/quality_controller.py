@@ -0,0 +1,127 @@
+"""Controller quality-of-service - degrada/ripristina la pipeline per tenere TARGET_FPS."""
+
+from config.settings import (
+    TARGET_FPS, LATENCY_BUDGET_MS, FRAME_RESIZE_WIDTH,
+    DETECTION_UPSAMPLE, QOS_COOLDOWN_FRAMES
+)
+
+# Gradini per stage, dal più accurato al più economico. Quando la pipeline
+# supera il budget si degrada lo stage che pesa di più nelle medie misurate.
+# La risoluzione di detection scende agendo sullo scale del detector: encoding
+# e box restano sul frame a FRAME_RESIZE_WIDTH, quindi le coordinate inviate
+# al frontend non cambiano.
+QOS_STEPS = {
+    'landmarks': [{'landmarks': True}, {'landmarks': False}],
+    'detection': [
+        {'detection_width': FRAME_RESIZE_WIDTH, 'detect_every': 1, 'upsample': DETECTION_UPSAMPLE},
+        {'detection_width': FRAME_RESIZE_WIDTH, 'detect_every': 2, 'upsample': DETECTION_UPSAMPLE},
+        {'detection_width': int(FRAME_RESIZE_WIDTH * 0.75), 'detect_every': 2,
+         'upsample': DETECTION_UPSAMPLE},
+        {'detection_width': int(FRAME_RESIZE_WIDTH * 0.75), 'detect_every': 3,
+         'upsample': max(0, DETECTION_UPSAMPLE - 1)},
+        {'detection_width': FRAME_RESIZE_WIDTH // 2, 'detect_every': 4,
+         'upsample': max(0, DETECTION_UPSAMPLE - 1)},
+    ],
+    # Moltiplicatore dell'intervallo di ri-encoding dei volti tracciati
+    'encoding': [{'reencode_factor': 1}, {'reencode_factor': 2}, {'reencode_factor': 4}],
+}
+QOS_MAX_LEVEL = sum(len(steps) - 1 for steps in QOS_STEPS.values())
+
+
+class QualityController:
+    """
+    Controller a retroazione sui tempi misurati della pipeline.
+    Tiene una media esponenziale del tempo totale e di ogni stage: se il
+    totale supera il budget degrada di un gradino lo stage più costoso tra
+    quelli ancora degradabili; se resta ben sotto per un po' ripristina
+    l'ultimo stage degradato. Dopo ogni cambio attende QOS_COOLDOWN_FRAMES
+    frame (isteresi).
+    """
+
+    ALPHA = 0.2
+    UPGRADE_MARGIN = 0.6  # Risale solo se il tempo è sotto il 60% del budget
+
+    def __init__(self, target_fps=TARGET_FPS, budget_ms=LATENCY_BUDGET_MS,
+                 cooldown=QOS_COOLDOWN_FRAMES, enabled=True):
+        self.target_fps = target_fps
+        self.budget_ms = budget_ms or 1000.0 / target_fps
+        self.cooldown = cooldown
+        self.enabled = enabled
+        self.steps = {stage: 0 for stage in QOS_STEPS}
+        self.history = []  # Stage degradati, in ordine (ripristino LIFO)
+        self.avg_total = None
+        self.avg_stages = {}
+        self._frames_since_change = 0
+        self._under_budget = 0
+        self.changes = 0
+
+    @property
+    def level(self):
+        return len(self.history)
+
+    def current(self):
+        """Decisioni correnti (unione dei gradini attivi di ogni stage)."""
+        decisions = {}
+        for stage, step in self.steps.items():
+            decisions.update(QOS_STEPS[stage][step])
+        return decisions
+
+    def _costliest_stage(self):
+        """Stage degradabile con il tempo medio più alto (None se tutti al minimo)."""
+        candidates = [stage for stage, step in self.steps.items()
+                      if step < len(QOS_STEPS[stage]) - 1
+                      and self.avg_stages.get(stage) is not None]
+        return max(candidates, key=lambda stage: self.avg_stages[stage], default=None)
+
+    def observe(self, timing):
+        """
+        Aggiorna le medie con i tempi (ms) dell'ultimo frame e decide il livello.
+        Uno stage assente dal frame (non eseguito) conta 0 ms: la sua media
+        decade e non resta il più costoso per sempre.
+        """
+        for stage in set(self.avg_stages) | set(timing):
+            ms = timing.get(stage, 0.0)
+            prev = self.avg_stages.get(stage)
+            self.avg_stages[stage] = ms if prev is None else prev + self.ALPHA * (ms - prev)
+        self.avg_total = self.avg_stages.get('total')
+        if not self.enabled or self.avg_total is None:
+            return
+
+        self._frames_since_change += 1
+        if self._frames_since_change < self.cooldown:
+            return
+
+        if self.avg_total > self.budget_ms:
+            stage = self._costliest_stage()
+            if stage is not None:
+                self.steps[stage] += 1
+                self.history.append(stage)
+                self._changed()
+        elif self.avg_total < self.budget_ms * self.UPGRADE_MARGIN and self.history:
+            # Risale solo dopo un periodo stabile sotto budget
+            self._under_budget += 1
+            if self._under_budget >= self.cooldown:
+                self.steps[self.history.pop()] -= 1
+                self._changed()
+        else:
+            self._under_budget = 0
+
+    def _changed(self):
+        self.changes += 1
+        self._frames_since_change = 0
+        self._under_budget = 0
+
+    def state(self):
+        """Stato per /api/performance."""
+        return {
+            'enabled': self.enabled,
+            'target_fps': self.target_fps,
+            'budget_ms': round(self.budget_ms, 1),
+            'level': self.level,
+            'max_level': QOS_MAX_LEVEL,
+            'steps': dict(self.steps),
+            'decisions': dict(self.current()),
+            'avg_total_ms': round(self.avg_total, 1) if self.avg_total is not None else None,
+            'avg_stage_ms': {k: round(v, 1) for k, v in self.avg_stages.items()},
+            'changes': self.changes,
+        }
@@ -0,0 +1,166 @@
+"""
+Rappresentazioni compatte degli encoding (128 float32 = 512 byte per riga).
+
+  float32  nessuna compressione (riferimento)
+  float16  256 byte/riga (2x), errore ~1e-4 sugli embedding dlib
+  int8     128 byte/riga (4x), scala e offset per dimensione
+
+La ricerca calcola distanze asimmetriche: le query restano float32 e i
+codici vengono decodificati a blocchi, così la memoria temporanea resta
+limitata a QUANT_CHUNK_ROWS righe float32 indipendentemente dalla gallery.
+La conversione float16 -> float32 di NumPy non è vettorizzata: int8
+risparmia più memoria ed è anche più veloce.
+"""
+
+import numpy as np
+from config.settings import QUANT_CHUNK_ROWS
+
+INT8_LEVELS = 127  # Codici simmetrici in [-127, 127]
+INT8_MARGIN = 0.25  # Margine sul range osservato (tolleranza per profili futuri)
+INT8_MIN_HALF_RANGE = 0.05  # Semi-ampiezza minima per dimensione (pochi campioni)
+
+
+class Float32Codec:
+    name = 'float32'
+    dtype = np.float32
+    suffix = 'f32'
+
+    def __init__(self, state=None):
+        self.version = (state or {}).get('version', 0)
+
+    @property
+    def trained(self):
+        return True
+
+    def train(self, blocks):
+        pass
+
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=self.dtype)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def prepare(self, queries):
+        """
+        (query trasformate, bias) tali che queries · decode(c) = trasformate · c + bias:
+        la ricerca converte i codici in float32 senza applicare scala e offset.
+        """
+        return queries, np.zeros(len(queries), dtype=np.float32)
+
+    def saturation(self, vectors):
+        """Frazione di valori fuori dal range rappresentabile."""
+        return 0.0
+
+    def state(self):
+        return {'name': self.name, 'version': self.version}
+
+    def same_as(self, other):
+        """True se i codici prodotti da other sono decodificabili con questo codec."""
+        return other is self or (other is not None and other.state() == self.state())
+
+    @property
+    def row_bytes(self):
+        return np.dtype(self.dtype).itemsize
+
+
+class Float16Codec(Float32Codec):
+    name = 'float16'
+    dtype = np.float16
+    suffix = 'f16'
+
+
+class Int8Codec(Float32Codec):
+    """x ≈ offset + scale * code, con scale e offset per dimensione."""
+
+    name = 'int8'
+    dtype = np.int8
+    suffix = 'i8'
+
+    def __init__(self, state=None):
+        super().__init__(state)
+        self.offset = self.scale = None
+        if state and state.get('scale') is not None:
+            self.offset = np.asarray(state['offset'], dtype=np.float32)
+            self.scale = np.asarray(state['scale'], dtype=np.float32)
+
+    @property
+    def trained(self):
+        return self.scale is not None
+
+    def train(self, blocks):
+        """Range per dimensione (min/max) calcolato blocco per blocco, senza concatenare."""
+        lo = hi = None
+        for block in blocks:
+            if len(block) == 0:
+                continue
+            block = np.asarray(block, dtype=np.float32)
+            lo = block.min(axis=0) if lo is None else np.minimum(lo, block.min(axis=0))
+            hi = block.max(axis=0) if hi is None else np.maximum(hi, block.max(axis=0))
+        if lo is None:
+            return
+        half = np.maximum((hi - lo) / 2 * (1 + INT8_MARGIN), INT8_MIN_HALF_RANGE)
+        self.offset = ((hi + lo) / 2).astype(np.float32)
+        self.scale = (half / INT8_LEVELS).astype(np.float32)
+        self.version += 1
+
+    def encode(self, vectors):
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.offset) / self.scale)
+        return np.clip(codes, -INT8_LEVELS, INT8_LEVELS).astype(np.int8)
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def prepare(self, queries):
+        return queries * self.scale, queries @ self.offset
+
+    def saturation(self, vectors):
+        limit = self.scale * (INT8_LEVELS + 0.5)
+        return float(np.mean(np.abs(np.asarray(vectors, dtype=np.float32) - self.offset) > limit))
+
+    def state(self):
+        state = super().state()
+        state.update({'offset': self.offset.tolist(), 'scale': self.scale.tolist()}
+                     if self.trained else {})
+        return state
+
+
+CODECS = {c.name: c for c in (Float32Codec, Float16Codec, Int8Codec)}
+
+
+def get_codec(name, state=None):
+    """Codec per nome ('float32', 'float16', 'int8'), eventualmente da uno stato salvato."""
+    if name not in CODECS:
+        raise ValueError(f'Rappresentazione gallery non valida: {name}')
+    return CODECS[name](state)
+
+
+def decoded_sq_norms(codec, codes, chunk=QUANT_CHUNK_ROWS):
+    """Norme al quadrato dei vettori decodificati (per le distanze asimmetriche)."""
+    out = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), chunk):
+        block = codec.decode(codes[start:start + chunk])
+        out[start:start + chunk] = np.einsum('ij,ij->i', block, block)
+    return out
+
+
+def asymmetric_sq_dist(queries, codec, codes, sq_norms, chunk=QUANT_CHUNK_ROWS):
+    """
+    Distanze al quadrato (Q x N) tra query float32 e codici. I codici vengono
+    convertiti a blocchi in un buffer riusato (resta in cache) e scala/offset
+    sono già applicati alle query da codec.prepare.
+    """
+    q_sq = np.einsum('ij,ij->i', queries, queries)
+    scaled, bias = codec.prepare(queries)
+    d2 = np.empty((len(queries), len(codes)), dtype=np.float32)
+    buffer = np.empty((min(chunk, len(codes)), codes.shape[1]), dtype=np.float32)
+    for start in range(0, len(codes), chunk):
+        block = codes[start:start + chunk]
+        converted = buffer[:len(block)]
+        np.copyto(converted, block, casting='unsafe')
+        np.matmul(scaled, converted.T, out=d2[:, start:start + len(block)])
+    d2 *= -2.0
+    d2 += (q_sq - 2.0 * bias)[:, None]
+    d2 += sq_norms[None, :]
+    np.maximum(d2, 0.0, out=d2)
+    return d2
@@ -0,0 +1,85 @@
+"""Ring buffer a capacità fissa su array strutturato NumPy."""
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Serie temporale a capacità fissa: append O(1), eviction dei record più
+    vecchi O(log n + k) e memoria limitata a capacity record.
+    I record devono essere aggiunti in ordine di tempo.
+    on_evict(records) riceve i record rimossi (per scadenza o overflow).
+    """
+
+    def __init__(self, dtype, capacity, on_evict=None):
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=self.dtype)
+        self.start = 0
+        self.size = 0
+        self.on_evict = on_evict
+
+    def __len__(self):
+        return self.size
+
+    def _physical(self, i):
+        return (self.start + i) % self.capacity
+
+    def append(self, record):
+        """Aggiunge un record (tupla nell'ordine dei campi del dtype)."""
+        if self.size == self.capacity:
+            self._drop(1)
+        self.data[self._physical(self.size)] = record
+        self.size += 1
+
+    def count_older(self, field, cutoff):
+        """Numero di record in testa con field <= cutoff (ricerca binaria)."""
+        lo, hi = 0, self.size
+        column = self.data[field]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if column[self._physical(mid)] <= cutoff:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def evict_older(self, field, cutoff):
+        """Rimuove dalla testa i record con field <= cutoff. Ritorna quanti."""
+        count = self.count_older(field, cutoff)
+        if count:
+            self._drop(count)
+        return count
+
+    def view_since(self, field, cutoff):
+        """Copia ordinata dei record con field > cutoff."""
+        return self.view(self.size - self.count_older(field, cutoff))
+
+    def _drop(self, count):
+        if self.on_evict is not None:
+            self.on_evict(self.view(count, from_start=True))
+        self.start = self._physical(count)
+        self.size -= count
+
+    def _ordered(self, array, last, from_start):
+        n = self.size if last is None else max(0, min(last, self.size))
+        begin = self._physical(0 if from_start else self.size - n)
+        end = begin + n
+        if end <= self.capacity:
+            return array[begin:end].copy()
+        return np.concatenate([array[begin:], array[:end - self.capacity]])
+
+    def view(self, last=None, from_start=False):
+        """
+        Copia ordinata (dal più vecchio) degli ultimi `last` record
+        (o dei primi `last` se from_start). last=None: tutti.
+        """
+        return self._ordered(self.data, last, from_start)
+
+    def column(self, field, last=None):
+        """Copia ordinata di un singolo campo degli ultimi `last` record."""
+        return self._ordered(self.data[field], last, False)
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
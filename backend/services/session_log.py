@@ -0,0 +1,174 @@
+"""
+Log persistente append-only degli eventi di sessione in SESSIONS_DIR.
+
+Per ogni sessione:
+  <id>.events     record binari a dimensione fissa (LOG_DTYPE), solo append
+  <id>.names      nomi, uno per riga: name_id = indice di riga
+  <id>.meta.json  metadati (inizio, ultimo evento, numero eventi)
+
+Il frame path accoda i record in memoria; un thread in background li scrive
+a batch (un write + fsync per batch), quindi nessun I/O blocca il processing.
+"""
+
+import json
+import os
+import re
+import threading
+import atexit
+import numpy as np
+from services.atomic_file import write_json_atomic
+from services.export_stream import iter_chunks
+from config.settings import SESSIONS_DIR, SESSION_FLUSH_INTERVAL
+
+LOG_DTYPE = np.dtype([
+    ('timestamp', '<f8'), ('name_id', '<u2'), ('confidence', '<f4'), ('box', '<i4', (4,)),
+])
+
+_SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def _paths(session_id, directory):
+    base = os.path.join(directory, session_id)
+    return f'{base}.events', f'{base}.names', f'{base}.meta.json'
+
+
+class SessionLog:
+    def __init__(self, session_id, started_at, directory=SESSIONS_DIR,
+                 flush_interval=SESSION_FLUSH_INTERVAL):
+        self.session_id = session_id
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.events_path, self.names_path, self.meta_path = _paths(session_id, directory)
+        # I name_id ripartono da 0: accodare ai file di un'altra sessione confonderebbe i nomi
+        if any(os.path.exists(p) for p in (self.events_path, self.names_path, self.meta_path)):
+            raise FileExistsError(f'Sessione già esistente: {session_id}')
+
+        self.meta = {'session_id': session_id, 'started_at': started_at,
+                     'last_timestamp': None, 'event_count': 0}
+        self._name_ids = {}
+        self._new_names = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name=f'session-log-{session_id}',
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, timestamp, name, confidence, box):
+        """Accoda un evento (solo memoria, nessun I/O)."""
+        with self._lock:
+            name_id = self._name_ids.get(name)
+            if name_id is None:
+                name_id = self._name_ids[name] = len(self._name_ids)
+                self._new_names.append(name)
+            self._pending.append((timestamp, name_id, confidence, box[:4]))
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f'[SessionLog] Errore scrittura {self.session_id}: {e}')
+
+    def flush(self):
+        """Scrive su disco il batch accodato (nomi prima degli eventi)."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            new_names, self._new_names = self._new_names, []
+        if not pending and not new_names:
+            return
+
+        if new_names:
+            with open(self.names_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(n.replace('\n', ' ') + '\n' for n in new_names))
+
+        if pending:
+            records = np.array(pending, dtype=LOG_DTYPE)
+            with open(self.events_path, 'ab') as f:
+                f.write(records.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.meta['event_count'] += len(records)
+            self.meta['last_timestamp'] = float(records['timestamp'][-1])
+
+        write_json_atomic(self.meta_path, self.meta)
+
+    def close(self):
+        """Ferma il flusher e scrive gli eventi rimasti."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+
+def list_sessions(directory=SESSIONS_DIR):
+    """Sessioni persistite, dalla più recente."""
+    sessions = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.meta.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        events_path = _paths(meta['session_id'], directory)[0]
+        meta['size_bytes'] = os.path.getsize(events_path) if os.path.exists(events_path) else 0
+        sessions.append(meta)
+    return sorted(sessions, key=lambda m: m.get('started_at') or 0, reverse=True)
+
+
+def load_session(session_id, directory=SESSIONS_DIR):
+    """
+    Carica una sessione persistita.
+    Ritorna (records, names): records è un memmap read-only di LOG_DTYPE
+    (eventuale record finale troncato ignorato), names la lista dei nomi.
+    Ritorna None se la sessione non esiste.
+    """
+    if not _SESSION_ID_RE.match(session_id or ''):
+        return None
+    events_path, names_path, meta_path = _paths(session_id, directory)
+    if not os.path.exists(meta_path):
+        return None
+
+    names = []
+    if os.path.exists(names_path):
+        with open(names_path, encoding='utf-8') as f:
+            names = [line.rstrip('\n') for line in f]
+
+    count = os.path.getsize(events_path) // LOG_DTYPE.itemsize if os.path.exists(events_path) else 0
+    if count == 0:
+        return np.empty(0, dtype=LOG_DTYPE), names
+    records = np.memmap(events_path, dtype=LOG_DTYPE, mode='r', shape=(count,))
+    return records, names
+
+
+def record_to_event(record, names):
+    """Record del log → dict evento (stesso formato degli eventi live)."""
+    name_id = int(record['name_id'])
+    return {
+        'timestamp': float(record['timestamp']),
+        'name': names[name_id] if name_id < len(names) else 'Unknown',
+        'confidence': round(float(record['confidence']), 3),
+        'box': [int(v) for v in record['box']],
+    }
+
+
+def iter_session_blocks(records, names, start=None, end=None, name=None):
+    """Blocchi di eventi (dict) di una sessione persistita, filtrati, a memoria costante."""
+    name_mask = None
+    if name:
+        name_id = names.index(name) if name in names else -1
+
+        def name_mask(chunk):
+            return chunk['name_id'] == name_id
+
+    for chunk in iter_chunks(records, start, end, name_mask):
+        yield [record_to_event(r, names) for r in chunk]
@@ -1,27 +1,53 @@
 """Pipeline di processing video - orchestra detection e recognition."""
 
-import base64
 import time
 import cv2
 import numpy as np
-from config.settings import FRAME_RESIZE_WIDTH
+from services.frame_codec import decode_image
+from services.frame_context import FrameContext
+from services.face_tracker import FaceTracker
+from services.frame_ingest import LatestFrameSlot, new_ingest_stats
+from services.quality_controller import QualityController
+from services.metrics import StageLatency
+from config.settings import FRAME_RESIZE_WIDTH, QOS_ENABLED
 
 
 class VideoProcessor:
-    def __init__(self, face_detector, face_recognizer, analytics_tracker):
+    """
+    Stato della pipeline per un singolo stream video (una connessione socket).
+    Detector, recognizer e analytics sono condivisi tra tutti gli stream;
+    FPS, timing, tracker e impostazioni sono per stream.
+    encoder: EncodingDispatcher condiviso (encoding in batch con gli altri
+    stream); None = encoding diretto del frame con il detector.
+    """
+
+    def __init__(self, face_detector, face_recognizer, analytics_tracker, qos_enabled=QOS_ENABLED,
+                 encoder=None):
         self.detector = face_detector
         self.recognizer = face_recognizer
         self.tracker = analytics_tracker
+        self.encoder = encoder
+        self.face_tracker = FaceTracker()
 
         self.frame_count = 0
         self.fps = 0
         self.last_fps_time = time.time()
         self.fps_frame_count = 0
+        self.last_frame_time = 0.0
         self.show_landmarks = False
         self.detect_emotions = False
+        self.threshold = face_recognizer.threshold  # Soglia di questo stream
 
-        # Timing per pipeline visualization
+        # Timing per pipeline visualization (ultimo frame) e istogrammi per stage
         self.pipeline_timing = {}
+        self.latency = StageLatency()
+
+        # Controller QoS: adatta detection e stage opzionali a TARGET_FPS
+        self.qos = QualityController(enabled=qos_enabled)
+
+        # Slot di ingestion dello stream e contatori ricevuti/processati/scartati
+        self.ingest_stats = new_ingest_stats()
+        self.ingest = LatestFrameSlot(self.ingest_stats)
 
     def process_frame(self, frame_data):
         """
@@ -29,41 +55,77 @@ class VideoProcessor:
         Ritorna risultati per il frontend.
         """
         start_time = time.time()
+        self.pipeline_timing = {}
+        qos = self.qos.current()
 
         # Step 1: Decode
         t0 = time.time()
         frame = self._decode_frame(frame_data)
         if frame is None:
+            self.ingest_stats['errors'] += 1
             return None
         self.pipeline_timing['decode'] = round((time.time() - t0) * 1000, 1)
 
         # Step 2: Pre-processing (resize)
         t0 = time.time()
         frame = self._preprocess(frame)
+        # Contesto condiviso: una sola conversione RGB/gray per frame
+        ctx = FrameContext(frame)
         self.pipeline_timing['preprocess'] = round((time.time() - t0) * 1000, 1)
 
-        # Step 3: Face Detection
-        t0 = time.time()
-        face_locations = self.detector.detect_faces(frame)
-        self.pipeline_timing['detection'] = round((time.time() - t0) * 1000, 1)
-
-        # Step 4: Face Encoding
-        t0 = time.time()
-        face_encodings = self.detector.get_face_encodings(frame, face_locations)
-        self.pipeline_timing['encoding'] = round((time.time() - t0) * 1000, 1)
-
-        # Step 5: Recognition
-        t0 = time.time()
-        results = self.recognizer.recognize_faces(face_encodings, face_locations)
-        self.pipeline_timing['recognition'] = round((time.time() - t0) * 1000, 1)
-
-        # Step 6: Landmarks (opzionale)
-        landmarks_data = None
-        if self.show_landmarks and face_locations:
+        try:
+            # Step 3: Face Detection (o box previsti dal tracker se il QoS la salta)
+            t0 = time.time()
+            face_locations = None
+            if self.frame_count % qos['detect_every'] and self.face_tracker.tracks:
+                face_locations = self.face_tracker.predicted_locations(ctx.shape)
+            detected = not face_locations
+            if detected:
+                scale = self.detector.scale * qos['detection_width'] / float(FRAME_RESIZE_WIDTH)
+                face_locations = self.detector.detect_faces(ctx, scale=min(1.0, scale),
+                                                            upsample=qos['upsample'])
+            self.pipeline_timing['detection'] = round((time.time() - t0) * 1000, 1)
+
+            # Step 4: Tracking - associa i volti ai track dei frame precedenti
+            t0 = time.time()
+            tracks = self.face_tracker.update(face_locations, detected)
+            gallery_version = self.recognizer.gallery_version
+            to_encode = [i for i, track in enumerate(tracks)
+                         if self.face_tracker.needs_encoding(track, gallery_version,
+                                                             qos['reencode_factor'])]
+            self.pipeline_timing['tracking'] = round((time.time() - t0) * 1000, 1)
+
+            # Step 5: Face Encoding (solo volti nuovi o da rinfrescare)
             t0 = time.time()
-            landmarks_list = self.detector.get_face_landmarks(frame, face_locations)
-            landmarks_data = landmarks_list
-            self.pipeline_timing['landmarks'] = round((time.time() - t0) * 1000, 1)
+            encode_locations = [face_locations[i] for i in to_encode]
+            if not to_encode:
+                face_encodings = []
+            elif self.encoder is not None:
+                face_encodings = self.encoder.encode(ctx, encode_locations, stream=id(self))
+            else:
+                face_encodings = self.detector.get_face_encodings(ctx, encode_locations)
+            self.pipeline_timing['encoding'] = round((time.time() - t0) * 1000, 1)
+
+            # Step 6: Recognition
+            t0 = time.time()
+            recognized = self.recognizer.recognize_faces(face_encodings, encode_locations,
+                                                         threshold=self.threshold)
+            for i, result in zip(to_encode, recognized):
+                self.face_tracker.set_identity(tracks[i], result, gallery_version)
+            results = [self._track_result(track, loc) for track, loc in zip(tracks, face_locations)]
+            self.pipeline_timing['recognition'] = round((time.time() - t0) * 1000, 1)
+
+            # Step 7: Landmarks (opzionale)
+            landmarks_data = None
+            if self.show_landmarks and qos['landmarks'] and face_locations:
+                t0 = time.time()
+                landmarks_list = self.detector.get_face_landmarks(ctx, face_locations)
+                landmarks_data = landmarks_list
+                self.pipeline_timing['landmarks'] = round((time.time() - t0) * 1000, 1)
+
+        finally:
+            # Libera risorse legate al frame (es. slot shared memory dei worker)
+            ctx.release()
 
         # Calcola FPS
         self.fps_frame_count += 1
@@ -76,6 +138,8 @@ class VideoProcessor:
         # Latenza totale
         total_latency = round((time.time() - start_time) * 1000, 1)
         self.pipeline_timing['total'] = total_latency
+        self.qos.observe(self.pipeline_timing)
+        self.latency.observe(self.pipeline_timing)
 
         # Aggiorna analytics
         self.tracker.track_detection(results, self.fps, total_latency)
@@ -96,19 +160,22 @@ class VideoProcessor:
                     face['landmarks'] = landmarks_data[i]
 
         self.frame_count += 1
+        self.last_frame_time = time.time()
         return response
 
+    def _track_result(self, track, face_location):
+        """Risultato per un volto tracciato: identità del track, box corrente."""
+        top, right, bottom, left = face_location
+        result = dict(track.identity)
+        result['box'] = [left, top, right - left, bottom - top]
+        result['track_id'] = track.track_id
+        return result
+
     def _decode_frame(self, frame_data):
-        """Decodifica frame base64 → OpenCV numpy array."""
-        try:
-            if ',' in frame_data:
-                frame_data = frame_data.split(',')[1]
-            img_bytes = base64.b64decode(frame_data)
-            nparr = np.frombuffer(img_bytes, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            return frame
-        except Exception:
-            return None
+        """Decodifica frame (JPEG/WebP binario o base64) → OpenCV numpy array."""
+        if isinstance(frame_data, np.ndarray):
+            return frame_data  # Già decodificato (es. file video offline)
+        return decode_image(frame_data)
 
     def _preprocess(self, frame):
         """Ridimensiona frame per performance."""
@@ -127,7 +194,8 @@ class VideoProcessor:
         if 'detect_emotions' in settings:
             self.detect_emotions = settings['detect_emotions']
         if 'threshold' in settings:
-            self.recognizer.set_threshold(settings['threshold'])
+            self.threshold = self.recognizer.percent_to_distance(settings['threshold'])
+            self.face_tracker.invalidate()
 
     def get_performance_stats(self):
         """Stats per Tech showcase / Performance monitor."""
@@ -135,9 +203,13 @@ class VideoProcessor:
             'fps': self.fps,
             'frame_count': self.frame_count,
             'pipeline_timing': self.pipeline_timing,
+            'frames': dict(self.ingest_stats),
+            'queue_depth': self.ingest.depth,
+            'latency': self.latency.summary(),
+            'qos': self.qos.state(),
             'settings': {
                 'show_landmarks': self.show_landmarks,
                 'detect_emotions': self.detect_emotions,
-                'threshold': self.recognizer.threshold,
+                'threshold': self.threshold,
             }
         }
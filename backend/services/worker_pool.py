@@ -0,0 +1,178 @@
+"""
+Esecuzione di detection/encoding/landmarks in un pool di processi.
+
+Il frame viene scritto una sola volta in un blocco di shared memory riusabile:
+ai worker viaggia solo il descrittore (nome, shape, dtype), non i pixel.
+L'attesa del risultato avviene in un thread nativo (eventlet.tpool), quindi
+il loop eventlet continua a servire REST e altri socket nel frattempo.
+"""
+
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from services.face_detector import FaceDetector
+from services.frame_context import FrameContext
+
+try:
+    from eventlet import tpool
+except ImportError:  # Esecuzione fuori dal server (CLI, benchmark)
+    tpool = None
+
+
+# ==========================================
+# Lato worker
+# ==========================================
+
+_worker_detector = None
+_worker_segments = {}
+
+
+def _init_worker():
+    global _worker_detector
+    _worker_detector = FaceDetector()
+
+
+def _attach(descriptor):
+    """Vista numpy (senza copia) sul frame condiviso dal processo principale."""
+    name, shape, dtype = descriptor
+    shm = _worker_segments.get(name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # Il segmento appartiene al processo principale: il worker non deve
+            # rimuoverlo all'uscita
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        _worker_segments[name] = shm
+    frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return FrameContext(frame)
+
+
+def _run_detect(descriptor, scale, upsample):
+    return _worker_detector.detect_faces(_attach(descriptor), scale, upsample)
+
+
+def _run_encode(descriptor, face_locations):
+    return _worker_detector.get_face_encodings(_attach(descriptor), face_locations)
+
+
+def _run_landmarks(descriptor, face_locations):
+    return _worker_detector.get_face_landmarks(_attach(descriptor), face_locations)
+
+
+def _run_encode_chips(chips):
+    return _worker_detector.encode_face_chips(chips)
+
+
+# ==========================================
+# Lato processo principale
+# ==========================================
+
+class _SharedSlots:
+    """Blocchi di shared memory riusabili, uno per frame in volo."""
+
+    def __init__(self):
+        self._free = []
+        self._all = []
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes):
+        with self._lock:
+            for i, shm in enumerate(self._free):
+                if shm.size >= nbytes:
+                    return self._free.pop(i)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        with self._lock:
+            self._all.append(shm)
+        return shm
+
+    def release(self, shm):
+        with self._lock:
+            self._free.append(shm)
+
+    def close(self):
+        with self._lock:
+            for shm in self._all:
+                shm.close()
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+            self._all = []
+            self._free = []
+
+
+class PooledFaceDetector(FaceDetector):
+    """
+    FaceDetector con le fasi CPU-bound eseguite nel pool di processi.
+    Stessa interfaccia di FaceDetector: check_quality, estimate_face_angle e get_face_chips
+    restano locali perché leggere.
+    """
+
+    def __init__(self, processes):
+        super().__init__()
+        self.processes = processes
+        self._executor = None  # Creato al primo frame (i worker non ri-creano il pool)
+        self._executor_lock = threading.Lock()
+        self._slots = _SharedSlots()
+        atexit.register(self.shutdown)
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                     initializer=_init_worker)
+            return self._executor
+
+    def _share(self, ctx):
+        """Copia il frame in shared memory (una volta per FrameContext)."""
+        if ctx.shared is None:
+            bgr = np.ascontiguousarray(ctx.bgr)
+            shm = self._slots.acquire(bgr.nbytes)
+            np.ndarray(bgr.shape, dtype=bgr.dtype, buffer=shm.buf)[...] = bgr
+            ctx.shared = (shm.name, bgr.shape, bgr.dtype.str)
+            ctx.on_release(lambda: self._slots.release(shm))
+        return ctx
+
+    def _call(self, fn, frame, *args):
+        """
+        Esegue fn nel pool sul frame condiviso e attende senza bloccare il loop.
+        Se il chiamante passa un array (non un FrameContext) lo slot viene
+        liberato subito dopo la chiamata.
+        """
+        ctx = FrameContext.wrap(frame)
+        try:
+            self._share(ctx)
+            future = self._get_executor().submit(fn, ctx.shared, *args)
+            if tpool is not None:
+                return tpool.execute(future.result)
+            return future.result()
+        finally:
+            if ctx is not frame:
+                ctx.release()
+
+    def detect_faces(self, frame, scale=None, upsample=None):
+        return self._call(_run_detect, frame, scale, upsample)
+
+    def get_face_encodings(self, frame, face_locations=None):
+        return self._call(_run_encode, frame, face_locations)
+
+    def get_face_landmarks(self, frame, face_locations=None):
+        return self._call(_run_landmarks, frame, face_locations)
+
+    def encode_face_chips(self, chips):
+        # Chiamato dal thread nativo dell'EncodingDispatcher: attesa diretta, senza tpool.
+        # I crop sono piccoli (150x150) e viaggiano serializzati, senza shared memory
+        if not chips:
+            return []
+        return self._get_executor().submit(_run_encode_chips, chips).result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._slots.close()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I test girano dalla root del repo o da backend: i moduli si importano come in app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+import math
+import numpy as np
+from services.auto_capture import AutoCapture
+
+FRONT = {'is_frontal': True, 'is_right': False, 'is_left': False, 'pitch': 0.4}
+RIGHT = {'is_frontal': False, 'is_right': True, 'is_left': False, 'pitch': None}
+
+
+def _frame(value=0):
+    return np.full((100, 100, 3), value, dtype=np.uint8)
+
+
+def _offer(capture, sharpness, angle=FRONT, value=0, **kwargs):
+    return capture.offer(_frame(value), (40, 60, 60, 40), {'is_good': True, 'sharpness': sharpness},
+                         angle, **kwargs)
+
+
+def test_keeps_best_n_per_pose():
+    capture = AutoCapture(samples={'front': 2, 'right': 1}, min_interval=0)
+    for value, sharpness in enumerate((10, 50, 5, 80, 30)):
+        _offer(capture, sharpness, value=value)
+    # Un candidato peggiore dei migliori N non entra
+    assert _offer(capture, 1)['accepted'] is False
+    assert not capture.is_complete()
+    assert _offer(capture, 20, RIGHT)['accepted']
+    assert capture.is_complete() and capture.total_captured == 3
+
+    selected = capture.selected()
+    assert [step for step, _, _ in selected] == ['front', 'front', 'right']
+    # Migliori N dal migliore: sharpness 80 (frame 3) e 50 (frame 1)
+    assert [int(crop[0, 0, 0]) for _, crop, _ in selected[:2]] == [3, 1]
+    crop, box = selected[0][1], selected[0][2]
+    assert crop.shape == (40, 40, 3) and box == (10, 30, 30, 10)
+
+
+def test_rejections_and_progress():
+    capture = AutoCapture(samples={'front': 1, 'right': 1}, min_interval=60)
+    result = _offer(capture, 10, RIGHT, step='front')
+    assert result['pose'] == 'right' and not result['accepted']  # Posa diversa da quella richiesta
+    assert not capture.offer(_frame(), (40, 60, 60, 40), {'is_good': False}, FRONT)['accepted']
+
+    first = _offer(capture, 10)
+    assert first['accepted'] and first['score'] == round(math.log1p(10), 3)
+    assert not _offer(capture, 1000)['accepted']  # Entro min_interval dall'ultimo accettato
+    assert first['progress'] == {'front': {'captured': 1, 'required': 1},
+                                 'right': {'captured': 0, 'required': 1}}
+
+
+def test_pitch_relative_to_frontal_baseline():
+    capture = AutoCapture(samples={'front': 1, 'up': 1, 'down': 1}, pitch_delta=0.1)
+    assert capture.classify(dict(FRONT, pitch=0.9)) == 'front'  # Nessun riferimento ancora
+    _offer(capture, 10)
+    assert capture.pitch_baseline() == 0.4
+    assert capture.classify(dict(FRONT, pitch=0.2)) == 'up'
+    assert capture.classify(dict(FRONT, pitch=0.6)) == 'down'
+    assert capture.classify(dict(FRONT, pitch=0.45)) == 'front'
+    assert capture.classify(None) is None
@@ -0,0 +1,50 @@
+import csv
+import io
+import json
+import numpy as np
+from services.export_stream import CSV_HEADER, csv_stream, iter_chunks, json_stream, time_slice
+
+DTYPE = np.dtype([('timestamp', 'f8'), ('name', 'U8')])
+
+
+def _records():
+    return np.array([(float(t), 'Anna' if t % 2 else 'Bruno') for t in range(10)], dtype=DTYPE)
+
+
+def _event(t, name='Anna'):
+    return {'timestamp': t, 'name': name, 'confidence': 0.9, 'box': [1, 2, 3, 4]}
+
+
+def test_time_slice_is_inclusive():
+    timestamps = np.arange(10, dtype=np.float64)
+    assert time_slice(timestamps) == (0, 10)
+    assert time_slice(timestamps, 2, 5) == (2, 6)
+    assert time_slice(timestamps, 2.5, 2.7) == (3, 3)
+    assert time_slice(timestamps, 8, 3) == (8, 8)  # Range vuoto, mai hi < lo
+
+
+def test_iter_chunks_filters_by_range_and_name():
+    chunks = list(iter_chunks(_records(), 2, 8, chunk_size=3))
+    assert [c['timestamp'].tolist() for c in chunks] == [[2, 3, 4], [5, 6, 7], [8]]
+
+    anna = list(iter_chunks(_records(), 2, 8, lambda c: c['name'] == 'Anna', chunk_size=3))
+    assert np.concatenate(anna)['timestamp'].tolist() == [3, 5, 7]
+    # I blocchi senza record accettati non vengono restituiti
+    none = list(iter_chunks(_records(), None, None, lambda c: c['name'] == 'Carla', chunk_size=3))
+    assert none == []
+
+
+def test_json_stream_is_valid_json():
+    blocks = [[_event(1.0)], [], [_event(2.0, 'Bruno'), _event(3.0)]]
+    data = json.loads(''.join(json_stream({'session': {'id': 's'}}, iter(blocks))))
+    assert data['session'] == {'id': 's'}
+    assert [e['timestamp'] for e in data['events']] == [1.0, 2.0, 3.0]
+    assert json.loads(''.join(json_stream({}, iter([])))) == {'events': []}
+
+
+def test_csv_stream_rows():
+    text = ''.join(csv_stream(iter([[_event(1.0)], [_event(2.0, 'Bruno')]])))
+    rows = list(csv.reader(io.StringIO(text)))
+    assert rows[0] == CSV_HEADER
+    assert rows[1:] == [['1.0', 'Anna', '0.9', '1', '2', '3', '4'],
+                        ['2.0', 'Bruno', '0.9', '1', '2', '3', '4']]
@@ -0,0 +1,52 @@
+import numpy as np
+from services.face_recognizer import FaceRecognizer
+
+DIM = 128
+
+
+class _RecordingRecognizer(FaceRecognizer):
+    """Registra ogni snapshot pubblicato (assegnamento di self.snapshot)."""
+
+    def __setattr__(self, name, value):
+        if name == 'snapshot':
+            self.__dict__.setdefault('published', []).append(value)
+        super().__setattr__(name, value)
+
+
+def _profiles(rng, count=4, samples=3):
+    return [{'id': f'p{i}', 'name': f'n{i}', 'color': '#fff',
+             'encodings': rng.normal(size=(samples, DIM)).astype(np.float32) * 0.3}
+            for i in range(count)]
+
+
+def test_update_profile_publishes_one_complete_snapshot():
+    rng = np.random.default_rng(0)
+    recognizer = _RecordingRecognizer()
+    profiles = _profiles(rng)
+    recognizer.load_profiles(profiles)
+    recognizer.published.clear()
+
+    new_encodings = rng.normal(size=(2, DIM)).astype(np.float32) * 0.3
+    recognizer.update_profile({'id': 'p1', 'name': 'n1', 'color': '#fff', 'encodings': new_encodings})
+
+    assert len(recognizer.published) == 1
+    snap = recognizer.published[0]
+    assert sorted(snap.profile_ids[p] for p in snap.live_slots) == ['p0', 'p1', 'p2', 'p3']
+    results = recognizer.recognize_faces(new_encodings, [(0, 10, 10, 0)] * 2)
+    assert [r['profile_id'] for r in results] == ['p1', 'p1']
+    # Le vecchie righe del profilo non fanno più match
+    old = recognizer.recognize_faces(profiles[1]['encodings'][:1], [(0, 10, 10, 0)], threshold=1e-3)
+    assert old[0]['profile_id'] is None
+
+
+def test_remove_then_compaction_keeps_live_profiles():
+    rng = np.random.default_rng(1)
+    recognizer = FaceRecognizer()
+    profiles = _profiles(rng)
+    recognizer.load_profiles(profiles)
+    for pid in ('p0', 'p1', 'p2'):
+        assert recognizer.remove_profile(pid)
+    assert recognizer.profile_names == ['n3']
+    assert len(recognizer.gallery) == 3  # Compattata: solo le righe vive
+    results = recognizer.recognize_faces(profiles[3]['encodings'][:1], [(0, 10, 10, 0)])
+    assert results[0]['profile_id'] == 'p3'
@@ -0,0 +1,61 @@
+from services.face_tracker import FaceTracker, box_iou
+
+
+def _box(x, y, size=40):
+    return (y, x + size, y + size, x)  # (top, right, bottom, left)
+
+
+def test_box_iou():
+    assert box_iou(_box(0, 0), _box(0, 0)) == 1.0
+    assert box_iou(_box(0, 0), _box(100, 100)) == 0.0
+    assert abs(box_iou(_box(0, 0), _box(20, 0)) - 1 / 3) < 1e-9
+
+
+def test_association_keeps_ids_and_follows_motion():
+    tracker = FaceTracker(iou_threshold=0.3, max_misses=1)
+    a, b = tracker.update([_box(0, 0), _box(200, 0)])
+    # Entrambi i volti si spostano di 10px a destra, in ordine inverso
+    moved = tracker.update([_box(210, 0), _box(10, 0)])
+    assert [t.track_id for t in moved] == [b.track_id, a.track_id]
+    assert a.velocity[1] > 0
+
+    # Un volto sparisce: il track sopravvive max_misses frame, poi viene eliminato
+    tracker.update([_box(20, 0)])
+    assert len(tracker.tracks) == 2
+    tracker.update([_box(30, 0)])
+    assert [t.track_id for t in tracker.tracks] == [a.track_id]
+
+
+def test_reencoding_rules():
+    tracker = FaceTracker(reencode_interval=3, min_confidence=0.5)
+    track, = tracker.update([_box(0, 0)])
+    assert tracker.needs_encoding(track, gallery_version=1)
+    tracker.set_identity(track, {'name': 'Anna'}, 1)
+    assert not tracker.needs_encoding(track, 1)
+    assert tracker.needs_encoding(track, 2)  # Gallery cambiata
+
+    for _ in range(3):
+        tracker.update([_box(0, 0)])
+    assert tracker.needs_encoding(track, 1)
+    assert not tracker.needs_encoding(track, 1, interval_factor=2)
+
+
+def test_predicted_frames_decay_confidence():
+    tracker = FaceTracker(reencode_interval=100, min_confidence=0.5, prediction_decay=0.8)
+    track, = tracker.update([_box(0, 0)])
+    tracker.update([_box(0, 0)])
+    tracker.set_identity(track, {'name': 'Anna'}, 1)
+    assert track.confidence == 1.0
+
+    # Detection saltata: i box previsti hanno IoU 1 con sé stessi, ma la
+    # confidenza decade finché non arriva una detection reale
+    for _ in range(3):
+        tracker.update(tracker.predicted_locations((480, 640)), detected=False)
+    assert track.frames_since_detection == 3
+    assert abs(track.confidence - 0.8 ** 3) < 1e-9
+    assert not tracker.needs_encoding(track, 1)
+    tracker.update(tracker.predicted_locations((480, 640)), detected=False)
+    assert tracker.needs_encoding(track, 1)  # 0.8^4 < min_confidence
+
+    tracker.update([_box(0, 0)])
+    assert track.confidence == 1.0 and track.frames_since_detection == 0
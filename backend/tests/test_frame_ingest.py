@@ -0,0 +1,42 @@
+from services.frame_ingest import LatestFrameSlot
+
+
+def test_latest_frame_wins_while_busy():
+    slot = LatestFrameSlot(frame_skip=1)
+    handled = []
+
+    def handler(item):
+        # Durante il processing del primo frame ne arrivano altri tre
+        if item == 1:
+            for newer in (2, 3, 4):
+                slot.run(newer, handler)
+        handled.append(item)
+        return item
+
+    slot.run(1, handler)
+    assert handled == [1, 4]  # 2 e 3 sostituiti dal più recente
+    assert slot.stats == {'received': 4, 'processed': 2, 'dropped': 2, 'skipped': 0, 'errors': 0}
+    assert slot.depth == 0
+
+
+def test_failed_frames_are_not_counted_as_processed():
+    slot = LatestFrameSlot(frame_skip=1)
+
+    def handler(item):
+        if item == 'bad':
+            raise ValueError('decode')
+        return None if item == 'empty' else item
+
+    for item in ('ok', 'bad', 'empty', 'ok'):
+        slot.run(item, handler)
+    assert slot.stats['processed'] == 2
+    assert slot.stats['errors'] == 1  # 'empty' è contato da chi lo ha scartato
+
+
+def test_frame_skip_and_discard():
+    slot = LatestFrameSlot(frame_skip=2)
+    results = [slot.offer(i) for i in range(4)]
+    assert results == [True, False, False, False]  # 1 e 3 saltati, 2 in attesa
+    assert slot.stats['skipped'] == 2 and slot.depth == 2
+    slot.discard()
+    assert slot.stats['dropped'] == 1 and slot.next() is None and slot.depth == 0
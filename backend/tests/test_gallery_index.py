@@ -0,0 +1,30 @@
+import numpy as np
+from services.gallery_index import create_index, load_index
+
+DIM = 128
+PARAMS = {
+    'ivf': {'nlist': 4, 'nprobe': 2},
+    'prototype': {'prototypes': 2, 'rerank': 2, 'tolerance': 0.0},
+}
+
+
+def _gallery(rng, profiles=6, samples=4):
+    centers = rng.normal(size=(profiles, DIM)).astype(np.float32)
+    vectors = np.repeat(centers, samples, axis=0) + 0.01 * rng.normal(size=(profiles * samples, DIM))
+    return vectors.astype(np.float32), np.repeat(np.arange(profiles), samples)
+
+
+def test_switching_kind_over_same_file_rebuilds(tmp_path):
+    path = str(tmp_path / 'gallery_index.npz')
+    vectors, labels = _gallery(np.random.default_rng(0))
+    for saved, configured in (('ivf', 'prototype'), ('prototype', 'ivf')):
+        index = create_index(saved, DIM, **PARAMS[saved])
+        index.build(vectors, labels)
+        index.fingerprint = 'abc'
+        index.save(path)
+
+        # Tipo diverso: indice stantio, nessun TypeError dai params dell'altro tipo
+        assert load_index(path, DIM, configured, **PARAMS[configured]) is None
+
+        cached = load_index(path, DIM, saved, **PARAMS[saved])
+        assert cached is not None and cached.kind == saved and cached.fingerprint == 'abc'
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import pytest
+from services.gallery_store import GalleryStore
+
+
+def _store(directory, dtype='float16'):
+    return GalleryStore(os.path.join(directory, 'gallery.meta.json'), directory, dtype=dtype)
+
+
+def test_float16_reopen_and_compact(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    rng = np.random.default_rng(0)
+    store = _store(directory)
+    for i in range(3):
+        store.add_profile({'id': f'p{i}', 'name': f'n{i}'}, rng.normal(size=(2, 128)))
+    assert store.meta['codec'] == store.codec.state()
+
+    # Riapertura: il codec è nel checkpoint, nessuna riquantizzazione
+    monkeypatch.setattr(GalleryStore, 'requantize', lambda self: pytest.fail('requantize non atteso'))
+    reopened = _store(directory)
+    assert [p['id'] for p in reopened.profiles()] == ['p0', 'p1', 'p2']
+    np.testing.assert_allclose(reopened.profiles()[1]['codes'].astype(np.float32),
+                               reopened.profiles()[1]['encodings'], atol=1e-2)
+    monkeypatch.undo()
+
+    # Compattazione: restano solo i file della nuova generazione
+    reopened.remove_profile('p0')
+    reopened.remove_profile('p1')
+    files = set(os.listdir(directory))
+    assert files == {'gallery.meta.json', 'gallery.1.f32',
+                     os.path.basename(reopened._codes_path())}
+    assert [p['id'] for p in _store(directory).profiles()] == ['p2']
@@ -0,0 +1,65 @@
+import types
+import numpy as np
+from services.face_recognizer import FaceRecognizer
+from services.frame_ingest import new_ingest_stats
+from services.metrics import LatencyHistogram, MetricsRegistry, StageLatency
+
+
+def _processor(total_ms, processed):
+    latency = StageLatency()
+    for ms in total_ms:
+        latency.observe({'total': ms, 'detection': ms / 2})
+    stats = new_ingest_stats()
+    stats.update(received=processed + 1, processed=processed, dropped=1)
+    return types.SimpleNamespace(latency=latency, ingest_stats=stats,
+                                 ingest=types.SimpleNamespace(depth=1))
+
+
+def _recognizer():
+    recognizer = FaceRecognizer()
+    recognizer.load_profiles([{'id': 'p0', 'name': 'Anna',
+                               'encodings': np.zeros((3, 128), dtype=np.float32)}])
+    return recognizer
+
+
+def test_histogram_quantiles_and_merge():
+    h = LatencyHistogram(bounds=(10, 20, 50))
+    for ms in (5, 15, 15, 40):
+        h.observe(ms)
+    assert h.counts == [1, 2, 1, 0]
+    assert h.quantile(0.5) == 15.0  # Interpolato nel bucket (10, 20]
+    other = LatencyHistogram(bounds=(10, 20, 50))
+    other.observe(100)  # Bucket +Inf
+    h.merge(other)
+    assert h.count == 5 and h.quantile(1.0) == 50.0
+    assert h.summary()['mean'] == 35.0
+    assert LatencyHistogram().summary() == {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0,
+                                           'count': 0}
+
+
+def test_retired_streams_keep_counters_monotonic():
+    registry = MetricsRegistry()
+    recognizer = _recognizer()
+    a, b = _processor([10, 30], 2), _processor([50], 1)
+    before = registry.snapshot([a, b], recognizer)
+    registry.retire(a)
+    after = registry.snapshot([b], recognizer)
+    assert before['frames'] == after['frames'] == {'received': 5, 'processed': 3, 'dropped': 2,
+                                                  'skipped': 0, 'errors': 0}
+    assert after['latency']['total']['count'] == 3
+    assert after['gauges']['streams'] == 1 and after['gauges']['queue_depth'] == 1
+    assert after['gauges']['gallery_profiles'] == 1 and after['gauges']['gallery_rows'] == 3
+
+
+def test_prometheus_rendering():
+    registry = MetricsRegistry()
+    text = registry.render_prometheus([_processor([10, 30], 2)], _recognizer())
+    lines = text.splitlines()
+    assert '# TYPE facerec_stage_latency_ms histogram' in lines
+    assert 'facerec_stage_latency_ms_bucket{stage="total",le="10"} 1' in lines
+    assert 'facerec_stage_latency_ms_bucket{stage="total",le="+Inf"} 2' in lines
+    assert 'facerec_stage_latency_ms_count{stage="total"} 2' in lines
+    assert 'facerec_frames_total{result="processed"} 2' in lines
+    assert 'facerec_gallery_profiles 1' in lines
+    assert not any('encoding_batch_size' in line for line in lines)  # Nessun dispatcher
+    assert text.endswith('\n')
@@ -0,0 +1,39 @@
+from services.quality_controller import QualityController, QOS_STEPS
+
+
+def _run(qos, timing, frames):
+    for _ in range(frames):
+        qos.observe(timing)
+
+
+def test_degrades_costliest_stage_then_recovers():
+    qos = QualityController(target_fps=10, budget_ms=100, cooldown=2)
+    _run(qos, {'detection': 120, 'landmarks': 10, 'encoding': 5, 'total': 140}, 3)
+    assert qos.steps['detection'] == 1 and qos.history == ['detection']
+    assert qos.current()['detect_every'] == QOS_STEPS['detection'][1]['detect_every']
+
+    # Ben sotto budget: ripristino LIFO fino al livello 0
+    _run(qos, {'detection': 10, 'landmarks': 5, 'encoding': 5, 'total': 20}, 100)
+    assert qos.level == 0 and qos.current()['detect_every'] == 1
+
+
+def test_landmarks_heavy_degrades_landmarks_first():
+    qos = QualityController(target_fps=10, budget_ms=100, cooldown=1)
+    _run(qos, {'detection': 20, 'landmarks': 100, 'encoding': 5, 'total': 130}, 2)
+    assert qos.history[0] == 'landmarks'
+    assert qos.current()['landmarks'] is False
+
+
+def test_absent_stage_average_decays():
+    qos = QualityController(target_fps=10, budget_ms=100, cooldown=1)
+    qos.observe({'landmarks': 200, 'detection': 20, 'total': 50})
+    # Landmarks non più eseguiti: la media decade verso 0
+    _run(qos, {'detection': 60, 'total': 150}, 30)
+    assert qos.avg_stages['landmarks'] < 1
+    assert qos.steps['detection'] > 0
+
+
+def test_disabled_controller_keeps_full_quality():
+    qos = QualityController(target_fps=10, budget_ms=100, cooldown=1, enabled=False)
+    _run(qos, {'detection': 500, 'total': 500}, 20)
+    assert qos.level == 0 and qos.state()['avg_total_ms'] == 500
@@ -0,0 +1,59 @@
+import types
+import numpy as np
+import services.analytics_tracker as analytics
+from services.analytics_tracker import AnalyticsTracker
+from services.ring_buffer import RingBuffer
+
+DTYPE = np.dtype([('time', 'f8'), ('value', 'i4')])
+
+
+def test_overflow_evicts_oldest_in_order():
+    evicted = []
+    ring = RingBuffer(DTYPE, 4, on_evict=lambda records: evicted.extend(records['value']))
+    for i in range(7):
+        ring.append((float(i), i))
+    assert len(ring) == 4
+    assert evicted == [0, 1, 2]
+    assert ring.column('value').tolist() == [3, 4, 5, 6]  # Wrap-around ordinato
+    assert ring.view(2)['value'].tolist() == [5, 6]
+    assert ring.view(2, from_start=True)['value'].tolist() == [3, 4]
+
+
+def test_evict_older_and_view_since():
+    evicted = []
+    ring = RingBuffer(DTYPE, 5, on_evict=lambda records: evicted.extend(records['value']))
+    for i in range(8):
+        ring.append((float(i), i))
+    assert ring.count_older('time', 4.5) == 2
+    assert ring.view_since('time', 5.0)['value'].tolist() == [6, 7]
+    assert ring.evict_older('time', 4.5) == 2
+    assert ring.column('value').tolist() == [5, 6, 7]
+    assert evicted == [0, 1, 2, 3, 4]
+    assert ring.evict_older('time', 100) == 3 and len(ring) == 0
+    assert ring.view().size == 0
+
+
+def test_analytics_aggregates_follow_window_eviction(monkeypatch):
+    clock = {'now': 1000.0}
+    monkeypatch.setattr(analytics, 'time', types.SimpleNamespace(time=lambda: clock['now']))
+    tracker = AnalyticsTracker(persist=False)
+
+    tracker.track_detection([{'name': 'Anna', 'confidence': 0.9, 'box': [0, 0, 64, 48]}], 15, 40)
+    clock['now'] += analytics.ANALYTICS_WINDOW_SECONDS - 5
+    tracker.track_detection([{'name': 'Bruno', 'confidence': 0.5, 'box': [320, 240, 64, 48]}], 15, 40)
+    stats = tracker.get_session_stats()
+    assert stats['total_detections'] == 2
+    assert stats['confidence'] == {'avg': 0.7, 'min': 0.5, 'max': 0.9}
+    assert sum(b['count'] for b in tracker.get_confidence_distribution()) == 2
+
+    # Il primo evento esce dalla finestra: gli aggregati vengono decrementati
+    clock['now'] += 10
+    tracker.track_detection([], 15, 40)
+    stats = tracker.get_session_stats()
+    assert stats['total_detections'] == 1
+    assert stats['confidence'] == {'avg': 0.5, 'min': 0.5, 'max': 0.5}
+    assert [b['count'] for b in tracker.get_confidence_distribution()][10] == 1
+    assert sum(b['count'] for b in tracker.get_confidence_distribution()) == 1
+    timeline = tracker.get_timeline_data()
+    assert [set(e) - {'timestamp'} for e in timeline] == [{'Bruno'}]
+    assert [e['name'] for e in tracker.get_recent_events()] == ['Bruno']
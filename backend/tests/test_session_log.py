@@ -0,0 +1,45 @@
+import pytest
+from services.session_log import SessionLog, list_sessions, load_session, record_to_event
+
+
+def test_round_trip(tmp_path):
+    directory = str(tmp_path)
+    log = SessionLog('session_1', 100.0, directory=directory, flush_interval=60)
+    log.append(101.0, 'Anna', 0.9, [1, 2, 3, 4])
+    log.append(102.0, 'Unknown', 0.2, [5, 6, 7, 8])
+    log.flush()
+    log.append(103.0, 'Anna', 0.8, [9, 10, 11, 12])
+    log.close()
+
+    records, names = load_session('session_1', directory)
+    events = [record_to_event(r, names) for r in records]
+    assert [e['name'] for e in events] == ['Anna', 'Unknown', 'Anna']
+    assert events[2] == {'timestamp': 103.0, 'name': 'Anna', 'confidence': 0.8,
+                         'box': [9, 10, 11, 12]}
+    meta, = list_sessions(directory)
+    assert meta['event_count'] == 3 and meta['last_timestamp'] == 103.0
+
+
+def test_truncated_trailing_record_is_ignored(tmp_path):
+    directory = str(tmp_path)
+    log = SessionLog('session_1', 100.0, directory=directory, flush_interval=60)
+    log.append(101.0, 'Anna', 0.9, [1, 2, 3, 4])
+    log.close()
+    with open(log.events_path, 'ab') as f:
+        f.write(b'\x00' * 5)
+    records, _ = load_session('session_1', directory)
+    assert len(records) == 1
+
+
+def test_existing_session_is_not_reused(tmp_path):
+    directory = str(tmp_path)
+    log = SessionLog('session_1', 100.0, directory=directory, flush_interval=60)
+    log.append(101.0, 'Anna', 0.9, [1, 2, 3, 4])
+    log.close()
+    with pytest.raises(FileExistsError):
+        SessionLog('session_1', 200.0, directory=directory, flush_interval=60)
+
+
+def test_invalid_or_missing_session(tmp_path):
+    assert load_session('../etc', str(tmp_path)) is None
+    assert load_session('session_missing', str(tmp_path)) is None
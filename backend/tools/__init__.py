@@ -0,0 +1 @@
+"""Strumenti a riga di comando (import e processing offline)."""
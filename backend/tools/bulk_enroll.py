@@ -0,0 +1,258 @@
+"""
+Enrollment offline da cartelle di immagini: una sottocartella per persona.
+
+    root/
+      Mario Rossi/  001.jpg 002.jpg ...
+      Anna Bianchi/ ...
+
+Detection, check_quality ed encoding girano in un pool di processi; i profili
+vengono scritti direttamente nella gallery (append atomico). Ogni immagine
+scartata finisce nel report CSV con il motivo. Le immagini di una persona che
+ha già --max-samples encoding non vengono elaborate; la thumbnail viene
+generata solo dal primo sample accettato.
+
+Uso (dalla directory backend, a server fermo: il server legge la gallery all'avvio):
+    python -m tools.bulk_enroll /path/to/root --report report.csv
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import cv2
+from services.face_detector import FaceDetector
+from services.frame_context import FrameContext
+from services.enrollment_manager import EnrollmentManager, make_thumbnail, MIN_SAMPLES
+from config.settings import (
+    FRAME_RESIZE_WIDTH, BULK_MAX_PROFILES, TOTAL_ENROLLMENT_SAMPLES, WORKER_PROCESSES
+)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+PROFILE_COLORS = ['#00d9ff', '#00ff88', '#ffd700', '#ff4444', '#a855f7', '#ff8c00']
+REPORT_HEADER = ['person', 'image', 'status', 'reason', 'message']
+
+
+# ==========================================
+# Lato worker
+# ==========================================
+
+_worker_detector = None
+
+
+def _init_worker():
+    global _worker_detector
+    _worker_detector = FaceDetector()
+
+
+def _load_image(path):
+    """Legge l'immagine e la porta alla larghezza del frame path live."""
+    frame = cv2.imread(path)
+    if frame is None:
+        return None
+    h, w = frame.shape[:2]
+    if w > FRAME_RESIZE_WIDTH:
+        frame = cv2.resize(frame, (FRAME_RESIZE_WIDTH, int(h * FRAME_RESIZE_WIDTH / w)),
+                           interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def process_image(path, check_quality=True):
+    """
+    Detection → qualità → encoding su una singola immagine.
+    Ritorna dict con 'encoding' (o None), 'reason'/'message' se scartata
+    e 'location' del volto (per la thumbnail, generata dal processo principale).
+    """
+    frame = _load_image(path)
+    if frame is None:
+        return {'encoding': None, 'reason': 'unreadable', 'message': 'Immagine non leggibile'}
+
+    ctx = FrameContext(frame)
+    locations = _worker_detector.detect_faces(ctx)
+    if len(locations) == 0:
+        return {'encoding': None, 'reason': 'no_face', 'message': 'Nessun volto rilevato'}
+    if len(locations) > 1:
+        return {'encoding': None, 'reason': 'multiple_faces',
+                'message': f'{len(locations)} volti nell\'immagine'}
+
+    if check_quality:
+        quality = _worker_detector.check_quality(ctx, locations[0])
+        if not quality['is_good']:
+            return {'encoding': None, 'reason': 'quality', 'message': quality['message']}
+
+    encodings = _worker_detector.get_face_encodings(ctx, locations)
+    if not encodings:
+        return {'encoding': None, 'reason': 'encoding_failed',
+                'message': 'Impossibile generare encoding'}
+
+    return {'encoding': encodings[0], 'reason': None, 'message': '',
+            'location': tuple(locations[0])}
+
+
+# ==========================================
+# Lato processo principale
+# ==========================================
+
+def scan_folders(root):
+    """Ritorna [(persona, [percorsi immagini ordinati])] dalle sottocartelle di root."""
+    people = []
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        if not os.path.isdir(folder):
+            continue
+        images = sorted(
+            os.path.join(folder, f) for f in os.listdir(folder)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        people.append((name, images))
+    return people
+
+
+def run(root, report_path, workers=0, max_samples=TOTAL_ENROLLMENT_SAMPLES,
+        max_profiles=BULK_MAX_PROFILES, check_quality=True):
+    manager = EnrollmentManager()
+    workers = workers or WORKER_PROCESSES or os.cpu_count() or 1
+    summary = {'profiles_added': 0, 'profiles_skipped': 0, 'images_accepted': 0,
+               'images_rejected': 0, 'images_skipped': 0}
+
+    with open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+        report = csv.writer(report_file)
+        report.writerow(REPORT_HEADER)
+
+        # Persone da importare: escluse quelle già presenti e oltre il limite profili
+        people = []
+        skipped_cap = 0
+        free = max_profiles - len(manager.profiles) if max_profiles else float('inf')
+        for person, images in scan_folders(root):
+            if manager.find_profile_by_name(person):
+                report.writerow([person, '', 'skipped', 'profile_exists', 'Profilo già esistente'])
+            elif len(people) >= free:
+                report.writerow([person, '', 'skipped', 'max_profiles',
+                                 f'Massimo {max_profiles} profili raggiunto'])
+                skipped_cap += 1
+            else:
+                people.append((person, images))
+                continue
+            summary['profiles_skipped'] += 1
+
+        if skipped_cap:
+            print(f'[BulkEnroll] Attenzione: {skipped_cap} persone saltate, limite di '
+                  f'{max_profiles} profili raggiunto (usa --max-profiles)', file=sys.stderr)
+
+        total = sum(len(images) for _, images in people)
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # Le immagini di tutte le persone condividono il pool (resta pieno
+            # anche tra una persona e l'altra), con al più workers * 4 in volo
+            # così quelle di una persona già completa non vengono inviate
+            pending = deque((person, path) for person, images in people for path in images)
+            in_flight = deque()
+            state = {person: {'encodings': [], 'thumbnail': None, 'remaining': len(images)}
+                     for person, images in people}
+            done = 0
+            while pending or in_flight:
+                while pending and len(in_flight) < workers * 4:
+                    person, path = pending.popleft()
+                    if len(state[person]['encodings']) >= max_samples:
+                        future = None  # Persona completa: immagine non elaborata
+                    else:
+                        future = _submit(pool, path, check_quality)
+                    in_flight.append((person, path, future))
+
+                person, path, future = in_flight.popleft()
+                entry = state[person]
+                image = os.path.relpath(path, root)
+                if future is None or len(entry['encodings']) >= max_samples:
+                    if future is not None:
+                        future.cancel()
+                    report.writerow([person, image, 'skipped', 'max_samples',
+                                     f'Oltre {max_samples} sample'])
+                    summary['images_skipped'] += 1
+                else:
+                    try:
+                        result = future.result()
+                    except Exception as e:  # Errore nel worker (file malformato, pool interrotto)
+                        result = {'encoding': None, 'reason': 'error',
+                                  'message': f'{type(e).__name__}: {e}'}
+                    if result['encoding'] is None:
+                        report.writerow([person, image, 'rejected', result['reason'], result['message']])
+                        summary['images_rejected'] += 1
+                    else:
+                        entry['encodings'].append(result['encoding'])
+                        if entry['thumbnail'] is None:
+                            entry['thumbnail'] = make_thumbnail(_load_image(path), result['location'])
+                        summary['images_accepted'] += 1
+                done += 1
+                _progress(done, total, start)
+
+                entry['remaining'] -= 1
+                if entry['remaining'] == 0:
+                    _save(manager, person, entry, report, summary)
+
+        for person, images in people:
+            if not images:  # Cartella senza immagini
+                _save(manager, person, state[person], report, summary)
+
+        sys.stderr.write('\n')
+        summary['elapsed_s'] = round(time.time() - start, 1)
+    return summary
+
+
+def _submit(pool, path, check_quality):
+    """Invia un'immagine al pool; se il pool è interrotto l'errore finisce nel future."""
+    try:
+        return pool.submit(process_image, path, check_quality)
+    except Exception as e:  # BrokenProcessPool dopo la morte di un worker
+        future = Future()
+        future.set_exception(e)
+        return future
+
+
+def _save(manager, person, entry, report, summary):
+    """Salva il profilo di una persona di cui sono arrivati tutti i risultati."""
+    encodings = entry['encodings']
+    if len(encodings) < MIN_SAMPLES:
+        report.writerow([person, '', 'skipped', 'not_enough_samples',
+                         f'Servono almeno {MIN_SAMPLES} sample validi ({len(encodings)})'])
+        summary['profiles_skipped'] += 1
+        return
+    color = PROFILE_COLORS[len(manager.profiles) % len(PROFILE_COLORS)]
+    manager.save_profile(str(uuid.uuid4())[:8], person, color, encodings, entry['thumbnail'])
+    summary['profiles_added'] += 1
+
+
+def _progress(done, total, start):
+    rate = done / max(time.time() - start, 1e-6)
+    sys.stderr.write(f'\r[BulkEnroll] {done}/{total} immagini ({rate:.1f} img/s)')
+    sys.stderr.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='Cartella con una sottocartella per persona')
+    parser.add_argument('--report', default='bulk_enroll_report.csv', help='Report CSV delle immagini scartate')
+    parser.add_argument('--workers', type=int, default=0, help='Processi (0 = WORKER_PROCESSES o numero CPU)')
+    parser.add_argument('--max-samples', type=int, default=TOTAL_ENROLLMENT_SAMPLES,
+                        help='Encoding massimi per persona')
+    parser.add_argument('--max-profiles', type=int, default=BULK_MAX_PROFILES,
+                        help='Profili massimi in gallery, inclusi quelli esistenti (0 = nessun limite, '
+                             'default BULK_MAX_PROFILES)')
+    parser.add_argument('--no-quality', action='store_true',
+                        help='Salta check_quality (foto non inquadrate come la webcam)')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        parser.error(f'Cartella non trovata: {args.root}')
+
+    summary = run(args.root, args.report, args.workers, args.max_samples,
+                  args.max_profiles, not args.no_quality)
+    print(f"[BulkEnroll] Profili aggiunti: {summary['profiles_added']}, "
+          f"saltati: {summary['profiles_skipped']}, immagini accettate: {summary['images_accepted']}, "
+          f"scartate: {summary['images_rejected']}, non elaborate: {summary['images_skipped']} in {summary['elapsed_s']}s - report: {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Valuta la gallery quantizzata (float16/int8) rispetto alla ricerca float32 esatta.
+
+Le query sono campioni tenuti fuori dalla gallery: l'ultimo encoding di ogni
+profilo con almeno due campioni (o query sintetiche con --synthetic). Per ogni
+formato e dimensione della shortlist riporta memoria, accordo del top-1 e della
+decisione match/unknown, errore di distanza e latenza per query.
+
+Uso (dalla directory backend):
+    python -m tools.evaluate_quantization
+    python -m tools.evaluate_quantization --synthetic 20000 --samples 5 --rerank 1,4,16
+"""
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from services.gallery_index import ExactIndex, QuantizedIndex
+from services.gallery_store import GalleryStore
+from services.quantization import get_codec, decoded_sq_norms
+from config.settings import DEFAULT_THRESHOLD, QUANT_RERANK
+
+ENCODING_DIM = 128
+
+
+def load_gallery():
+    """(vettori, label, query, label query) dalla gallery salvata, leave-one-out per profilo."""
+    vectors, labels, queries, query_labels = [], [], [], []
+    for slot, profile in enumerate(GalleryStore().profiles()):
+        encodings = np.asarray(profile['encodings'], dtype=np.float32)
+        if len(encodings) >= 2:
+            queries.append(encodings[-1])
+            query_labels.append(slot)
+            encodings = encodings[:-1]
+        vectors.append(encodings)
+        labels.append(np.full(len(encodings), slot, dtype=np.int64))
+    if not queries:
+        return None
+    return np.concatenate(vectors), np.concatenate(labels), np.stack(queries), np.asarray(query_labels)
+
+
+def synthetic_gallery(identities, samples, count):
+    from benchmarks.ann_benchmark import make_gallery, make_queries
+    centers, vectors, labels = make_gallery(identities, samples)
+    return vectors, labels, make_queries(centers, count), None
+
+
+def search_all(index, queries):
+    """Cerca una query alla volta (come nel frame path); ritorna distanze, label e ms/query."""
+    start = time.perf_counter()
+    results = [index.search(q, k=1) for q in queries]
+    elapsed = (time.perf_counter() - start) * 1000 / len(queries)
+    dist = np.asarray([d[0, 0] for d, _ in results])
+    lab = np.asarray([l[0, 0] for _, l in results])
+    return dist, lab, elapsed
+
+
+def evaluate(vectors, labels, queries, formats, reranks, threshold):
+    exact = ExactIndex(ENCODING_DIM)
+    exact.build(vectors, labels)
+    exact_dist, exact_lab, exact_ms = search_all(exact, queries)
+    exact_match = exact_dist <= threshold
+    base_bytes = exact.vectors.nbytes + exact.sq_norms.nbytes
+
+    rows = [{'format': 'float32', 'rerank': None, 'memory_bytes': base_bytes, 'compression': 1.0,
+             'top1_agreement': 1.0, 'decision_agreement': 1.0, 'distance_error_max': 0.0,
+             'latency_ms': round(exact_ms, 3)}]
+    for name in formats:
+        codec = get_codec(name)
+        codec.train([vectors])
+        codes = codec.encode(vectors)
+        sq_norms = decoded_sq_norms(codec, codes)
+        memory = codes.nbytes + sq_norms.nbytes
+        for rerank in reranks:
+            index = QuantizedIndex.wrap(codes, sq_norms, labels, codec, lambda rows: vectors[rows], rerank)
+            dist, lab, ms = search_all(index, queries)
+            rows.append({
+                'format': name,
+                'rerank': rerank,
+                'memory_bytes': memory,
+                'compression': round(base_bytes / memory, 2),
+                'top1_agreement': round(float(np.mean(lab == exact_lab)), 4),
+                'decision_agreement': round(float(np.mean(
+                    ((dist <= threshold) == exact_match) & (~exact_match | (lab == exact_lab)))), 4),
+                'distance_error_max': round(float(np.max(np.abs(dist - exact_dist))), 6),
+                'latency_ms': round(ms, 3),
+            })
+    return {'gallery_size': len(vectors), 'queries': len(queries), 'threshold': threshold,
+            'results': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, default=0, help='Identità sintetiche (0 = gallery salvata)')
+    parser.add_argument('--samples', type=int, default=5, help='Encoding per identità sintetica')
+    parser.add_argument('--queries', type=int, default=500, help='Query sintetiche')
+    parser.add_argument('--formats', default='float16,int8')
+    parser.add_argument('--rerank', default=f'1,{QUANT_RERANK}', help='Dimensioni della shortlist')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Distanza di match')
+    parser.add_argument('--json', action='store_true', help='Output JSON invece della tabella')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        data = synthetic_gallery(args.synthetic, args.samples, args.queries)
+    else:
+        data = load_gallery()
+        if data is None:
+            print('[EvalQuant] Nessun profilo con almeno 2 campioni nella gallery (usa --synthetic)')
+            sys.exit(1)
+    vectors, labels, queries, _ = data
+
+    report = evaluate(vectors, labels, queries, [f for f in args.formats.split(',') if f],
+                      [int(x) for x in args.rerank.split(',') if x], args.threshold)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Gallery: {report['gallery_size']} encoding, {report['queries']} query, "
+          f"soglia {report['threshold']}")
+    print(f"{'format':<9}{'rerank':>7}{'MB':>9}{'x':>7}{'top1':>9}{'decision':>10}{'max Δd':>11}{'ms/query':>10}")
+    for r in report['results']:
+        rerank = '-' if r['rerank'] is None else r['rerank']
+        print(f"{r['format']:<9}{rerank:>7}{r['memory_bytes'] / 2**20:>9.2f}{r['compression']:>7.2f}"
+              f"{r['top1_agreement']:>9.4f}{r['decision_agreement']:>10.4f}"
+              f"{r['distance_error_max']:>11.6f}{r['latency_ms']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Processing offline di un file video con la stessa pipeline del server
+(detect → tracking → encode → recognize), output JSONL un record per frame.
+
+Il video viene diviso in segmenti contigui, uno per processo: ogni worker ha
+il proprio VideoProcessor (tracker incluso, QoS disattivato per la massima
+qualità) e un thread di decodifica che riempie una coda limitata, così decode
+e processing si sovrappongono. I segmenti vengono poi concatenati in ordine.
+Box e landmarks sono nelle coordinate del video sorgente (la pipeline lavora
+sul frame ridimensionato a FRAME_RESIZE_WIDTH).
+
+Uso (dalla directory backend):
+    python -m tools.process_video registrazione.mp4 --output risultati.jsonl --workers 8
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+from services.face_detector import FaceDetector
+from services.face_recognizer import FaceRecognizer
+from services.analytics_tracker import AnalyticsTracker
+from services.video_processor import VideoProcessor
+from services.enrollment_manager import EnrollmentManager
+from services.gallery_store import GalleryStore
+from config.settings import FRAME_RESIZE_WIDTH
+
+DECODE_QUEUE_SIZE = 32  # Frame decodificati in attesa per worker
+SEEK_PREROLL_FRAMES = 30  # Il seek parte così prima dell'inizio del segmento
+FACE_FIELDS = ('box', 'name', 'confidence', 'profile_id', 'track_id')
+
+
+class ThreadedDecoder:
+    """
+    Legge i frame [start, end) di un video in un thread dedicato.
+    cv2 rilascia il GIL durante la decodifica, quindi il thread lavora
+    in parallelo alla pipeline. Iterando si ottengono
+    (indice, posizione_ms, frame, decode_ms).
+
+    Il seek per frame di OpenCV non è accurato (si ferma su un keyframe o usa
+    i timestamp del container): il decoder si posiziona qualche frame prima
+    di start, ricava l'indice dei frame letti dalla loro posizione in ms e
+    decodifica in avanti fino a start. Se il seek oltrepassa start (o il video
+    non dichiara gli fps) si riparte dall'inizio saltando start frame.
+    """
+
+    def __init__(self, path, start=0, end=None, queue_size=DECODE_QUEUE_SIZE):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        capture = cv2.VideoCapture(self.path)
+        try:
+            if not capture.isOpened():
+                raise IOError(f'Impossibile aprire {self.path}')
+            index = self.start
+            while self.end is None or index < self.end:
+                t0 = time.time()
+                if index == self.start and self.start:
+                    ok, frame = self._seek(capture)
+                else:
+                    ok, frame = capture.read()
+                if not ok:
+                    break
+                decode_ms = round((time.time() - t0) * 1000, 1)
+                self.queue.put((index, capture.get(cv2.CAP_PROP_POS_MSEC), frame, decode_ms))
+                index += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            capture.release()
+            self.queue.put(None)
+
+    def _seek(self, capture):
+        """Posiziona capture su self.start; ritorna (ok, frame) come capture.read()."""
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        ok, _ = capture.read()
+        if fps > 0 and ok:
+            origin_ms = capture.get(cv2.CAP_PROP_POS_MSEC)  # Timestamp del frame 0
+            capture.set(cv2.CAP_PROP_POS_FRAMES, max(0, self.start - SEEK_PREROLL_FRAMES))
+            ok, frame = capture.read()
+            while ok:
+                index = round((capture.get(cv2.CAP_PROP_POS_MSEC) - origin_ms) * fps / 1000)
+                if index == self.start:
+                    return ok, frame
+                if index > self.start:
+                    break  # Seek oltre l'inizio del segmento
+                ok, frame = capture.read()
+
+        # Fallback esatto: decodifica sequenziale dall'inizio
+        capture.open(self.path)
+        for _ in range(self.start):
+            if not capture.grab():
+                return False, None
+        return capture.read()
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                if self.error:
+                    raise self.error
+                return
+            yield item
+
+
+def source_scale(shape):
+    """
+    Fattori (x, y) dal frame ridimensionato da VideoProcessor._preprocess al
+    frame sorgente di forma shape.
+    """
+    h, w = shape[:2]
+    if w <= FRAME_RESIZE_WIDTH:
+        return 1.0, 1.0
+    return w / FRAME_RESIZE_WIDTH, h / int(h * FRAME_RESIZE_WIDTH / w)
+
+
+def frame_record(index, position_ms, response, decode_ms, scale=(1.0, 1.0)):
+    """
+    Record JSONL di un frame: box, identità, confidenze e timing per stage.
+    scale: fattori (x, y) per riportare box e landmarks al frame sorgente.
+    """
+    sx, sy = scale
+    timing = dict(response['pipeline_timing'])
+    timing['decode'] = decode_ms  # Decodifica del video (il frame arriva già decodificato)
+    faces = []
+    for face in response['faces']:
+        record = {key: face.get(key) for key in FACE_FIELDS}
+        if record['box'] is not None:
+            x, y, w, h = record['box']
+            record['box'] = [round(x * sx), round(y * sy), round(w * sx), round(h * sy)]
+        if 'landmarks' in face:
+            record['landmarks'] = {
+                feature: [[round(px * sx), round(py * sy)] for px, py in points]
+                for feature, points in face['landmarks'].items()
+            }
+        faces.append(record)
+    return {'frame': index, 'time_ms': round(position_ms, 1), 'faces': faces, 'timing': timing}
+
+
+def process_segment(path, start, end, out_path, threshold=None, landmarks=False):
+    """Worker: processa i frame [start, end) e scrive il JSONL del segmento."""
+    recognizer = FaceRecognizer()
+    recognizer.load_profiles(GalleryStore().profiles())
+    processor = VideoProcessor(FaceDetector(), recognizer, AnalyticsTracker(persist=False),
+                               qos_enabled=False)
+    if threshold is not None:
+        processor.update_settings({'threshold': threshold})
+    processor.show_landmarks = landmarks
+
+    count = 0
+    with open(out_path, 'w', encoding='utf-8') as out:
+        for index, position_ms, frame, decode_ms in ThreadedDecoder(path, start, end):
+            response = processor.process_frame(frame)
+            if response is None:
+                continue
+            record = frame_record(index, position_ms, response, decode_ms, source_scale(frame.shape))
+            out.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+
+def split_segments(total_frames, workers):
+    """Divide [0, total_frames) in al più `workers` segmenti contigui."""
+    if total_frames <= 0:
+        return [(0, None)]  # Durata ignota: un solo segmento fino alla fine
+    workers = max(1, min(workers, total_frames))
+    bounds = [total_frames * i // workers for i in range(workers + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(workers)]
+
+
+def run(path, output, workers=0, threshold=None, landmarks=False):
+    # Eventuale migrazione della gallery legacy prima di avviare i worker
+    profiles = len(EnrollmentManager().profiles)
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f'Impossibile aprire {path}')
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+
+    workers = workers or os.cpu_count() or 1
+    segments = split_segments(total_frames, workers)
+    print(f'[Video] {path}: {total_frames} frame, {len(segments)} segmenti, {profiles} profili')
+
+    start = time.time()
+    processed = 0
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as tmp:
+        parts = [os.path.join(tmp, f'part_{i:04d}.jsonl') for i in range(len(segments))]
+        with ProcessPoolExecutor(max_workers=len(segments)) as pool:
+            futures = {
+                pool.submit(process_segment, path, seg_start, seg_end, part, threshold, landmarks): i
+                for i, ((seg_start, seg_end), part) in enumerate(zip(segments, parts))
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                processed += future.result()
+                elapsed = time.time() - start
+                sys.stderr.write(f'\r[Video] segmenti {done}/{len(segments)}, '
+                                 f'{processed} frame ({processed / max(elapsed, 1e-6):.1f} fps)')
+                sys.stderr.flush()
+        sys.stderr.write('\n')
+
+        # Concatena i segmenti nell'ordine dei frame
+        with open(output, 'w', encoding='utf-8') as out:
+            for part in parts:
+                with open(part, encoding='utf-8') as f:
+                    for line in f:
+                        out.write(line)
+
+    elapsed = time.time() - start
+    return {'frames': processed, 'elapsed_s': round(elapsed, 1),
+            'fps': round(processed / max(elapsed, 1e-6), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help='File video da processare')
+    parser.add_argument('--output', default=None, help='File JSONL (default: <video>.jsonl)')
+    parser.add_argument('--workers', type=int, default=0, help='Processi (0 = numero CPU)')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='Soglia riconoscimento in percentuale (50-99), come dal frontend')
+    parser.add_argument('--landmarks', action='store_true', help='Calcola anche i landmarks')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.video):
+        parser.error(f'File non trovato: {args.video}')
+    output = args.output or os.path.splitext(args.video)[0] + '.jsonl'
+
+    summary = run(args.video, output, args.workers, args.threshold, args.landmarks)
+    print(f"[Video] {summary['frames']} frame in {summary['elapsed_s']}s "
+          f"({summary['fps']} fps) → {output}")
+
+
+if __name__ == '__main__':
+    main()